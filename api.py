@@ -3,7 +3,7 @@
 from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form, Query, Request, Header, BackgroundTasks
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer, HTTPBearer, HTTPAuthorizationCredentials, OAuth2PasswordRequestForm
 from fastapi.routing import APIRouter
 from slowapi import Limiter
@@ -31,7 +31,14 @@ from schemas import (RecentVisit as RecentVisitSchema, UserCreate, UserLogin, Us
                      TwoFactorSetup, TwoFactorVerification, EmailTwoFactorSetup, EmailTwoFactorVerification, SendOTPRequest, VerifyOTPRequest,
                      OTPVerification, VerificationRequest, InitializeVerificationRequest, Drug, ClaimCreate, ClaimResponse, ClaimStatusUpdate,
                      MedicineResponse, ServiceResponse, ClaimDraftCreate, ClaimDraftResponse, ClaimDraftUpdate, InvestigationResponse, ZoomCodeResponse, OPDProcedureResponse, DentProcedureResponse, ENTProcedureResponse, MedicineProcedureResponse, PaediatricProcedureResponse)
-from utils import FaceComparisonSystem
+from inference_pool import inference_executor
+from face_cache import profile_embeddings
+from model_registry import model_registry
+from upload_outbox import upload_outbox
+from tariff_catalogue import tariff_catalogue
+from catalogue_search import catalogue_search
+from catalogue_usage import usage_tracker
+from timing import render_metrics, server_timing_middleware
 from security import get_password_hash, verify_password, create_access_token, decode_access_token, SECRET_KEY, ALGORITHM
 from sendd import generate_otp, send_otp_email
 from totp import TwoFactorAuth, setup_2fa, enable_2fa, verify_2fa, disable_2fa, regenerate_backup_codes
@@ -65,7 +72,6 @@ app = FastAPI()
 templates = Jinja2Templates(directory="templates")
 security = HTTPBearer()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-face_system = FaceComparisonSystem()
 limiter = Limiter(key_func=get_remote_address)
 executor = ThreadPoolExecutor()
 
@@ -76,6 +82,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 
@@ -111,8 +118,17 @@ async def db_session_middleware(request: Request, call_next):
         return JSONResponse(status_code=500, content={"detail": "Internal server error occurred."})
 
 
+# Registered last so it wraps the handlers above and times the whole request
+app.middleware("http")(server_timing_middleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 from routers import (
-    auth, users, mfa, encounters, members, claims, drafts, medicines, services, visits, dispositions
+    auth, users, mfa, encounters, members, claims, drafts, medicines, services, visits, dispositions, catalogues
 )
 from routers.ws_router import router as ws_router
 from src.expert_system import controller as expert_system_controller
@@ -128,6 +144,7 @@ app.include_router(medicines.router)
 app.include_router(services.router)
 app.include_router(visits.router)
 app.include_router(dispositions.router)
+app.include_router(catalogues.router)
 app.include_router(icd.router)
 app.include_router(investigations.router)
 app.include_router(zoom.router)
@@ -149,5 +166,22 @@ def create_health_check(app: FastAPI):
     def health():
         return {"status": "ok"}
 
+    @app.get("/health/inference")
+    def inference_health():
+        return {
+            "executor": inference_executor.stats(),
+            "profile_embeddings": profile_embeddings.stats(),
+            "models": model_registry.stats(),
+            "upload_outbox": upload_outbox.stats(),
+        }
+
+    @app.get("/health/tariffs")
+    def tariff_health():
+        return tariff_catalogue.stats()
+
+    @app.get("/health/catalogue-search")
+    def catalogue_search_health():
+        return {**catalogue_search.stats(), "usage": usage_tracker.stats()}
+
 create_health_check(app)
 
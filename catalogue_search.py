@@ -0,0 +1,327 @@
+# catalogue_search.py
+import os
+import re
+import time
+import heapq
+import hashlib
+import asyncio
+import threading
+import logging
+from bisect import bisect_left
+from decimal import Decimal
+from collections import Counter
+from itertools import chain, islice, takewhile
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, text
+
+from db import (SessionLocal, ICD10Code, Medicines, ServiceTariffs, Investigation, ZoomCode, OPDProcedure,
+                DentProcedure, ENTProcedure, MedicineProcedure, PaediatricProcedure, Disposition)
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_SEARCH_REFRESH_SECONDS = float(os.getenv("CATALOGUE_SEARCH_REFRESH_SECONDS", "300"))
+# Share of a query word's trigrams a catalogue word must contain to count as a fuzzy match
+CATALOGUE_FUZZY_MIN_SIMILARITY = float(os.getenv("CATALOGUE_FUZZY_MIN_SIMILARITY", "0.5"))
+
+# Result ranks, best first
+EXACT_CODE, CODE_PREFIX, NAME_PREFIX, TOKEN_MATCH, FUZZY_MATCH = range(5)
+
+_WORD = re.compile(r"[0-9a-z]+")
+
+
+class CatalogueSpec:
+    def __init__(self, model, code_column: str, name_column: str):
+        self.model = model
+        self.table = model.__tablename__
+        self.code_column = code_column
+        self.name_column = name_column
+        self.key_column = model.__table__.primary_key.columns.values()[0].name
+
+    def stamp_sql(self) -> str:
+        # Row count plus a hash over every column: changes on insert, delete or edit
+        columns = ", ".join(f"{c.name}::text" for c in self.model.__table__.columns)
+        return (
+            f"SELECT count(*), coalesce(sum(hashtext(concat_ws('|', {columns}))::bigint), 0) "
+            f"FROM {self.table}"
+        )
+
+
+CATALOGUES: Dict[str, CatalogueSpec] = {
+    "icd10": CatalogueSpec(ICD10Code, "icd_code", "diagnosis_description"),
+    "medicines": CatalogueSpec(Medicines, "code", "generic_name"),
+    "services": CatalogueSpec(ServiceTariffs, "code", "service"),
+    "investigations": CatalogueSpec(Investigation, "inv_code", "name"),
+    "zoom": CatalogueSpec(ZoomCode, "zoom_code", "description"),
+    "opd": CatalogueSpec(OPDProcedure, "opd_code", "name"),
+    "dent": CatalogueSpec(DentProcedure, "dent_code", "description"),
+    "ent": CatalogueSpec(ENTProcedure, "ent_code", "description"),
+    "medicine_procedures": CatalogueSpec(MedicineProcedure, "medi_code", "description"),
+    "paediatrics": CatalogueSpec(PaediatricProcedure, "paed_code", "description"),
+    "dispositions": CatalogueSpec(Disposition, "name", "description"),
+}
+
+
+def normalize(value: Optional[str]) -> str:
+    return " ".join((value or "").lower().split())
+
+
+def words(value: str) -> List[str]:
+    return _WORD.findall(value.lower())
+
+
+def trigrams(value: str) -> set:
+    """pg_trgm-style trigrams: each word padded with two leading blanks and one trailing"""
+    grams = set()
+    for word in words(value):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class _PrefixArray:
+    """Sorted (key, row) pairs; the rows whose key starts with a prefix are one contiguous run"""
+
+    def __init__(self, pairs: List[Tuple[str, int]]):
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.rows = [row for _, row in pairs]
+
+    def scan(self, prefix: str):
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            yield self.keys[i], self.rows[i]
+            i += 1
+
+
+class SearchIndex:
+    """
+    One catalogue held in memory for autocomplete.
+
+    Codes, whole names and the words of each name sit in sorted arrays so a
+    prefix is a bisect plus a walk over the matching run; a trigram index
+    covers typos and matches inside words. Results are ranked exact code >
+    code prefix > name prefix > every query word prefixing a name word >
+    trigram similarity, alphabetical within a rank.
+    """
+
+    def __init__(self, rows: Sequence[Dict[str, Any]], code_column: str, name_column: str,
+                 key_column: Optional[str] = None, version: str = ""):
+        self.rows = list(rows)
+        # Identifies the catalogue contents the index was built from (for ETags)
+        self.version = version
+        self._by_key = {str(r[key_column]): i for i, r in enumerate(self.rows)} if key_column else {}
+        dated = [i for i, r in enumerate(self.rows) if r.get("created_at") is not None]
+        self._newest = sorted(dated, key=lambda i: self.rows[i]["created_at"], reverse=True)
+        self._codes = _PrefixArray([(normalize(r[code_column]), i) for i, r in enumerate(self.rows)])
+        self._names = _PrefixArray([(normalize(r[name_column]), i) for i, r in enumerate(self.rows)])
+        self._row_words: List[List[str]] = []
+        word_rows: Dict[str, List[int]] = {}
+        for i, row in enumerate(self.rows):
+            row_words = words(f"{row[code_column] or ''} {row[name_column] or ''}")
+            self._row_words.append(row_words)
+            for word in set(row_words):
+                word_rows.setdefault(word, []).append(i)
+        self._words = _PrefixArray([(word, i) for word, rows in word_rows.items() for i in rows])
+        # Trigrams over the distinct words (far fewer than rows), mapped back to rows via word_rows
+        self._word_rows = word_rows
+        self._word_grams: Dict[str, List[str]] = {}
+        for word in word_rows:
+            for gram in trigrams(word):
+                self._word_grams.setdefault(gram, []).append(word)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def search(self, query: str, limit: int = 15) -> List[Dict[str, Any]]:
+        return [self.rows[i] for i, _ in self.ranked(query, limit)]
+
+    def get(self, keys: Sequence[str]) -> List[Dict[str, Any]]:
+        """Rows by primary key (as text), in the order given; unknown keys are skipped"""
+        return [self.rows[self._by_key[key]] for key in keys if key in self._by_key]
+
+    def newest(self, limit: int = 15, exclude: Sequence[str] = ()) -> List[Dict[str, Any]]:
+        """Most recently added rows, skipping the keys in exclude"""
+        skip = {self._by_key[key] for key in exclude if key in self._by_key}
+        return [self.rows[i] for i in islice((i for i in self._newest if i not in skip), limit)]
+
+    def ranked(self, query: str, limit: int = 15) -> List[Tuple[int, int]]:
+        """(row, rank) pairs for the best `limit` matches"""
+        term = normalize(query)
+        if not term or limit <= 0:
+            return []
+        hits: Dict[int, int] = {}
+
+        def take(rank: int, rows) -> bool:
+            for row in rows:
+                if row not in hits:
+                    hits[row] = rank
+                    if len(hits) >= limit:
+                        return True
+            return False
+
+        exact = (row for _, row in takewhile(lambda pair: pair[0] == term, self._codes.scan(term)))
+        if take(EXACT_CODE, exact):
+            return list(hits.items())
+        if take(CODE_PREFIX, (row for _, row in self._codes.scan(term))):
+            return list(hits.items())
+        if take(NAME_PREFIX, (row for _, row in self._names.scan(term))):
+            return list(hits.items())
+        if take(TOKEN_MATCH, self._token_matches(term)):
+            return list(hits.items())
+        take(FUZZY_MATCH, self._fuzzy_matches(term, limit - len(hits), exclude=hits))
+        return list(hits.items())
+
+    def _token_matches(self, term: str):
+        query_words = words(term)
+        if not query_words:
+            return
+        # Walk the run of the longest (most selective) word, check the rest per row
+        query_words.sort(key=len, reverse=True)
+        first, rest = query_words[0], query_words[1:]
+        seen = set()
+        for _, row in self._words.scan(first):
+            if row in seen:
+                continue
+            seen.add(row)
+            row_words = self._row_words[row]
+            if all(any(w.startswith(q) for w in row_words) for q in rest):
+                yield row
+
+    def _fuzzy_matches(self, term: str, limit: int, exclude: Dict[int, int]):
+        """Rows with a similar word for every query word, most similar first"""
+        query_words = sorted(set(words(term)))
+        if not query_words:
+            return []
+        if len(query_words) == 1:
+            # Rows come straight off the word lists, best word first: no per-row scoring
+            similar = self._similar_words(query_words[0])
+            ordered = sorted(similar, key=lambda word: (-similar[word], word))
+            return (row for word in ordered for row in self._word_rows[word] if row not in exclude)
+
+        scores: Optional[Dict[int, float]] = None
+        for query_word in query_words:
+            word_scores: Dict[int, float] = {}
+            for word, similarity in self._similar_words(query_word).items():
+                for row in self._word_rows[word]:
+                    if similarity > word_scores.get(row, 0.0):
+                        word_scores[row] = similarity
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {row: score + word_scores[row] for row, score in scores.items() if row in word_scores}
+            if not scores:
+                return []
+        best = heapq.nsmallest(limit, ((-score, row) for row, score in scores.items() if row not in exclude))
+        return [row for _, row in best]
+
+    def _similar_words(self, query_word: str) -> Dict[str, float]:
+        """Catalogue words sharing enough of query_word's trigrams, with the share they contain"""
+        query_grams = trigrams(query_word)
+        if len(query_grams) < 4:
+            # Too short to judge similarity: only take it as a prefix
+            return {word: 1.0 for word, _ in self._words.scan(query_word)}
+        shared = Counter(chain.from_iterable(self._word_grams.get(gram, ()) for gram in query_grams))
+        needed = CATALOGUE_FUZZY_MIN_SIMILARITY * len(query_grams)
+        return {word: count / len(query_grams) for word, count in shared.items() if count >= needed}
+
+
+class CatalogueSearch:
+    """
+    Search indexes for every code catalogue, shared by the catalogue routers.
+
+    Same refresh scheme as the tariff catalogue: a cheap stamp per table is
+    compared on every refresh and only changed tables are rebuilt; a rebuilt
+    index is swapped in whole, so searches never see a half-built one.
+    """
+
+    def __init__(self, refresh_seconds: float = CATALOGUE_SEARCH_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._indexes: Dict[str, SearchIndex] = {}
+        self._stamps: Dict[str, Tuple] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.loaded_at: Optional[float] = None
+        self.reloads = 0
+
+    def search(self, name: str, query: str, limit: int = 15) -> List[Dict[str, Any]]:
+        return self.index(name).search(query, limit)
+
+    def key_of(self, name: str, row: Dict[str, Any]) -> str:
+        return str(row[CATALOGUES[name].key_column])
+
+    def index(self, name: str) -> SearchIndex:
+        index = self._indexes.get(name)
+        if index is None:
+            self.refresh([name])
+            index = self._indexes[name]
+        return index
+
+    def refresh(self, names: Optional[Sequence[str]] = None, force: bool = False) -> List[str]:
+        """Rebuild the named catalogues (default all) whose stamp changed; returns their names"""
+        with self._lock:
+            db = SessionLocal()
+            try:
+                changed = []
+                for name in names or CATALOGUES:
+                    spec = CATALOGUES[name]
+                    stamp = tuple(db.execute(text(spec.stamp_sql())).fetchone())
+                    if not force and name in self._indexes and self._stamps.get(name) == stamp:
+                        continue
+                    rows = [
+                        {key: _plain(value) for key, value in row.items()}
+                        for row in db.execute(
+                            select(spec.model.__table__).order_by(spec.model.__table__.c[spec.code_column])
+                        ).mappings()
+                    ]
+                    version = hashlib.sha1(repr(stamp).encode()).hexdigest()[:16]
+                    index = SearchIndex(rows, spec.code_column, spec.name_column, spec.key_column, version)
+                    self._indexes = {**self._indexes, name: index}
+                    self._stamps[name] = stamp
+                    changed.append(name)
+            finally:
+                db.close()
+            if changed:
+                self.reloads += 1
+                logger.info(f"Catalogue search indexes rebuilt: {', '.join(changed)}")
+            self.loaded_at = time.time()
+            return changed
+
+    def start(self) -> None:
+        """Build in the background and keep refreshing every refresh_seconds"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Catalogue search refresh failed: {str(e)}")
+            await asyncio.sleep(self.refresh_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "refresh_seconds": self.refresh_seconds,
+            "entries": {name: len(index) for name, index in self._indexes.items()},
+        }
+
+
+def _plain(value: Any) -> Any:
+    return float(value) if isinstance(value, Decimal) else value
+
+
+catalogue_search = CatalogueSearch()
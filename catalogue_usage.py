@@ -0,0 +1,171 @@
+# catalogue_usage.py
+import os
+import asyncio
+import threading
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from db import SessionLocal, CatalogueUsage
+from catalogue_search import catalogue_search
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_USAGE_FLUSH_SECONDS = float(os.getenv("CATALOGUE_USAGE_FLUSH_SECONDS", "10"))
+# Pending (catalogue, item) entries kept across failed flushes before new hits are dropped
+CATALOGUE_USAGE_MAX_PENDING = int(os.getenv("CATALOGUE_USAGE_MAX_PENDING", "50000"))
+
+_Key = Tuple[str, str]
+
+
+class UsageTracker:
+    """
+    "Recently used" tracking for the catalogue searches.
+
+    A search records the rows it returned in an in-memory counter and goes
+    on without touching the database. A background task flushes the
+    aggregated hits every CATALOGUE_USAGE_FLUSH_SECONDS as one upsert into
+    ``catalogue_usage``, so a burst of keystrokes costs one write per item
+    instead of an UPDATE per keystroke. Hits from a failed flush are merged
+    back and retried on the next one.
+    """
+
+    def __init__(self, flush_seconds: float = CATALOGUE_USAGE_FLUSH_SECONDS,
+                 max_pending: int = CATALOGUE_USAGE_MAX_PENDING):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._pending: Dict[_Key, List[Any]] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.flushed = 0
+        self.dropped = 0
+
+    def record(self, name: str, rows: Sequence[Dict[str, Any]]) -> None:
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            for row in rows:
+                key = (name, catalogue_search.key_of(name, row))
+                entry = self._pending.get(key)
+                if entry is None:
+                    if len(self._pending) >= self.max_pending:
+                        self.dropped += 1
+                        continue
+                    entry = self._pending[key] = [0, now]
+                entry[0] += 1
+                entry[1] = now
+                self.recorded += 1
+
+    def recent(self, db: Session, name: str, limit: int = 15) -> List[Dict[str, Any]]:
+        """
+        Most recently used rows of a catalogue, newest first, including hits
+        not flushed yet; topped up with the newest catalogue rows when fewer
+        than limit have been used.
+        """
+        stored = db.query(CatalogueUsage.item_key, CatalogueUsage.last_used_at).filter(
+            CatalogueUsage.catalogue == name
+        ).order_by(CatalogueUsage.last_used_at.desc()).limit(limit).all()
+        last_used: Dict[str, datetime] = {item_key: used_at for item_key, used_at in stored}
+        with self._lock:
+            for (catalogue, item_key), (_, used_at) in self._pending.items():
+                if catalogue == name and (item_key not in last_used or used_at > last_used[item_key]):
+                    last_used[item_key] = used_at
+        keys = sorted(last_used, key=last_used.get, reverse=True)[:limit]
+
+        index = catalogue_search.index(name)
+        rows = index.get(keys)
+        if len(rows) < limit:
+            rows.extend(index.newest(limit - len(rows), exclude=keys))
+        return rows
+
+    # Flushing
+
+    def flush(self) -> int:
+        """Write pending hits; returns the number of usage rows upserted"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        # Sorted so concurrent workers lock usage rows in the same order
+        values = [
+            {"catalogue": name, "item_key": item_key, "hits": hits, "last_used_at": used_at}
+            for (name, item_key), (hits, used_at) in sorted(pending.items())
+        ]
+        table = CatalogueUsage.__table__
+        stmt = pg_insert(table).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["catalogue", "item_key"],
+            set_={
+                "hits": table.c.hits + stmt.excluded.hits,
+                "last_used_at": func.greatest(table.c.last_used_at, stmt.excluded.last_used_at),
+            },
+        )
+        db = SessionLocal()
+        try:
+            db.execute(stmt)
+            db.commit()
+        except Exception:
+            db.rollback()
+            self._merge_back(pending)
+            raise
+        finally:
+            db.close()
+        self.flushed += len(values)
+        return len(values)
+
+    def _merge_back(self, pending: Dict[_Key, List[Any]]) -> None:
+        with self._lock:
+            for key, (hits, used_at) in pending.items():
+                entry = self._pending.get(key)
+                if entry is None:
+                    if len(self._pending) >= self.max_pending:
+                        self.dropped += hits
+                        continue
+                    self._pending[key] = [hits, used_at]
+                else:
+                    entry[0] += hits
+                    entry[1] = max(entry[1], used_at)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Last flush so a restart loses nothing recorded before it
+        try:
+            await asyncio.to_thread(self.flush)
+        except Exception as e:
+            logger.error(f"Final catalogue usage flush failed: {str(e)}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await asyncio.to_thread(self.flush)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Catalogue usage flush failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "flush_seconds": self.flush_seconds,
+        }
+
+
+usage_tracker = UsageTracker()
@@ -0,0 +1,256 @@
+# claim_export.py
+import os
+import io
+import csv
+import json
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, text
+
+from db import SessionLocal, Claim
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip of the server-side cursor
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", "2000"))
+# Statement timeout for exports in milliseconds (0 disables it for the export transaction)
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.getenv("EXPORT_STATEMENT_TIMEOUT_MS", "0"))
+# Bytes buffered before a CSV/NDJSON chunk is sent, and rows per Parquet row group
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(256 * 1024)))
+EXPORT_PARQUET_ROW_GROUP = int(os.getenv("EXPORT_PARQUET_ROW_GROUP", "20000"))
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# (column, type) of every exported claim row
+CLAIM_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ("encounter_token", "str"), ("created_at", "timestamp"), ("status", "str"), ("reason", "str"),
+    ("user_id", "int"), ("hospital_name", "str"), ("location", "str"), ("patient_name", "str"), ("age", "int"),
+    ("service_type", "list"), ("service_outcome", "str"), ("service_type_1", "str"), ("service_type_2", "str"),
+    ("specialties", "list"), ("type_of_attendance", "str"), ("pharmacy", "bool"),
+    ("diagnosis_total", "float"), ("medical_procedures_total", "float"), ("lab_tests_total", "float"),
+    ("drugs_total", "float"), ("expected_payout", "float"), ("adjusted_amount", "float"), ("total_payout", "float"),
+)
+
+# With lines=<kind> each claim becomes one row per line item, with these fields prefixed line_
+LINE_COLUMNS: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "diagnosis": (("ICD10", "str"), ("GRDG", "str"), ("description", "str"), ("primary", "bool"), ("tariff", "float")),
+    "drugs": (("code", "str"), ("generic_name", "str"), ("dosage", "str"), ("frequency", "int"),
+              ("duration", "str"), ("quantity", "int"), ("tariff", "float"), ("total", "float")),
+    "medical_procedures": (("code", "str"), ("service", "str"), ("tariff", "float")),
+    "lab_tests": (("code", "str"), ("service", "str"), ("tariff", "float")),
+}
+
+
+def export_columns(lines: Optional[str] = None) -> List[Tuple[str, str]]:
+    columns = list(CLAIM_COLUMNS)
+    if lines:
+        columns.append(("line_no", "int"))
+        columns.extend((f"line_{name}", kind) for name, kind in LINE_COLUMNS[lines])
+    return columns
+
+
+def iter_claim_rows(status: Optional[Sequence[str]] = None, start_date: Optional[datetime] = None,
+                    end_date: Optional[datetime] = None, user_id: Optional[int] = None,
+                    hospital_name: Optional[str] = None, lines: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Claims matching the filters, oldest first, read through a server-side
+    cursor so only EXPORT_YIELD_PER rows are in memory at a time.
+
+    Uses its own session: the generator outlives the request's dependencies.
+    """
+    claim_names = [name for name, _ in CLAIM_COLUMNS]
+    columns = [getattr(Claim, name) for name in claim_names]
+    if lines:
+        columns.append(getattr(Claim, lines))
+    stmt = select(*columns)
+    if status:
+        stmt = stmt.where(Claim.status.in_(list(status)))
+    if start_date:
+        stmt = stmt.where(Claim.created_at >= start_date)
+    if end_date:
+        stmt = stmt.where(Claim.created_at <= end_date)
+    if user_id:
+        stmt = stmt.where(Claim.user_id == user_id)
+    if hospital_name:
+        stmt = stmt.where(Claim.hospital_name == hospital_name)
+    stmt = stmt.order_by(Claim.created_at, Claim.encounter_token).execution_options(
+        stream_results=True, yield_per=EXPORT_YIELD_PER
+    )
+
+    db = SessionLocal()
+    exported = 0
+    try:
+        db.execute(text(f"SET LOCAL statement_timeout = {int(EXPORT_STATEMENT_TIMEOUT_MS)}"))
+        line_fields = [name for name, _ in LINE_COLUMNS[lines]] if lines else []
+        for row in db.execute(stmt):
+            record = {name: _plain(value) for name, value in zip(claim_names, row)}
+            if not lines:
+                exported += 1
+                yield record
+                continue
+            items = row[-1] or []
+            if isinstance(items, str):
+                items = json.loads(items)
+            for line_no, item in enumerate(items, 1):
+                line = dict(record)
+                line["line_no"] = line_no
+                for field in line_fields:
+                    line[f"line_{field}"] = _plain(item.get(field))
+                exported += 1
+                yield line
+    finally:
+        db.rollback()
+        db.close()
+        logger.info(f"Claim export finished after {exported} rows")
+
+
+def csv_chunks(rows: Iterator[Dict[str, Any]], columns: List[Tuple[str, str]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    names = [name for name, _ in columns]
+    writer.writerow(names)
+    for row in rows:
+        writer.writerow([_csv_value(row.get(name)) for name in names])
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def ndjson_chunks(rows: Iterator[Dict[str, Any]]) -> Iterator[bytes]:
+    parts: List[str] = []
+    size = 0
+    for row in rows:
+        line = json.dumps(row, default=str) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(parts).encode("utf-8")
+            parts, size = [], 0
+    if parts:
+        yield "".join(parts).encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands what was written back as chunks"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_chunks(rows: Iterator[Dict[str, Any]], columns: List[Tuple[str, str]]) -> Iterator[bytes]:
+    """Parquet written a row group at a time, so memory is bounded by EXPORT_PARQUET_ROW_GROUP rows"""
+    if pyarrow is None:
+        raise RuntimeError("Parquet export requires pyarrow")
+    schema = pyarrow.schema([(name, _arrow_type(kind)) for name, kind in columns])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        batch: Dict[str, List[Any]] = {name: [] for name, _ in columns}
+        count = 0
+        for row in rows:
+            for name, kind in columns:
+                batch[name].append(_coerce(row.get(name), kind))
+            count += 1
+            if count >= EXPORT_PARQUET_ROW_GROUP:
+                writer.write_table(pyarrow.Table.from_pydict(batch, schema=schema))
+                batch = {name: [] for name, _ in columns}
+                count = 0
+                yield sink.drain()
+        if count:
+            writer.write_table(pyarrow.Table.from_pydict(batch, schema=schema))
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_chunks(fmt: str, rows: Iterator[Dict[str, Any]], columns: List[Tuple[str, str]]) -> Iterator[bytes]:
+    if fmt == "csv":
+        return csv_chunks(rows, columns)
+    if fmt == "ndjson":
+        return ndjson_chunks(rows)
+    if fmt == "parquet":
+        return parquet_chunks(rows, columns)
+    raise ValueError(f"Unknown export format: {fmt}")
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return ";".join(str(v) for v in value)
+    return value
+
+
+def _arrow_type(kind: str):
+    return {
+        "str": pyarrow.string(),
+        "int": pyarrow.int64(),
+        "float": pyarrow.float64(),
+        "bool": pyarrow.bool_(),
+        "timestamp": pyarrow.timestamp("us"),
+        "list": pyarrow.list_(pyarrow.string()),
+    }[kind]
+
+
+def _coerce(value: Any, kind: str) -> Any:
+    """Best-effort conversion of a JSON line value to its Parquet column type (None when it doesn't fit)"""
+    if value is None:
+        return None
+    try:
+        if kind == "str":
+            return str(value)
+        if kind == "int":
+            return int(value)
+        if kind == "float":
+            return float(value)
+        if kind == "bool":
+            return bool(value)
+        if kind == "timestamp":
+            return datetime.fromisoformat(value) if isinstance(value, str) else value
+        if kind == "list":
+            return [str(v) for v in value]
+    except (TypeError, ValueError):
+        return None
+    return value
@@ -0,0 +1,237 @@
+# claim_stats.py
+import logging
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from db import Claim, ClaimStat, SummaryBuild
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ("pending", "approved", "flagged", "rejected")
+
+# The backfill is recorded in summary_builds under this name; until then summarize() counts claims
+SUMMARY_BUILD_NAME = "claim_stats"
+# Held for the backfill's transaction, so one worker runs it
+SUMMARY_BUILD_LOCK = 7294015
+_built = False
+
+# Same upsert for the psycopg2 adjudication worker (psycopg2.extras.execute_values)
+PSYCOPG2_UPSERT_SQL = """
+    INSERT INTO claim_stats (day, user_id, hospital_name, status, claim_count, expected_total, payout_total)
+    VALUES %s
+    ON CONFLICT (day, user_id, hospital_name, status) DO UPDATE SET
+        claim_count = claim_stats.claim_count + EXCLUDED.claim_count,
+        expected_total = claim_stats.expected_total + EXCLUDED.expected_total,
+        payout_total = claim_stats.payout_total + EXCLUDED.payout_total
+"""
+
+_REBUILD_SQL = """
+    INSERT INTO claim_stats (day, user_id, hospital_name, status, claim_count, expected_total, payout_total)
+    SELECT created_at::date, user_id, hospital_name, status,
+           count(*), coalesce(sum(expected_payout), 0), coalesce(sum(total_payout), 0)
+    FROM claims
+    GROUP BY 1, 2, 3, 4
+"""
+
+_Key = Tuple[date, int, str, str]
+
+
+class StatsDelta:
+    """
+    Changes to the claim counters from one transaction.
+
+    Collect the claims a write adds, removes or moves between statuses, then
+    apply() in the same transaction as the write so the counters commit or
+    roll back with it.
+    """
+
+    def __init__(self):
+        self._deltas: Dict[_Key, List[float]] = {}
+
+    def add(self, created_at: datetime, user_id: int, hospital_name: str, status: str,
+            expected_payout: Optional[float] = None, total_payout: Optional[float] = None, sign: int = 1) -> None:
+        key = (_day(created_at), user_id, hospital_name or "", status)
+        delta = self._deltas.setdefault(key, [0, 0.0, 0.0])
+        delta[0] += sign
+        delta[1] += sign * float(expected_payout or 0)
+        delta[2] += sign * float(total_payout or 0)
+
+    def remove(self, created_at: datetime, user_id: int, hospital_name: str, status: str,
+               expected_payout: Optional[float] = None, total_payout: Optional[float] = None) -> None:
+        self.add(created_at, user_id, hospital_name, status, expected_payout, total_payout, sign=-1)
+
+    def move(self, created_at: datetime, user_id: int, hospital_name: str, old_status: str, new_status: str,
+             expected_payout: Optional[float] = None, old_payout: Optional[float] = None,
+             new_payout: Optional[float] = None) -> None:
+        self.remove(created_at, user_id, hospital_name, old_status, expected_payout, old_payout)
+        self.add(created_at, user_id, hospital_name, new_status, expected_payout, new_payout)
+
+    def rows(self) -> List[Tuple]:
+        # Sorted so concurrent transactions lock counter rows in the same order
+        return [
+            (*key, count, expected, payout)
+            for key, (count, expected, payout) in sorted(self._deltas.items())
+            if count or expected or payout
+        ]
+
+    def apply(self, db: Session) -> None:
+        rows = self.rows()
+        if not rows:
+            return
+        table = ClaimStat.__table__
+        stmt = pg_insert(table).values([
+            dict(zip(("day", "user_id", "hospital_name", "status", "claim_count", "expected_total", "payout_total"), row))
+            for row in rows
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["day", "user_id", "hospital_name", "status"],
+            set_={
+                "claim_count": table.c.claim_count + stmt.excluded.claim_count,
+                "expected_total": table.c.expected_total + stmt.excluded.expected_total,
+                "payout_total": table.c.payout_total + stmt.excluded.payout_total,
+            },
+        )
+        db.execute(stmt)
+        self._deltas.clear()
+
+    def apply_psycopg2(self, cursor) -> None:
+        import psycopg2.extras
+        rows = self.rows()
+        if rows:
+            psycopg2.extras.execute_values(cursor, PSYCOPG2_UPSERT_SQL, rows)
+        self._deltas.clear()
+
+
+def is_built(db: Session) -> bool:
+    """Whether the backfill has finished; once it has, every claim write keeps the counters current"""
+    global _built
+    if not _built:
+        _built = db.execute(
+            text("SELECT EXISTS (SELECT 1 FROM summary_builds WHERE name = :name)"), {"name": SUMMARY_BUILD_NAME}
+        ).scalar()
+    return _built
+
+
+def rebuild(db: Session) -> int:
+    """
+    Recount everything from claims and record the build; blocks claim writes
+    for the duration. Returns counter rows written.
+    """
+    global _built
+    db.execute(text("LOCK TABLE claims IN SHARE MODE"))
+    db.execute(text("DELETE FROM claim_stats"))
+    written = db.execute(text(_REBUILD_SQL)).rowcount
+    now = datetime.utcnow()
+    db.execute(
+        pg_insert(SummaryBuild.__table__)
+        .values(name=SUMMARY_BUILD_NAME, built_at=now)
+        .on_conflict_do_update(index_elements=["name"], set_={"built_at": now})
+    )
+    db.commit()
+    _built = True
+    logger.info(f"Rebuilt claim_stats: {written} counter rows")
+    return written
+
+
+def ensure_built(db: Session) -> bool:
+    """
+    Backfill the counters unless summary_builds says it is done; one worker
+    runs it, the others return straight away. Returns whether this call
+    built them.
+    """
+    if is_built(db):
+        return False
+    if not db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": SUMMARY_BUILD_LOCK}).scalar():
+        db.rollback()
+        return False
+    # Another worker may have finished between the check and the lock
+    if is_built(db):
+        db.rollback()
+        return False
+    rebuild(db)
+    return True
+
+
+def _counters(db: Session):
+    """claim_stats, or the same counts grouped from claims while the backfill hasn't finished"""
+    if is_built(db):
+        return ClaimStat.__table__
+    keys = (func.date(Claim.created_at), Claim.user_id, func.coalesce(Claim.hospital_name, ""), Claim.status)
+    return select(
+        keys[0].label("day"),
+        keys[1],
+        keys[2].label("hospital_name"),
+        keys[3],
+        func.count().label("claim_count"),
+        func.coalesce(func.sum(Claim.expected_payout), 0).label("expected_total"),
+        func.coalesce(func.sum(Claim.total_payout), 0).label("payout_total"),
+    ).group_by(*keys).subquery("claim_counts")
+
+
+def summarize(db: Session, user_id: Optional[int] = None, hospital_name: Optional[str] = None,
+              start_date: Optional[date] = None, end_date: Optional[date] = None,
+              group_by: Optional[str] = None) -> Dict[str, Any]:
+    """Totals per status (and per group_by value) from the counters, without touching claims once they are built"""
+    stats = _counters(db).c
+    group_column = {"day": stats.day, "user_id": stats.user_id,
+                    "hospital_name": stats.hospital_name}.get(group_by)
+    columns = [
+        stats.status,
+        func.sum(stats.claim_count),
+        func.sum(stats.expected_total),
+        func.sum(stats.payout_total),
+    ]
+    if group_column is not None:
+        columns.insert(0, group_column)
+    query = db.query(*columns)
+    if user_id is not None:
+        query = query.filter(stats.user_id == user_id)
+    if hospital_name is not None:
+        query = query.filter(stats.hospital_name == hospital_name)
+    if start_date is not None:
+        query = query.filter(stats.day >= start_date)
+    if end_date is not None:
+        query = query.filter(stats.day <= end_date)
+    group = [stats.status] if group_column is None else [group_column, stats.status]
+    rows = query.group_by(*group).all()
+
+    def empty() -> Dict[str, Dict[str, float]]:
+        return {status: {"count": 0, "expected_total": 0.0, "payout_total": 0.0} for status in STATUSES}
+
+    totals = empty()
+    groups: Dict[Any, Dict[str, Dict[str, float]]] = {}
+    for row in rows:
+        if group_column is not None:
+            group_value, row = row[0], row[1:]
+        status, count, expected, payout = row
+        targets = [totals]
+        if group_column is not None:
+            targets.append(groups.setdefault(group_value, empty()))
+        for target in targets:
+            bucket = target.setdefault(status, {"count": 0, "expected_total": 0.0, "payout_total": 0.0})
+            bucket["count"] += int(count or 0)
+            bucket["expected_total"] = round(bucket["expected_total"] + float(expected or 0), 2)
+            bucket["payout_total"] = round(bucket["payout_total"] + float(payout or 0), 2)
+
+    result: Dict[str, Any] = {
+        "total": sum(bucket["count"] for bucket in totals.values()),
+        "by_status": totals,
+    }
+    if group_column is not None:
+        result["groups"] = [
+            {group_by: str(value) if isinstance(value, date) else value, "by_status": buckets}
+            for value, buckets in sorted(groups.items(), key=lambda item: str(item[0]))
+        ]
+    return result
+
+
+def _day(created_at) -> date:
+    if isinstance(created_at, datetime):
+        return created_at.date()
+    if isinstance(created_at, date):
+        return created_at
+    return datetime.utcnow().date()
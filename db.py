@@ -1,6 +1,6 @@
 import uuid
 import datetime
-from sqlalchemy import create_engine, Column, String, DateTime, ForeignKey, Index, Integer, Boolean, JSON, Text, Float, TIMESTAMP, Numeric
+from sqlalchemy import create_engine, text, Column, String, Date, DateTime, ForeignKey, Index, Integer, Boolean, JSON, Text, Float, TIMESTAMP, Numeric, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from databases import Database
@@ -77,6 +77,8 @@ class Claim(Base):
         Index('idx_claim_encounter', 'encounter_token'),
         Index('idx_claim_created_date', 'created_at'),
         Index('idx_claim_status', 'status'),
+        # Keyset pagination of status lists: WHERE status = ? ORDER BY created_at DESC
+        Index('idx_claim_status_created', 'status', 'created_at'),
     )
 
 
@@ -135,6 +137,35 @@ class ClaimNotification(Base):
     id = Column(Integer, primary_key=True, index=True)
     status = Column(String, unique=True, index=True)  
     count = Column(Integer, default=0)
+
+
+class ClaimStat(Base):
+    """Claims submitted on a day by a user/hospital that are currently in a status, with their totals"""
+    __tablename__ = "claim_stats"
+
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    hospital_name = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    claim_count = Column(Integer, nullable=False, default=0)
+    expected_total = Column(Float, nullable=False, default=0)
+    payout_total = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('idx_claim_stats_hospital_day', 'hospital_name', 'day'),
+    )
+
+
+class ClaimLease(Base):
+    """A pending claim an assistant worker holds or is backing off on (managed by gpt.ClaimsProcessor)"""
+    __tablename__ = "claim_leases"
+
+    encounter_token = Column(String, ForeignKey('claims.encounter_token', ondelete='CASCADE'), primary_key=True)
+    worker_id = Column(String, nullable=True)
+    available_at = Column(TIMESTAMP, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    last_error = Column(Text, nullable=True)
+    gave_up = Column(Boolean, nullable=False, default=False, server_default=text('false'))
     
 
 class Disposition(Base):
@@ -266,6 +297,20 @@ class ServiceTariffs(Base):
     created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
 
 
+class CatalogueUsage(Base):
+    """How often and how recently a catalogue entry was picked from search; item_key is its primary key as text"""
+    __tablename__ = "catalogue_usage"
+
+    catalogue = Column(String(40), primary_key=True)
+    item_key = Column(String(50), primary_key=True)
+    hits = Column(Integer, nullable=False, default=0)
+    last_used_at = Column(TIMESTAMP(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index('idx_catalogue_usage_recent', 'catalogue', 'last_used_at'),
+    )
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -323,6 +368,43 @@ class Member(Base):
     )
 
 
+class ProfileEmbedding(Base):
+    __tablename__ = "profile_embeddings"
+
+    membership_id = Column(String, ForeignKey('members.membership_id'), primary_key=True, nullable=False, index=True)
+    image_url = Column(String, nullable=False)  # Profile image the embedding was computed from
+    etag = Column(String, nullable=True)  # ETag returned when the image was fetched
+    model_version = Column(Integer, nullable=False)
+    embedding = Column(LargeBinary, nullable=False)  # float32 bytes
+    detection_score = Column(Float, nullable=False)
+    bbox = Column(JSON, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, nullable=False)
+
+
+class PendingUpload(Base):
+    """Outbox row for an image spooled to local disk and not yet in object storage"""
+    __tablename__ = "pending_uploads"
+
+    id = Column(Integer, primary_key=True, index=True)
+    object_key = Column(String, nullable=False)
+    spool_path = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    host = Column(String, nullable=False)  # Only this host has the spooled file
+    verification_token_id = Column(UUID(as_uuid=True), ForeignKey('verification_tokens.id'), nullable=True)
+    target_column = Column(String, nullable=True)  # compare_image_url / encounter_image_url
+    status = Column(String, nullable=False, default="pending")  # pending, uploaded, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    uploaded_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('idx_pending_uploads_due', 'status', 'host', 'next_attempt_at'),
+    )
+
+
 class VerificationToken(Base):
     __tablename__ = "verification_tokens"
     
@@ -434,6 +516,7 @@ class RecentVisit(Base):
     __table_args__ = (
         Index('idx_visit_date_range', 'visit_date', 'membership_id'),
         Index('idx_user_visits', 'user_id'),
+        Index('idx_user_visit_date', 'user_id', 'visit_date'),
     )
     
     @classmethod
@@ -455,6 +538,57 @@ class RecentVisit(Base):
         )
 
 
+class MemberActivitySummary(Base):
+    """Latest visit, verification and recent encounters per member, kept current by the encounter endpoints"""
+    __tablename__ = "member_activity_summary"
+
+    membership_id = Column(String, ForeignKey('members.membership_id'), primary_key=True)
+    last_visit_at = Column(DateTime, nullable=True)
+    last_verification_token = Column(String, nullable=True)
+    last_verification_at = Column(DateTime, nullable=True)
+    final_verification_status = Column(Boolean, nullable=True)
+    disposition_name = Column(String, nullable=True)
+    # Last MEMBER_RECENT_ENCOUNTERS encounters, newest first
+    recent_encounters = Column(JSON, nullable=False, default=list)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+
+class SummaryBuild(Base):
+    """Summary tables whose one-off backfill has finished; written in the backfill's own transaction"""
+    __tablename__ = "summary_builds"
+
+    name = Column(String(64), primary_key=True)
+    built_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+
+# Held by the worker creating indexes at startup; the others skip rather than queue behind it
+INDEX_BUILD_LOCK = 7294013
+
+
+def create_indexes_concurrently(indexes):
+    """
+    Create indexes that create_all won't add to existing tables: name ->
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS name ...". One worker at a time
+    builds them; an index left invalid by an interrupted build is dropped and
+    built again. Returns False when another worker holds the lock.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # Try, don't wait: a session waiting on the lock holds a snapshot the concurrent build waits for
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": INDEX_BUILD_LOCK}).scalar():
+            return False
+        try:
+            for name, ddl in indexes.items():
+                valid = conn.execute(
+                    text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name}
+                ).scalar()
+                if valid is False:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                conn.execute(text(ddl))
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INDEX_BUILD_LOCK})
+    return True
+
+
 # Helper function to get database session
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,189 @@
+# face_cache.py
+import os
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from db import SessionLocal, ProfileEmbedding
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the detection/recognition pipeline changes in a way that
+# makes previously stored embeddings incomparable with fresh ones.
+# 2: images are fed to the models as BGR instead of RGB
+EMBEDDING_VERSION = 2
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_EMBEDDING_CACHE_SIZE", "4096"))
+# After this long an entry is revalidated against the image's ETag.
+PROFILE_REVALIDATE_AFTER = timedelta(
+    seconds=int(os.getenv("PROFILE_EMBEDDING_REVALIDATE_SECONDS", str(7 * 24 * 3600)))
+)
+
+
+@dataclass
+class ProfileFace:
+    membership_id: str
+    image_url: str
+    embedding: np.ndarray
+    detection_score: float
+    bbox: List[float]
+    etag: Optional[str] = None
+    updated_at: Optional[datetime] = None
+
+    def is_stale(self) -> bool:
+        if self.updated_at is None:
+            return True
+        return datetime.utcnow() - self.updated_at > PROFILE_REVALIDATE_AFTER
+
+    def face_info(self) -> Dict:
+        """Return the same structure as FaceComparisonSystem.get_face_info"""
+        bbox = self.bbox
+        width = bbox[2] - bbox[0]
+        height = bbox[3] - bbox[1]
+        return {
+            'bbox': list(bbox),
+            'embedding': self.embedding,
+            'detection_score': self.detection_score,
+            'facial_features': {
+                'norm_l2': float(np.linalg.norm(self.embedding)),
+                'bbox_area': float(width * height),
+                'bbox_aspect_ratio': float(width / height)
+            }
+        }
+
+
+class ProfileEmbeddingStore:
+    """
+    Two-tier store for member profile embeddings.
+
+    An in-process LRU sits in front of the ``profile_embeddings`` table so that
+    a verification only has to run the webcam frame through the model. Entries
+    are keyed by membership_id and only hit when the stored image URL and model
+    version still match.
+    """
+
+    def __init__(self, max_entries: int = PROFILE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, ProfileFace]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, membership_id: str, image_url: str) -> Optional[ProfileFace]:
+        with self._lock:
+            entry = self._entries.get(membership_id)
+            if entry is not None and entry.image_url == image_url:
+                self._entries.move_to_end(membership_id)
+                self.hits += 1
+                return entry
+
+        entry = self._load(membership_id, image_url)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(entry)
+        return entry
+
+    def put(self, membership_id: str, image_url: str, face_info: Dict,
+            etag: Optional[str] = None) -> ProfileFace:
+        entry = ProfileFace(
+            membership_id=membership_id,
+            image_url=image_url,
+            embedding=np.asarray(face_info['embedding'], dtype=np.float32),
+            detection_score=float(face_info['detection_score']),
+            bbox=[float(v) for v in face_info['bbox']],
+            etag=etag,
+            updated_at=datetime.utcnow(),
+        )
+        self._remember(entry)
+        self._save(entry)
+        return entry
+
+    def touch(self, entry: ProfileFace) -> None:
+        """Mark an entry as revalidated (e.g. after a 304 from the image host)"""
+        entry.updated_at = datetime.utcnow()
+        self._remember(entry)
+        self._save(entry)
+
+    def invalidate(self, membership_id: str) -> None:
+        with self._lock:
+            self._entries.pop(membership_id, None)
+        db = SessionLocal()
+        try:
+            db.query(ProfileEmbedding).filter(
+                ProfileEmbedding.membership_id == membership_id
+            ).delete()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Failed to invalidate profile embedding for {membership_id}: {str(e)}")
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _remember(self, entry: ProfileFace) -> None:
+        with self._lock:
+            self._entries[entry.membership_id] = entry
+            self._entries.move_to_end(entry.membership_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, membership_id: str, image_url: str) -> Optional[ProfileFace]:
+        db = SessionLocal()
+        try:
+            row = db.query(ProfileEmbedding).filter(
+                ProfileEmbedding.membership_id == membership_id
+            ).first()
+            if (
+                row is None
+                or row.image_url != image_url
+                or row.model_version != EMBEDDING_VERSION
+            ):
+                return None
+            return ProfileFace(
+                membership_id=row.membership_id,
+                image_url=row.image_url,
+                embedding=np.frombuffer(row.embedding, dtype=np.float32),
+                detection_score=row.detection_score,
+                bbox=row.bbox,
+                etag=row.etag,
+                updated_at=row.updated_at,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to load profile embedding for {membership_id}: {str(e)}")
+            return None
+        finally:
+            db.close()
+
+    def _save(self, entry: ProfileFace) -> None:
+        db = SessionLocal()
+        try:
+            db.merge(ProfileEmbedding(
+                membership_id=entry.membership_id,
+                image_url=entry.image_url,
+                etag=entry.etag,
+                model_version=EMBEDDING_VERSION,
+                embedding=entry.embedding.astype(np.float32).tobytes(),
+                detection_score=entry.detection_score,
+                bbox=entry.bbox,
+                updated_at=entry.updated_at,
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Failed to persist profile embedding for {entry.membership_id}: {str(e)}")
+        finally:
+            db.close()
+
+
+profile_embeddings = ProfileEmbeddingStore()
@@ -0,0 +1,137 @@
+# face_quality.py
+import os
+import math
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Shortest bbox side, in pixels of the decoded frame
+FACE_MIN_SIZE = float(os.getenv("FACE_MIN_SIZE", "48"))
+FACE_MIN_DET_SCORE = float(os.getenv("FACE_MIN_DET_SCORE", "0.6"))
+# Variance of the Laplacian over the face crop rescaled to SHARPNESS_CROP_SIZE
+FACE_MIN_SHARPNESS = float(os.getenv("FACE_MIN_SHARPNESS", "30"))
+# Pose limits estimated from the five detector keypoints
+FACE_MAX_YAW = float(os.getenv("FACE_MAX_YAW", "0.45"))
+FACE_MAX_PITCH = float(os.getenv("FACE_MAX_PITCH", "0.5"))
+FACE_MAX_ROLL_DEGREES = float(os.getenv("FACE_MAX_ROLL_DEGREES", "30"))
+
+SHARPNESS_CROP_SIZE = 112
+
+
+class FaceQualityError(ValueError):
+    """Raised when a frame is rejected before recognition; callers should answer 422."""
+
+    def __init__(self, reason: str, message: str, metrics: Optional[Dict[str, float]] = None):
+        super().__init__(message)
+        self.reason = reason
+        self.metrics = metrics or {}
+
+
+@dataclass
+class FaceQualityPolicy:
+    """
+    Cheap checks run on detector output before the recognition model.
+
+    Everything here only needs the bbox, det_score and the five keypoints the
+    detector already produced, plus one small Laplacian over the face crop, so
+    a bad webcam frame is turned away for a fraction of a full model pass.
+    """
+    min_size: float = FACE_MIN_SIZE
+    min_det_score: float = FACE_MIN_DET_SCORE
+    min_sharpness: float = FACE_MIN_SHARPNESS
+    max_yaw: float = FACE_MAX_YAW
+    max_pitch: float = FACE_MAX_PITCH
+    max_roll_degrees: float = FACE_MAX_ROLL_DEGREES
+
+    def check(self, image: np.ndarray, face) -> Dict[str, float]:
+        """Return the measured metrics, or raise FaceQualityError on the first failed check"""
+        x1, y1, x2, y2 = [float(v) for v in face.bbox[:4]]
+        metrics = {
+            'face_size': min(x2 - x1, y2 - y1),
+            'detection_score': float(face.det_score),
+        }
+        if metrics['face_size'] < self.min_size:
+            raise FaceQualityError(
+                'face_too_small',
+                "Face is too small in the frame, please move closer to the camera",
+                metrics,
+            )
+        if metrics['detection_score'] < self.min_det_score:
+            raise FaceQualityError(
+                'low_detection_score',
+                "Face could not be detected clearly, please face the camera",
+                metrics,
+            )
+
+        if face.kps is not None:
+            metrics.update(estimate_pose(face.kps))
+            if (
+                abs(metrics['yaw']) > self.max_yaw
+                or abs(metrics['pitch']) > self.max_pitch
+                or abs(metrics['roll_degrees']) > self.max_roll_degrees
+            ):
+                raise FaceQualityError(
+                    'extreme_pose',
+                    "Face is turned away from the camera, please look straight ahead",
+                    metrics,
+                )
+
+        metrics['sharpness'] = sharpness(image, face.bbox)
+        if metrics['sharpness'] < self.min_sharpness:
+            raise FaceQualityError(
+                'blurry',
+                "Image is too blurry, please hold still and retake the photo",
+                metrics,
+            )
+        return metrics
+
+
+def estimate_pose(kps: np.ndarray) -> Dict[str, float]:
+    """
+    Rough head pose from the detector keypoints (left eye, right eye, nose,
+    left mouth corner, right mouth corner).
+
+    yaw is the horizontal offset of the nose from the eye/mouth centre line and
+    pitch the vertical offset of the nose from the middle between eyes and
+    mouth, both relative to the inter-ocular distance, so 0 is frontal.
+    """
+    kps = np.asarray(kps, dtype=np.float32).reshape((-1, 2))
+    left_eye, right_eye, nose, left_mouth, right_mouth = kps[:5]
+    eye_center = (left_eye + right_eye) / 2
+    mouth_center = (left_mouth + right_mouth) / 2
+    eye_vec = right_eye - left_eye
+    eye_dist = float(np.linalg.norm(eye_vec)) or 1.0
+
+    roll = math.degrees(math.atan2(float(eye_vec[1]), float(eye_vec[0])))
+    # Work in the face's own frame so roll does not leak into yaw/pitch
+    cos_r, sin_r = eye_vec[0] / eye_dist, eye_vec[1] / eye_dist
+    rotation = np.array([[cos_r, sin_r], [-sin_r, cos_r]], dtype=np.float32)
+    nose_r = rotation @ (nose - eye_center)
+    mouth_r = rotation @ (mouth_center - eye_center)
+
+    yaw = (float(nose_r[0]) - float(mouth_r[0]) / 2) / eye_dist
+    pitch = (float(nose_r[1]) - float(mouth_r[1]) / 2) / eye_dist
+    return {'yaw': yaw, 'pitch': pitch, 'roll_degrees': roll}
+
+
+def sharpness(image: np.ndarray, bbox) -> float:
+    """Variance of the Laplacian over the face crop, rescaled to a fixed size"""
+    height, width = image.shape[:2]
+    x1, y1, x2, y2 = [int(round(float(v))) for v in bbox[:4]]
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(width, x2), min(height, y2)
+    if x2 <= x1 or y2 <= y1:
+        return 0.0
+    crop = image[y1:y2, x1:x2]
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    crop = cv2.resize(crop, (SHARPNESS_CROP_SIZE, SHARPNESS_CROP_SIZE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(crop, cv2.CV_64F).var())
+
+
+default_quality_policy = FaceQualityPolicy()
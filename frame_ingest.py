@@ -0,0 +1,100 @@
+# frame_ingest.py
+import os
+import struct
+import logging
+from io import BytesIO
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from fastapi import UploadFile
+
+logger = logging.getLogger(__name__)
+
+# JPEGs are decoded at 1/2, 1/4 or 1/8 scale as long as the long side stays at
+# least this big (1.5x the 640 detector input, so the ArcFace crop keeps detail)
+FRAME_REDUCED_DECODE_MIN_SIDE = int(os.getenv("FRAME_REDUCED_DECODE_MIN_SIDE", "960"))
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+# Start-of-frame markers carrying the image dimensions (all except DHT/JPG/DAC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+@dataclass
+class Frame:
+    """
+    An uploaded image, read once.
+
+    The same ``data`` buffer is handed to the decoder and to the uploader;
+    neither makes its own copy of the encoded bytes.
+    """
+    data: bytes
+    content_type: str = "image/jpeg"
+
+    def fileobj(self) -> BytesIO:
+        # BytesIO shares the bytes object until something writes to it
+        return BytesIO(self.data)
+
+
+async def read_upload(upload: UploadFile) -> Frame:
+    data = await upload.read()
+    return Frame(data=data, content_type=upload.content_type or "image/jpeg")
+
+
+def jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Return (width, height) from a JPEG header without decoding, or None if not a JPEG"""
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    pos = 2
+    size = len(data)
+    while pos + 4 <= size:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        (length,) = struct.unpack(">H", data[pos + 2:pos + 4])
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 9 > size:
+                return None
+            height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return width, height
+        if marker == 0xDA:
+            # Start of scan without a frame header
+            return None
+        pos += 2 + length
+    return None
+
+
+def decode_image(data: bytes, min_side: int = FRAME_REDUCED_DECODE_MIN_SIDE) -> Tuple[np.ndarray, int]:
+    """
+    Decode an encoded image into the BGR array the models expect.
+
+    Returns the image and the factor it was scaled down by during decoding
+    (1 unless a large JPEG was decoded at reduced resolution), so coordinates
+    found on the image can be mapped back onto the original.
+    """
+    buffer = np.frombuffer(data, np.uint8)
+    factor, flags = 1, cv2.IMREAD_COLOR
+    dims = jpeg_size(data) if min_side > 0 else None
+    if dims is not None:
+        long_side = max(dims)
+        for candidate, candidate_flags in _REDUCED_FLAGS:
+            if long_side // candidate >= min_side:
+                factor, flags = candidate, candidate_flags
+                break
+
+    image = cv2.imdecode(buffer, flags)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image, factor
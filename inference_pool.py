@@ -0,0 +1,117 @@
+# inference_pool.py
+import os
+import time
+import asyncio
+import threading
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from timing import record
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+# Requests allowed to wait for a worker before new ones are turned away.
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", str(INFERENCE_WORKERS * 4)))
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the inference queue is at capacity; callers should answer 503."""
+
+
+class InferenceExecutor:
+    """
+    Bounded worker pool for model inference.
+
+    ONNX Runtime releases the GIL while a session runs, so a thread pool gives
+    real parallelism while sharing one copy of the models per process. Work is
+    admitted only while fewer than ``max_workers + max_queue`` jobs are in
+    flight; beyond that ``run`` raises InferenceQueueFull instead of letting
+    the backlog (and request latency) grow without bound.
+    """
+
+    def __init__(self, max_workers: int = INFERENCE_WORKERS, max_queue: int = INFERENCE_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            if self._queued + self._running >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise InferenceQueueFull("Face verification is busy, please retry shortly")
+            self._queued += 1
+            self.submitted += 1
+
+        enqueued_at = time.perf_counter()
+
+        def call():
+            started_at = time.perf_counter()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self.wait_seconds += started_at - enqueued_at
+            record("inference.wait", started_at - enqueued_at)
+            try:
+                result = fn(*args, **kwargs)
+                with self._lock:
+                    self.completed += 1
+                return result
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self.run_seconds += time.perf_counter() - started_at
+
+        # Run in a copy of the caller's context so spans reach its request timings
+        context = contextvars.copy_context()
+        try:
+            future = self._pool.submit(context.run, call)
+        except Exception:
+            with self._lock:
+                self._queued -= 1
+            raise
+        # A client disconnect cancels the future; if that happens before a worker
+        # picked the job up, ``call`` never runs and the slot must be released here.
+        future.add_done_callback(self._release_if_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def _release_if_cancelled(self, future) -> None:
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "queue_capacity": self.max_queue,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "wait_seconds_total": round(self.wait_seconds, 6),
+                "run_seconds_total": round(self.run_seconds, 6),
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+
+inference_executor = InferenceExecutor()
@@ -16,6 +16,7 @@ from numpy.linalg import norm
 
 from ..model_zoo import model_zoo
 from ..utils import DEFAULT_MP_NAME, ensure_available
+from ..utils import face_align
 from .common import Face
 
 __all__ = ['FaceAnalysis']
@@ -59,6 +60,36 @@ class FaceAnalysis:
         bboxes, kpss = self.det_model.detect(img,
                                              max_num=max_num,
                                              metric=det_metric)
+        ret = self._build_faces(img, bboxes, kpss)
+        #run all faces of the image through the recognition model in one batch
+        if 'recognition' in self.models:
+            self.models['recognition'].get_batch(img, ret)
+        return ret
+
+    def get_batch(self, imgs, max_num=0, det_metric='default'):
+        """Analyse several images, running detection and recognition once each for the whole batch"""
+        dets = self.det_model.detect_batch(imgs,
+                                           max_num=max_num,
+                                           metric=det_metric)
+        rets = []
+        for img, (bboxes, kpss) in zip(imgs, dets):
+            rets.append(self._build_faces(img, bboxes, kpss))
+        if 'recognition' in self.models:
+            rec_model = self.models['recognition']
+            aimgs = []
+            faces = []
+            for img, ret in zip(imgs, rets):
+                for face in ret:
+                    aimgs.append(face_align.norm_crop(img, landmark=face.kps, image_size=rec_model.input_size[0]))
+                    faces.append(face)
+            if len(aimgs)>0:
+                feats = rec_model.get_feats(aimgs)
+                for face, feat in zip(faces, feats):
+                    face.embedding = feat.flatten()
+        return rets
+
+    def _build_faces(self, img, bboxes, kpss):
+        #faces with every model applied except recognition
         if bboxes.shape[0] == 0:
             return []
         ret = []
@@ -70,7 +101,7 @@ class FaceAnalysis:
                 kps = kpss[i]
             face = Face(bbox=bbox, kps=kps, det_score=det_score)
             for taskname, model in self.models.items():
-                if taskname=='detection':
+                if taskname=='detection' or taskname=='recognition':
                     continue
                 model.get(img, face)
             ret.append(face)
@@ -67,6 +67,27 @@ class ArcFaceONNX:
         face.embedding = self.get_feat(aimg).flatten()
         return face.embedding
 
+    def get_batch(self, img, faces):
+        if len(faces)==0:
+            return []
+        aimgs = [face_align.norm_crop(img, landmark=face.kps, image_size=self.input_size[0]) for face in faces]
+        feats = self.get_feats(aimgs)
+        for face, feat in zip(faces, feats):
+            face.embedding = feat.flatten()
+        return [face.embedding for face in faces]
+
+    def get_feats(self, aimgs):
+        #embed aligned crops, in one batch when the model allows it
+        if self.max_batch_size==1:
+            return [self.get_feat(aimg)[0] for aimg in aimgs]
+        return self.get_feat(aimgs)
+
+    @property
+    def max_batch_size(self):
+        #0 means the batch dimension is dynamic
+        batch_dim = self.input_shape[0]
+        return batch_dim if isinstance(batch_dim, int) else 0
+
     def compute_sim(self, feat1, feat2):
         from numpy.linalg import norm
         feat1 = feat1.ravel()
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+# @Organization  : insightface.ai
+# @Function      : vectorised decode, NMS and batched detection shared by RetinaFace and SCRFD
+
+from __future__ import division
+import time
+import numpy as np
+import cv2
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+__all__ = ['distance2bbox', 'distance2kps', 'nms', 'AnchorDetector']
+
+#boxes resolved per step of the tiled NMS
+NMS_TILE = 32
+
+
+def distance2bbox(points, distance, max_shape=None):
+    """Decode distance prediction to bounding box.
+
+    Args:
+        points (ndarray): Shape (n, 2), [x, y].
+        distance (ndarray): Distance from the given point to 4
+            boundaries (left, top, right, bottom).
+        max_shape (tuple): Shape of the image.
+
+    Returns:
+        ndarray: Decoded bboxes, shape (n, 4).
+    """
+    bboxes = np.concatenate([points[:, 0:2] - distance[:, 0:2],
+                             points[:, 0:2] + distance[:, 2:4]], axis=-1)
+    if max_shape is not None:
+        np.clip(bboxes[:, 0::2], 0, max_shape[1], out=bboxes[:, 0::2])
+        np.clip(bboxes[:, 1::2], 0, max_shape[0], out=bboxes[:, 1::2])
+    return bboxes
+
+
+def distance2kps(points, distance, max_shape=None):
+    """Decode distance prediction to keypoints.
+
+    Args:
+        points (ndarray): Shape (n, 2), [x, y].
+        distance (ndarray): Offsets from the given point, shape (n, 2*k)
+            laid out as x0, y0, x1, y1, ...
+        max_shape (tuple): Shape of the image.
+
+    Returns:
+        ndarray: Decoded keypoints, shape (n, 2*k).
+    """
+    n = distance.shape[0]
+    kps = distance.reshape( (n, -1, 2) ) + points[:, np.newaxis, 0:2]
+    if max_shape is not None:
+        np.clip(kps[:, :, 0], 0, max_shape[1], out=kps[:, :, 0])
+        np.clip(kps[:, :, 1], 0, max_shape[0], out=kps[:, :, 1])
+    return kps.reshape( (n, -1) )
+
+
+def nms(dets, thresh, tile=NMS_TILE):
+    """Greedy NMS over rows of [x1, y1, x2, y2, score].
+
+    Returns the indices of kept rows, highest score first, identical to the
+    original per-box loop. Instead of one numpy round per kept box, the
+    highest-scoring ``tile`` remaining boxes are resolved against each other
+    with a small overlap matrix, and the survivors then suppress everything
+    below them in a single pass.
+    """
+    n = dets.shape[0]
+    if n==0:
+        return []
+    if _nms_compiled is not None:
+        return _nms_compiled(np.ascontiguousarray(dets[:, 0:5], dtype=np.float32), np.float32(thresh)).tolist()
+
+    order = dets[:, 4].argsort()[::-1]
+    boxes = dets[order, 0:4].astype(np.float32)
+    x1 = np.ascontiguousarray(boxes[:, 0])
+    y1 = np.ascontiguousarray(boxes[:, 1])
+    x2 = np.ascontiguousarray(boxes[:, 2])
+    y2 = np.ascontiguousarray(boxes[:, 3])
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+
+    def suppresses(a, b):
+        #(len(a), len(b)) mask of pairs whose IoU exceeds thresh
+        w = np.minimum(x2[a][:, None], x2[b][None, :]) - np.maximum(x1[a][:, None], x1[b][None, :]) + 1
+        h = np.minimum(y2[a][:, None], y2[b][None, :]) - np.maximum(y1[a][:, None], y1[b][None, :]) + 1
+        np.maximum(w, 0.0, out=w)
+        np.maximum(h, 0.0, out=h)
+        inter = w * h
+        return inter > thresh * (areas[a][:, None] + areas[b][None, :] - inter)
+
+    keep = []
+    remaining = np.arange(n)
+    while remaining.size > 0:
+        head = remaining[:tile]
+        rest = remaining[tile:]
+        head_sup = suppresses(head, head)
+        alive = np.ones(head.size, dtype=bool)
+        kept = []
+        for i in range(head.size):
+            if alive[i]:
+                kept.append(i)
+                alive[i+1:] &= ~head_sup[i, i+1:]
+        kept = head[kept]
+        keep.extend(order[kept].tolist())
+        if rest.size > 0:
+            rest = rest[~suppresses(kept, rest).any(axis=0)]
+        remaining = rest
+    return keep
+
+
+class AnchorDetector:
+    """Detection steps shared by RetinaFace and SCRFD.
+
+    Subclasses provide forward() and the attributes set by their _init_vars
+    (input_size, input_shape, fmc, _feat_stride_fpn, use_kps, det_thresh,
+    nms_thresh) plus _get_anchor_centers().
+    """
+
+    def _letterbox(self, img, input_size):
+        im_ratio = float(img.shape[0]) / img.shape[1]
+        model_ratio = float(input_size[1]) / input_size[0]
+        if im_ratio>model_ratio:
+            new_height = input_size[1]
+            new_width = int(new_height / im_ratio)
+        else:
+            new_width = input_size[0]
+            new_height = int(new_width * im_ratio)
+        det_scale = float(new_height) / img.shape[0]
+        resized_img = cv2.resize(img, (new_width, new_height))
+        det_img = np.zeros( (input_size[1], input_size[0], 3), dtype=np.uint8 )
+        det_img[:new_height, :new_width, :] = resized_img
+        return det_img, det_scale
+
+    def detect(self, img, input_size = None, max_num=0, metric='default'):
+        assert input_size is not None or self.input_size is not None
+        input_size = self.input_size if input_size is None else input_size
+            
+        det_img, det_scale = self._letterbox(img, input_size)
+
+        scores_list, bboxes_list, kpss_list = self.forward(det_img, self.det_thresh)
+
+        return self._postprocess(img, det_scale, scores_list, bboxes_list, kpss_list, max_num, metric)
+
+    def detect_batch(self, imgs, input_size = None, max_num=0, metric='default'):
+        """Detect faces on several images with a single session.run.
+
+        Every image is letterboxed into the same input size and stacked into one
+        NCHW blob. Returns a list of (det, kpss) tuples, one per image.
+        """
+        assert input_size is not None or self.input_size is not None
+        input_size = self.input_size if input_size is None else input_size
+        if len(imgs)==0:
+            return []
+        batch_dim = self.input_shape[0]
+        if isinstance(batch_dim, int) and batch_dim>0 and batch_dim!=len(imgs):
+            #model was exported with a static batch size
+            return [self.detect(img, input_size=input_size, max_num=max_num, metric=metric) for img in imgs]
+
+        det_imgs = []
+        det_scales = []
+        for img in imgs:
+            det_img, det_scale = self._letterbox(img, input_size)
+            det_imgs.append(det_img)
+            det_scales.append(det_scale)
+        blob = cv2.dnn.blobFromImages(det_imgs, 1.0/self.input_std, input_size, (self.input_mean, self.input_mean, self.input_mean), swapRB=True)
+        net_outs = self.session.run(self.output_names, {self.input_name : blob})
+        decoded = self._decode_batch(net_outs, len(imgs), blob.shape[2], blob.shape[3], self.det_thresh)
+
+        ret = []
+        for img, det_scale, (scores_list, bboxes_list, kpss_list) in zip(imgs, det_scales, decoded):
+            ret.append(self._postprocess(img, det_scale, scores_list, bboxes_list, kpss_list, max_num, metric))
+        return ret
+
+    def _decode_batch(self, net_outs, batch_size, input_height, input_width, threshold):
+        #per-image (scores_list, bboxes_list, kpss_list), same layout as forward()
+        ret = [([], [], []) for _ in range(batch_size)]
+        fmc = self.fmc
+        for idx, stride in enumerate(self._feat_stride_fpn):
+            height = input_height // stride
+            width = input_width // stride
+            anchor_centers = self._get_anchor_centers(height, width, stride)
+            K = anchor_centers.shape[0]
+            #outputs are either (N, K, C) or flattened to (N*K, C)
+            scores = net_outs[idx].reshape( (batch_size, K, -1) )
+            bbox_preds = net_outs[idx+fmc].reshape( (batch_size, K, 4) )
+            if self.use_kps:
+                kps_preds = net_outs[idx+fmc*2].reshape( (batch_size, K, -1) )
+            for b in range(batch_size):
+                pos_inds = np.where(scores[b]>=threshold)[0]
+                pos_centers = anchor_centers[pos_inds]
+                ret[b][0].append(scores[b][pos_inds])
+                ret[b][1].append(distance2bbox(pos_centers, bbox_preds[b][pos_inds] * stride))
+                if self.use_kps:
+                    pos_kpss = distance2kps(pos_centers, kps_preds[b][pos_inds] * stride)
+                    ret[b][2].append(pos_kpss.reshape( (pos_kpss.shape[0], -1, 2) ))
+        return ret
+
+    def _postprocess(self, img, det_scale, scores_list, bboxes_list, kpss_list, max_num, metric):
+        scores = np.vstack(scores_list)
+        scores_ravel = scores.ravel()
+        order = scores_ravel.argsort()[::-1]
+        bboxes = np.vstack(bboxes_list) / det_scale
+        if self.use_kps:
+            kpss = np.vstack(kpss_list) / det_scale
+        pre_det = np.hstack((bboxes, scores)).astype(np.float32, copy=False)
+        pre_det = pre_det[order, :]
+        keep = self.nms(pre_det)
+        det = pre_det[keep, :]
+        if self.use_kps:
+            kpss = kpss[order,:,:]
+            kpss = kpss[keep,:,:]
+        else:
+            kpss = None
+        if max_num > 0 and det.shape[0] > max_num:
+            area = (det[:, 2] - det[:, 0]) * (det[:, 3] -
+                                                    det[:, 1])
+            img_center = img.shape[0] // 2, img.shape[1] // 2
+            offsets = np.vstack([
+                (det[:, 0] + det[:, 2]) / 2 - img_center[1],
+                (det[:, 1] + det[:, 3]) / 2 - img_center[0]
+            ])
+            offset_dist_squared = np.sum(np.power(offsets, 2.0), 0)
+            if metric=='max':
+                values = area
+            else:
+                values = area - offset_dist_squared * 2.0  # some extra weight on the centering
+            bindex = np.argsort(
+                values)[::-1]  # some extra weight on the centering
+            bindex = bindex[0:max_num]
+            det = det[bindex, :]
+            if kpss is not None:
+                kpss = kpss[bindex, :]
+        return det, kpss
+
+    def nms(self, dets):
+        return nms(dets, self.nms_thresh)
+
+
+def _nms_loop(dets, thresh):
+    #reference implementation, previously RetinaFace.nms / SCRFD.nms
+    x1 = dets[:, 0]
+    y1 = dets[:, 1]
+    x2 = dets[:, 2]
+    y2 = dets[:, 3]
+    scores = dets[:, 4]
+
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
+        inter = w * h
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+
+        inds = np.where(ovr <= thresh)[0]
+        order = order[inds + 1]
+
+    return keep
+
+
+def _distance2kps_loop(points, distance, max_shape=None):
+    #reference implementation, previously distance2kps in retinaface.py / scrfd.py
+    preds = []
+    for i in range(0, distance.shape[1], 2):
+        px = points[:, i%2] + distance[:, i]
+        py = points[:, i%2+1] + distance[:, i+1]
+        preds.append(px)
+        preds.append(py)
+    return np.stack(preds, axis=-1)
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _nms_compiled(dets, thresh):
+        n = dets.shape[0]
+        order = np.argsort(-dets[:, 4], kind='mergesort')
+        areas = (dets[:, 2] - dets[:, 0] + 1) * (dets[:, 3] - dets[:, 1] + 1)
+        suppressed = np.zeros(n, dtype=np.bool_)
+        keep = np.empty(n, dtype=np.int64)
+        nkeep = 0
+        for _i in range(n):
+            i = order[_i]
+            if suppressed[i]:
+                continue
+            keep[nkeep] = i
+            nkeep += 1
+            for _j in range(_i + 1, n):
+                j = order[_j]
+                if suppressed[j]:
+                    continue
+                w = min(dets[i, 2], dets[j, 2]) - max(dets[i, 0], dets[j, 0]) + 1
+                h = min(dets[i, 3], dets[j, 3]) - max(dets[i, 1], dets[j, 1]) + 1
+                if w <= 0 or h <= 0:
+                    continue
+                inter = w * h
+                if inter / (areas[i] + areas[j] - inter) > thresh:
+                    suppressed[j] = True
+        return keep[:nkeep]
+else:
+    _nms_compiled = None
+
+
+def _synthetic_outputs(input_size, strides=(8, 16, 32), num_anchors=2, num_faces=3, seed=0):
+    #score/bbox/kps maps shaped like a det_10g forward pass, with a few clusters of confident anchors
+    rng = np.random.RandomState(seed)
+    levels = []
+    face_centers = rng.uniform(0.2, 0.8, size=(num_faces, 2)) * np.array(input_size, dtype=np.float32)
+    for stride in strides:
+        height = input_size[1] // stride
+        width = input_size[0] // stride
+        centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+        centers = (centers * stride).reshape( (-1, 2) )
+        centers = np.stack([centers]*num_anchors, axis=1).reshape( (-1, 2) )
+        scores = rng.uniform(0.0, 0.3, size=(centers.shape[0], 1)).astype(np.float32)
+        for fc in face_centers:
+            near = np.where(np.abs(centers - fc).max(axis=1) < 48)[0]
+            scores[near, 0] = rng.uniform(0.5, 0.99, size=near.shape[0])
+        bbox_preds = rng.uniform(40, 80, size=(centers.shape[0], 4)).astype(np.float32)
+        kps_preds = rng.uniform(-30, 30, size=(centers.shape[0], 10)).astype(np.float32)
+        levels.append((centers, scores, bbox_preds, kps_preds))
+    return levels
+
+
+def _postprocess_legacy(levels, threshold, nms_thresh):
+    #as the detectors used to do it: decode every anchor, then filter, then loop NMS
+    scores_list = []
+    bboxes_list = []
+    kpss_list = []
+    for centers, scores, bbox_preds, kps_preds in levels:
+        pos_inds = np.where(scores>=threshold)[0]
+        bboxes = distance2bbox(centers, bbox_preds)
+        kpss = _distance2kps_loop(centers, kps_preds)
+        kpss = kpss.reshape( (kpss.shape[0], -1, 2) )
+        scores_list.append(scores[pos_inds])
+        bboxes_list.append(bboxes[pos_inds])
+        kpss_list.append(kpss[pos_inds])
+    return _select(scores_list, bboxes_list, kpss_list, nms_thresh, _nms_loop)
+
+
+def _postprocess_vectorised(levels, threshold, nms_thresh):
+    #filter first, decode only the surviving anchors, tiled NMS
+    scores_list = []
+    bboxes_list = []
+    kpss_list = []
+    for centers, scores, bbox_preds, kps_preds in levels:
+        pos_inds = np.where(scores>=threshold)[0]
+        pos_centers = centers[pos_inds]
+        scores_list.append(scores[pos_inds])
+        bboxes_list.append(distance2bbox(pos_centers, bbox_preds[pos_inds]))
+        kpss_list.append(distance2kps(pos_centers, kps_preds[pos_inds]).reshape( (pos_inds.shape[0], -1, 2) ))
+    return _select(scores_list, bboxes_list, kpss_list, nms_thresh, nms)
+
+
+def _select(scores_list, bboxes_list, kpss_list, nms_thresh, nms_fn):
+    scores = np.vstack(scores_list)
+    order = scores.ravel().argsort()[::-1]
+    pre_det = np.hstack((np.vstack(bboxes_list), scores)).astype(np.float32, copy=False)[order, :]
+    kpss = np.vstack(kpss_list)[order]
+    keep = nms_fn(pre_det, nms_thresh)
+    return pre_det[keep, :], kpss[keep]
+
+
+def benchmark(input_sizes=((640, 640), (1280, 1280)), thresholds=(0.5, 0.2), repeat=50):
+    """Compare the old and the vectorised post-processing on synthetic detector outputs."""
+    for input_size in input_sizes:
+        levels = _synthetic_outputs(input_size)
+        for threshold in thresholds:
+            results = {}
+            for name, fn in (('loop', _postprocess_legacy), ('vectorised', _postprocess_vectorised)):
+                det, _ = fn(levels, threshold, 0.4)
+                ta = time.perf_counter()
+                for _ in range(repeat):
+                    fn(levels, threshold, 0.4)
+                cost = (time.perf_counter() - ta) * 1000 / repeat
+                results[name] = (cost, det)
+            candidates = sum(int((lv[1]>=threshold).sum()) for lv in levels)
+            same = np.array_equal(results['loop'][1], results['vectorised'][1])
+            print('input %dx%d thresh %.1f candidates %d: loop %.3fms, vectorised %.3fms, identical=%s' % (
+                input_size[0], input_size[1], threshold, candidates,
+                results['loop'][0], results['vectorised'][0], same))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,230 @@
+# member_activity.py
+import os
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from db import create_indexes_concurrently, MemberActivitySummary, SummaryBuild, VerificationToken
+
+logger = logging.getLogger(__name__)
+
+# Encounters kept per member in the summary
+MEMBER_RECENT_ENCOUNTERS = int(os.getenv("MEMBER_RECENT_ENCOUNTERS", "20"))
+
+# Fields of each recent_encounters entry
+ENCOUNTER_FIELDS = ("token", "verification_date", "user_id", "verification_status",
+                    "final_verification_status", "disposition_name", "final_time")
+
+# The backfill is recorded in summary_builds under this name; until then reads work from the source tables
+SUMMARY_BUILD_NAME = "member_activity_summary"
+# Held for the backfill's transaction, so one worker runs it
+SUMMARY_BUILD_LOCK = 7294014
+_built = False
+
+# Read paths that still go to the big tables; created concurrently at startup
+# because create_all does not add indexes to existing tables
+_INDEXES = {
+    "idx_user_visit_date":
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_visit_date ON recent_visits (user_id, visit_date)",
+}
+
+
+def _summary_sql(members: str) -> str:
+    """
+    Summary rows of the members selected by `members`, computed from the
+    source tables; per-member lookups, so a handful of members stays cheap
+    """
+    return f"""
+    SELECT m.membership_id, v.last_visit_at, t.token AS last_verification_token,
+           t.verification_date AS last_verification_at, t.final_verification_status, t.disposition_name,
+           coalesce(e.recent, '[]'::json) AS recent_encounters, now() AS updated_at
+    FROM ({members}) m
+    LEFT JOIN LATERAL (
+        SELECT max(visit_date) AS last_visit_at FROM recent_visits rv WHERE rv.membership_id = m.membership_id
+    ) v ON true
+    LEFT JOIN LATERAL (
+        SELECT token, verification_date, final_verification_status, disposition_name
+        FROM verification_tokens vt
+        WHERE vt.membership_id = m.membership_id
+        ORDER BY vt.created_at DESC
+        LIMIT 1
+    ) t ON true
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object({", ".join(f"'{f}', r.{f}" for f in ENCOUNTER_FIELDS)})
+                        ORDER BY r.created_at DESC) AS recent
+        FROM (
+            SELECT * FROM verification_tokens vt
+            WHERE vt.membership_id = m.membership_id
+            ORDER BY vt.created_at DESC
+            LIMIT {MEMBER_RECENT_ENCOUNTERS}
+        ) r
+    ) e ON true
+"""
+
+
+_REBUILD_SQL = """
+    INSERT INTO member_activity_summary (membership_id, last_visit_at, last_verification_token,
+                                         last_verification_at, final_verification_status, disposition_name,
+                                         recent_encounters, updated_at)
+""" + _summary_sql("SELECT membership_id FROM recent_visits UNION SELECT membership_id FROM verification_tokens")
+
+_SUMMARIES_OF_SQL = _summary_sql(
+    "SELECT membership_id FROM recent_visits WHERE membership_id = ANY(:ids) "
+    "UNION SELECT membership_id FROM verification_tokens WHERE membership_id = ANY(:ids)"
+)
+
+
+def encounter_entry(token: VerificationToken) -> Dict[str, Any]:
+    entry = {}
+    for field in ENCOUNTER_FIELDS:
+        value = getattr(token, field)
+        entry[field] = value.isoformat() if isinstance(value, datetime) else value
+    return entry
+
+
+def _locked(db: Session, membership_id: str) -> MemberActivitySummary:
+    """The member's summary row, created if missing and locked until the caller's transaction ends"""
+    db.execute(
+        pg_insert(MemberActivitySummary.__table__)
+        .values(membership_id=membership_id, recent_encounters=[], updated_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=["membership_id"])
+    )
+    return db.query(MemberActivitySummary).filter(
+        MemberActivitySummary.membership_id == membership_id
+    ).with_for_update().populate_existing().one()
+
+
+def note_verification(db: Session, token: VerificationToken, visit_date: datetime) -> None:
+    """
+    A new encounter for token's member: it becomes the member's latest
+    verification and heads recent_encounters. Runs in the caller's
+    transaction, so it commits with the token and visit rows.
+    """
+    summary = _locked(db, token.membership_id)
+    if summary.last_visit_at is None or visit_date > summary.last_visit_at:
+        summary.last_visit_at = visit_date
+    summary.last_verification_token = token.token
+    summary.last_verification_at = token.verification_date or visit_date
+    summary.final_verification_status = token.final_verification_status
+    summary.disposition_name = token.disposition_name
+    recent = [entry for entry in (summary.recent_encounters or []) if entry.get("token") != token.token]
+    # A new list, so the JSON column is seen as changed
+    summary.recent_encounters = [encounter_entry(token)] + recent[:MEMBER_RECENT_ENCOUNTERS - 1]
+    summary.updated_at = datetime.utcnow()
+    db.flush()
+
+
+def note_outcome(db: Session, token: VerificationToken) -> None:
+    """Face match result or disposition recorded on token: refresh its entry, and the latest status if it is the latest"""
+    summary = db.query(MemberActivitySummary).filter(
+        MemberActivitySummary.membership_id == token.membership_id
+    ).with_for_update().populate_existing().first()
+    if summary is None:
+        return
+    if summary.last_verification_token == token.token:
+        summary.final_verification_status = token.final_verification_status
+        summary.disposition_name = token.disposition_name
+    entry = encounter_entry(token)
+    summary.recent_encounters = [
+        entry if existing.get("token") == token.token else existing
+        for existing in (summary.recent_encounters or [])
+    ]
+    summary.updated_at = datetime.utcnow()
+    db.flush()
+
+
+def summary_for(db: Session, membership_id: str) -> Optional[MemberActivitySummary]:
+    return summaries(db, [membership_id]).get(membership_id)
+
+
+def summaries(db: Session, membership_ids: Iterable[str]) -> Dict[str, MemberActivitySummary]:
+    """
+    Summaries by membership_id with one primary-key lookup; members without
+    activity are absent. Until the backfill has finished the table can be
+    missing members or encounters, so they are computed from
+    verification_tokens and recent_visits instead (not saved).
+    """
+    ids = list(set(membership_ids))
+    if not ids:
+        return {}
+    if not is_built(db):
+        rows = db.execute(text(_SUMMARIES_OF_SQL), {"ids": ids}).mappings()
+        return {row["membership_id"]: MemberActivitySummary(**row) for row in rows}
+    rows = db.query(MemberActivitySummary).filter(MemberActivitySummary.membership_id.in_(ids)).all()
+    return {row.membership_id: row for row in rows}
+
+
+def recent_tokens(summary: Optional[MemberActivitySummary], limit: int,
+                  exclude: Optional[str] = None) -> Optional[List[str]]:
+    """
+    Tokens of the member's newest `limit` encounters (newest first), or None
+    when the summary can't answer: no summary yet, or more encounters asked
+    for than it keeps.
+    """
+    if summary is None:
+        return None
+    entries = summary.recent_encounters or []
+    tokens = [entry["token"] for entry in entries if entry.get("token") != exclude]
+    # A list shorter than the cap holds every encounter the member has
+    if len(tokens) < limit and len(entries) >= MEMBER_RECENT_ENCOUNTERS:
+        return None
+    return tokens[:limit]
+
+
+def is_built(db: Session) -> bool:
+    """Whether the backfill has finished; once it has, the summaries are kept current by every encounter"""
+    global _built
+    if not _built:
+        _built = db.execute(
+            text("SELECT EXISTS (SELECT 1 FROM summary_builds WHERE name = :name)"), {"name": SUMMARY_BUILD_NAME}
+        ).scalar()
+    return _built
+
+
+def rebuild(db: Session) -> int:
+    """
+    Recompute every summary from verification_tokens and recent_visits and
+    record the build; returns rows written. Encounters wait on the table lock
+    meanwhile, and update the rebuilt rows once it commits.
+    """
+    global _built
+    db.execute(text("LOCK TABLE member_activity_summary IN EXCLUSIVE MODE"))
+    db.execute(text("DELETE FROM member_activity_summary"))
+    written = db.execute(text(_REBUILD_SQL)).rowcount
+    now = datetime.utcnow()
+    db.execute(
+        pg_insert(SummaryBuild.__table__)
+        .values(name=SUMMARY_BUILD_NAME, built_at=now)
+        .on_conflict_do_update(index_elements=["name"], set_={"built_at": now})
+    )
+    db.commit()
+    _built = True
+    logger.info(f"Rebuilt member_activity_summary: {written} members")
+    return written
+
+
+def ensure_built(db: Session) -> bool:
+    """
+    Backfill the summaries unless summary_builds says it is done. One worker
+    runs it; the others return straight away and keep reading from the
+    source tables until it finishes. Returns whether this call built them.
+    """
+    if is_built(db):
+        return False
+    if not db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": SUMMARY_BUILD_LOCK}).scalar():
+        db.rollback()
+        return False
+    # Another worker may have finished between the check and the lock
+    if is_built(db):
+        db.rollback()
+        return False
+    rebuild(db)
+    return True
+
+
+def ensure_indexes() -> None:
+    create_indexes_concurrently(_INDEXES)
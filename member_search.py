@@ -0,0 +1,118 @@
+# member_search.py
+import os
+import logging
+from typing import Any, Dict, List
+
+from sqlalchemy import and_, case, func, or_, text
+
+from db import create_indexes_concurrently, engine, Member
+from member_activity import summaries
+
+logger = logging.getLogger(__name__)
+
+# Infix matching needs a full trigram; shorter queries only match prefixes
+MEMBER_SEARCH_INFIX_MIN = int(os.getenv("MEMBER_SEARCH_INFIX_MIN", "3"))
+
+SEARCH_COLUMNS = ("membership_id", "nhis_number", "last_name", "first_name", "middle_name")
+
+# pg_trgm GIN indexes serve ILIKE 'q%' and '%q%' on each searched column
+_TRIGRAM_INDEXES = {
+    f"idx_members_{column}_trgm":
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_members_{column}_trgm ON members USING gin ({column} gin_trgm_ops)"
+    for column in SEARCH_COLUMNS
+}
+
+
+def ensure_indexes() -> None:
+    """Create pg_trgm and the member search indexes if missing (CONCURRENTLY, so writes carry on)"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    if create_indexes_concurrently(_TRIGRAM_INDEXES):
+        logger.info("Member search indexes in place")
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _any_column(pattern: str):
+    return or_(*(getattr(Member, column).ilike(pattern, escape="\\") for column in SEARCH_COLUMNS))
+
+
+def _order(term: str) -> List:
+    """Within a tier: ID matches, then last, first and middle name matches, then alphabetical"""
+    lowered = term.lower()
+    field_rank = case(
+        *((func.strpos(func.lower(getattr(Member, column)), lowered) > 0, i)
+          for i, column in enumerate(SEARCH_COLUMNS)),
+        else_=len(SEARCH_COLUMNS),
+    )
+    # membership_id is unique, so pages split the same way on every request
+    return [field_rank, func.lower(Member.last_name), func.lower(Member.first_name), Member.membership_id]
+
+
+def search_members(db, query: str, limit: int = 10, offset: int = 0) -> List[Member]:
+    """
+    Members matching query, best first: exact membership/NHIS number, then
+    any searched column starting with it, then containing it. Each tier is
+    one index-served query ordered and paged in SQL; later tiers are only
+    run while the page isn't full, and a tier the offset lies past is only
+    counted.
+    """
+    term = " ".join(query.split())
+    if not term:
+        return []
+    like = _escape_like(term)
+    ids = sorted({term, term.upper()})
+    exact = or_(Member.membership_id.in_(ids), Member.nhis_number.in_(ids))
+    prefix = _any_column(f"{like}%")
+    # IS NOT TRUE rather than NOT: a NULL middle_name makes the OR NULL, and NOT NULL would drop the row
+    tiers = [exact, and_(prefix, exact.isnot(True))]
+    if len(term) >= MEMBER_SEARCH_INFIX_MIN:
+        tiers.append(and_(_any_column(f"%{like}%"), prefix.isnot(True), exact.isnot(True)))
+
+    found: List[Member] = []
+    skip = offset
+    for condition in tiers:
+        if len(found) >= limit:
+            break
+        tier = db.query(Member).filter(condition)
+        rows = tier.order_by(*_order(term)).offset(skip).limit(limit - len(found)).all()
+        found.extend(rows)
+        if rows:
+            skip = 0
+        elif skip:
+            # The offset lies past this tier: the rest of it falls in the next ones
+            skip = max(0, skip - tier.count())
+    return found
+
+
+def autocomplete(db, query: str, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+    """search_members plus each member's latest visit and verification from the activity summary"""
+    members = search_members(db, query, limit, offset)
+    activity = summaries(db, (member.membership_id for member in members))
+    results = []
+    for member in members:
+        summary = activity.get(member.membership_id)
+        results.append({
+            "membership_id": member.membership_id,
+            "first_name": member.first_name,
+            "middle_name": member.middle_name,
+            "last_name": member.last_name,
+            "date_of_birth": member.date_of_birth.isoformat(),
+            "gender": member.gender,
+            "marital_status": member.marital_status,
+            "nhis_number": member.nhis_number,
+            "insurance_type": member.insurance_type,
+            "issue_date": member.issue_date.isoformat(),
+            "enrolment_status": member.enrolment_status,
+            "current_expiry_date": member.current_expiry_date.isoformat(),
+            "phone_number": member.mobile_phone_number,
+            "residential_address": member.residential_address,
+            "ghana_card_number": member.ghana_card_number,
+            "profile_image_url": member.profile_image_url,
+            "last_visit": summary.last_visit_at.isoformat() if summary and summary.last_visit_at else None,
+            "final_verification_status": summary.final_verification_status if summary else None,
+            "disposition_name": summary.disposition_name if summary else None,
+        })
+    return results
@@ -0,0 +1,212 @@
+# model_registry.py
+import os
+import glob
+import time
+import threading
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import onnxruntime
+from insightface.model_zoo import ArcFaceONNX, RetinaFace, Landmark, Attribute
+from insightface.utils import ensure_available
+
+logger = logging.getLogger(__name__)
+
+FACE_MODEL_ROOT = os.getenv("FACE_MODEL_ROOT", "~/.insightface")
+FACE_MODEL_PACK = os.getenv("FACE_MODEL_PACK", "buffalo_l")
+
+# ORT session options. Every inference worker thread runs its own session call,
+# so by default the cores are split between them instead of each call trying
+# to use all of them.
+_INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+ORT_INTRA_OP_THREADS = int(os.getenv(
+    "ORT_INTRA_OP_THREADS", str(max(1, (os.cpu_count() or 1) // max(1, _INFERENCE_WORKERS)))
+))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "1"))
+ORT_GRAPH_OPTIMIZATION = os.getenv("ORT_GRAPH_OPTIMIZATION", "extended")
+ORT_PROVIDERS = [p for p in os.getenv("ORT_PROVIDERS", "CUDAExecutionProvider,CPUExecutionProvider").split(",") if p]
+# When set, the optimised graph of each model is written here on first load
+# and read back (with optimisation disabled) on later worker starts.
+ORT_OPTIMIZED_MODEL_DIR = os.getenv("ORT_OPTIMIZED_MODEL_DIR")
+
+_GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+# File of each task in the model packs we use, so that only the needed
+# sessions are ever created. Unknown packs fall back to routing every file.
+MODEL_PACK_FILES: Dict[str, Dict[str, str]] = {
+    "buffalo_l": {"detection": "det_10g.onnx", "recognition": "w600k_r50.onnx",
+                  "landmark_3d_68": "1k3d68.onnx", "landmark_2d_106": "2d106det.onnx",
+                  "genderage": "genderage.onnx"},
+    "buffalo_m": {"detection": "det_2.5g.onnx", "recognition": "w600k_r50.onnx",
+                  "landmark_3d_68": "1k3d68.onnx", "landmark_2d_106": "2d106det.onnx",
+                  "genderage": "genderage.onnx"},
+    "buffalo_s": {"detection": "det_500m.onnx", "recognition": "w600k_mbf.onnx",
+                  "landmark_3d_68": "1k3d68.onnx", "landmark_2d_106": "2d106det.onnx",
+                  "genderage": "genderage.onnx"},
+    "buffalo_sc": {"detection": "det_500m.onnx", "recognition": "w600k_mbf.onnx"},
+    "antelopev2": {"detection": "scrfd_10g_bnkps.onnx", "recognition": "glintr100.onnx",
+                   "landmark_3d_68": "1k3d68.onnx", "landmark_2d_106": "2d106det.onnx",
+                   "genderage": "genderage.onnx"},
+}
+
+
+class SessionConfig:
+    """ONNX Runtime settings shared by every model the registry loads"""
+
+    def __init__(self, intra_op_threads: int = ORT_INTRA_OP_THREADS,
+                 inter_op_threads: int = ORT_INTER_OP_THREADS,
+                 graph_optimization: str = ORT_GRAPH_OPTIMIZATION,
+                 providers: Optional[List[str]] = None,
+                 optimized_model_dir: Optional[str] = ORT_OPTIMIZED_MODEL_DIR):
+        if graph_optimization not in _GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Unknown graph optimization level: {graph_optimization}")
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph_optimization = graph_optimization
+        available = onnxruntime.get_available_providers()
+        self.providers = [p for p in (providers or ORT_PROVIDERS) if p in available] or ["CPUExecutionProvider"]
+        self.optimized_model_dir = os.path.expanduser(optimized_model_dir) if optimized_model_dir else None
+
+    def create_session(self, model_file: str) -> onnxruntime.InferenceSession:
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.graph_optimization_level = _GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization]
+
+        path = model_file
+        cached = self._optimized_path(model_file)
+        if cached is not None:
+            if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(model_file):
+                # Already optimised at this level, skip doing it again
+                path = cached
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+            else:
+                os.makedirs(self.optimized_model_dir, exist_ok=True)
+                options.optimized_model_filepath = cached
+        return onnxruntime.InferenceSession(path, sess_options=options, providers=self.providers)
+
+    def _optimized_path(self, model_file: str) -> Optional[str]:
+        # Optimised graphs can contain provider specific nodes, so only cache CPU ones
+        if self.optimized_model_dir is None or self.providers != ["CPUExecutionProvider"]:
+            return None
+        name = os.path.splitext(os.path.basename(model_file))[0]
+        return os.path.join(
+            self.optimized_model_dir,
+            f"{name}.{self.graph_optimization}.ort{onnxruntime.__version__}.onnx",
+        )
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "graph_optimization": self.graph_optimization,
+            "providers": self.providers,
+            "optimized_model_dir": self.optimized_model_dir,
+        }
+
+
+class FaceModels:
+    """
+    The subset of a model pack a caller asked for.
+
+    Exposes ``models`` (taskname -> model) and ``det_model`` like
+    insightface's FaceAnalysis, without having loaded anything else.
+    """
+
+    def __init__(self, name: str, models: Dict[str, Any]):
+        if "detection" not in models:
+            raise ValueError(f"Model pack {name} has no detection model")
+        self.name = name
+        self.models = models
+        self.det_model = models["detection"]
+
+    def prepare(self, ctx_id: int = 0, det_thresh: float = 0.5, det_size: Tuple[int, int] = (640, 640)) -> None:
+        for taskname, model in self.models.items():
+            if taskname == "detection":
+                model.prepare(ctx_id, input_size=det_size, det_thresh=det_thresh)
+            else:
+                model.prepare(ctx_id)
+
+
+class ModelRegistry:
+    """
+    Per-process cache of face models.
+
+    Each (pack, modules, det_size) combination is loaded once, on first use,
+    and shared by every caller in the process. Only the requested modules get
+    an ONNX Runtime session.
+    """
+
+    def __init__(self, root: str = FACE_MODEL_ROOT, session_config: Optional[SessionConfig] = None):
+        self.root = root
+        self.session_config = session_config or SessionConfig()
+        self._loaded: Dict[Tuple, FaceModels] = {}
+        self._lock = threading.Lock()
+        self.load_seconds: Dict[str, float] = {}
+
+    def get(self, name: str = FACE_MODEL_PACK, modules: Iterable[str] = ("detection", "recognition"),
+            det_size: Tuple[int, int] = (640, 640), det_thresh: float = 0.5) -> FaceModels:
+        key = (name, tuple(sorted(modules)), tuple(det_size), det_thresh)
+        face_models = self._loaded.get(key)
+        if face_models is not None:
+            return face_models
+        with self._lock:
+            face_models = self._loaded.get(key)
+            if face_models is None:
+                started_at = time.perf_counter()
+                face_models = FaceModels(name, self._load(name, set(modules)))
+                face_models.prepare(ctx_id=0, det_thresh=det_thresh, det_size=det_size)
+                self._loaded[key] = face_models
+                elapsed = time.perf_counter() - started_at
+                self.load_seconds["/".join([name, *key[1]])] = round(elapsed, 3)
+                logger.info(f"Loaded {name} {sorted(face_models.models)} in {elapsed:.2f}s")
+        return face_models
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": sorted(self.load_seconds),
+            "load_seconds": dict(self.load_seconds),
+            "session": self.session_config.describe(),
+        }
+
+    def _load(self, name: str, modules: set) -> Dict[str, Any]:
+        model_dir = ensure_available("models", name, root=self.root)
+        known = MODEL_PACK_FILES.get(name, {})
+        files = {m: os.path.join(model_dir, known[m]) for m in modules if m in known}
+        models = {}
+        if len(files) == len(modules) and all(os.path.exists(f) for f in files.values()):
+            for taskname, model_file in sorted(files.items()):
+                models[taskname] = _build_model(model_file, self.session_config.create_session(model_file))
+            return models
+
+        # Unknown pack layout: route every file like FaceAnalysis does and keep the wanted ones
+        logger.warning(f"Model pack {name} is not in MODEL_PACK_FILES, routing every model file")
+        for model_file in sorted(glob.glob(os.path.join(model_dir, "*.onnx"))):
+            model = _build_model(model_file, self.session_config.create_session(model_file))
+            if model is not None and model.taskname in modules and model.taskname not in models:
+                models[model.taskname] = model
+        return models
+
+
+def _build_model(model_file: str, session: onnxruntime.InferenceSession):
+    """Wrap a session in the matching insightface model class (same rules as model_zoo.ModelRouter)"""
+    inputs = session.get_inputs()
+    input_shape = inputs[0].shape
+    if len(session.get_outputs()) >= 5:
+        return RetinaFace(model_file=model_file, session=session)
+    elif input_shape[2] == 192 and input_shape[3] == 192:
+        return Landmark(model_file=model_file, session=session)
+    elif input_shape[2] == 96 and input_shape[3] == 96:
+        return Attribute(model_file=model_file, session=session)
+    elif input_shape[2] == input_shape[3] and input_shape[2] >= 112 and input_shape[2] % 16 == 0:
+        return ArcFaceONNX(model_file=model_file, session=session)
+    logger.warning(f"Model not recognized: {model_file}")
+    return None
+
+
+model_registry = ModelRegistry()
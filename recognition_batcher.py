@@ -0,0 +1,109 @@
+# recognition_batcher.py
+import os
+import time
+import queue
+import threading
+import logging
+from concurrent.futures import Future
+from typing import Any, Dict, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RECOGNITION_MAX_BATCH = int(os.getenv("RECOGNITION_MAX_BATCH", "16"))
+RECOGNITION_MAX_WAIT_MS = float(os.getenv("RECOGNITION_MAX_WAIT_MS", "4"))
+
+
+class _Pending:
+    __slots__ = ("crop", "future")
+
+    def __init__(self, crop: np.ndarray):
+        self.crop = crop
+        self.future: Future = Future()
+
+
+class RecognitionBatcher:
+    """
+    Dynamic batcher for the ArcFace recognition model.
+
+    Aligned face crops submitted by concurrent verifications are collected for
+    at most ``max_wait_ms`` (or until ``max_batch`` crops are waiting) and then
+    run through a single ``get_feats`` call. Each caller gets a Future holding
+    its own embedding.
+    """
+
+    def __init__(self, rec_model, max_batch: int = RECOGNITION_MAX_BATCH,
+                 max_wait_ms: float = RECOGNITION_MAX_WAIT_MS):
+        self.rec_model = rec_model
+        if rec_model.max_batch_size:
+            # Static batch dimension: the model cannot take more than that
+            max_batch = min(max_batch, rec_model.max_batch_size)
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    @property
+    def input_size(self) -> int:
+        return self.rec_model.input_size[0]
+
+    def submit(self, crop: np.ndarray) -> Future:
+        self._ensure_started()
+        pending = _Pending(crop)
+        self._queue.put(pending)
+        return pending.future
+
+    def embed(self, crop: np.ndarray) -> np.ndarray:
+        return self.submit(crop).result()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 3) if self.batches else 0.0,
+            "queue_depth": self._queue.qsize(),
+        }
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="recognition-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self) -> List[_Pending]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                feats = self.rec_model.get_feats([item.crop for item in batch])
+                self.batches += 1
+                self.items += len(batch)
+                for item, feat in zip(batch, feats):
+                    item.future.set_result(np.asarray(feat).flatten())
+            except Exception as e:
+                logger.error(f"Recognition batch of {len(batch)} failed: {str(e)}")
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
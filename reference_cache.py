@@ -0,0 +1,134 @@
+# reference_cache.py
+import os
+import gzip
+import json
+import hashlib
+import threading
+import logging
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+from catalogue_search import CATALOGUES, catalogue_search, normalize
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds a client may reuse a catalogue snapshot or version list before revalidating it with
+# If-None-Match. Search responses are always revalidated, so every search is counted in catalogue_usage
+REFERENCE_CACHE_MAX_AGE = int(os.getenv("REFERENCE_CACHE_MAX_AGE", "300"))
+REFERENCE_SNAPSHOT_GZIP_LEVEL = int(os.getenv("REFERENCE_SNAPSHOT_GZIP_LEVEL", "6"))
+
+SNAPSHOT_FORMATS = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+}
+
+
+def make_etag(*parts: Any) -> str:
+    """Strong ETag over the given parts (catalogue version, query parameters...)"""
+    digest = hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match compares weakly: a W/ prefix from a proxy still matches
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in candidates
+
+
+def cache_headers(etag: str, private: bool = False,
+                  max_age: Optional[int] = REFERENCE_CACHE_MAX_AGE) -> Dict[str, str]:
+    """Caching headers for etag; a max_age of None makes clients revalidate on every use"""
+    scope = "private" if private else "public"
+    freshness = "no-cache" if max_age is None else f"max-age={max_age}"
+    return {"ETag": etag, "Cache-Control": f"{scope}, {freshness}"}
+
+
+def conditional(request: Request, response: Response, etag: str, private: bool = False,
+                max_age: Optional[int] = REFERENCE_CACHE_MAX_AGE) -> Optional[Response]:
+    """
+    Put the caching headers on response; returns a 304 to send instead of
+    the body when the client already holds this ETag.
+    """
+    headers = cache_headers(etag, private, max_age)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def search_not_modified(request: Request, response: Response, name: str, query: str,
+                        limit: int) -> Optional[Response]:
+    """
+    Conditional check for a catalogue search: same catalogue version and
+    parameters, same results. Searches are revalidated every time (no-cache)
+    so that each one reaches the server; record usage before calling this.
+    """
+    version = catalogue_search.index(name).version
+    return conditional(request, response, make_etag(name, version, normalize(query), limit),
+                       private=True, max_age=None)
+
+
+class SnapshotCache:
+    """
+    Whole catalogues serialized and gzipped once per catalogue version, so
+    clients can download a catalogue, search it locally and only fetch it
+    again when the ETag changes.
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[Tuple[str, str], Tuple[str, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, fmt: str = "json") -> Tuple[str, bytes]:
+        """(ETag, gzipped body) of the current version of a catalogue"""
+        if fmt not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Unknown snapshot format: {fmt}")
+        if fmt == "msgpack" and msgpack is None:
+            raise RuntimeError("MessagePack snapshots require msgpack")
+        index = catalogue_search.index(name)
+        cached = self._snapshots.get((name, fmt))
+        if cached is not None and cached[0] == index.version:
+            return make_etag(name, index.version, fmt), cached[1]
+        with self._lock:
+            cached = self._snapshots.get((name, fmt))
+            if cached is None or cached[0] != index.version:
+                document = {"catalogue": name, "version": index.version, "rows": index.rows}
+                body = gzip.compress(_serialize(document, fmt), compresslevel=REFERENCE_SNAPSHOT_GZIP_LEVEL)
+                cached = (index.version, body)
+                self._snapshots[(name, fmt)] = cached
+                logger.info(f"Built {fmt} snapshot of {name}: {len(index.rows)} rows, {len(body)} bytes")
+        return make_etag(name, index.version, fmt), cached[1]
+
+    def versions(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for name in CATALOGUES:
+            index = catalogue_search.index(name)
+            result[name] = {"version": index.version, "entries": len(index)}
+        return result
+
+
+def _serialize(document: Dict[str, Any], fmt: str) -> bytes:
+    if fmt == "msgpack":
+        return msgpack.packb(document, default=_plain)
+    return json.dumps(document, default=_plain, separators=(",", ":")).encode("utf-8")
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+snapshot_cache = SnapshotCache()
@@ -0,0 +1,52 @@
+# routers/catalogues.py
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+import gzip
+import logging
+
+from catalogue_search import CATALOGUES
+from reference_cache import SNAPSHOT_FORMATS, cache_headers, conditional, etag_matches, make_etag, snapshot_cache
+
+router = APIRouter(prefix="/catalogues", tags=["Catalogues"])
+logger = logging.getLogger(__name__)
+
+
+# --- Catalogue versions: poll this, re-download a snapshot when its version changes ---
+@router.get("/")
+def list_catalogues(request: Request, response: Response):
+    try:
+        versions = snapshot_cache.versions()
+    except Exception as e:
+        logger.error(f"Error listing catalogues: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error listing catalogues")
+    not_modified = conditional(request, response, make_etag(versions))
+    if not_modified is not None:
+        return not_modified
+    return versions
+
+
+# --- Whole catalogue for local search on the client ---
+@router.get("/{name}/snapshot")
+def catalogue_snapshot(
+    name: str,
+    request: Request,
+    format: str = Query("json", pattern="^(json|msgpack)$"),
+):
+    if name not in CATALOGUES:
+        raise HTTPException(status_code=404, detail=f"Unknown catalogue '{name}'")
+    try:
+        etag, body = snapshot_cache.get(name, format)
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error building {name} snapshot: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error building catalogue snapshot")
+
+    headers = {**cache_headers(etag), "Vary": "Accept-Encoding"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    # Stored gzipped; only clients that can't take gzip pay for decompression
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+    else:
+        body = gzip.decompress(body)
+    return Response(content=body, media_type=SNAPSHOT_FORMATS[format], headers=headers)
@@ -1,26 +1,260 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import select, text
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, tuple_
 from sqlalchemy.orm import Session
 from datetime import datetime, date
-from typing import List, Optional
+import asyncio
+from typing import List, Optional, Tuple
+import base64
+import json
 import logging
 import anyio
 from websocket_manager import manager
-from db import SessionLocal, Claim, VerificationToken, User
-from schemas import ClaimCreate, ClaimResponse
+from db import SessionLocal, Claim, VerificationToken, User, create_indexes_concurrently
+from schemas import ClaimCreate, ClaimResponse, ClaimListItem, ClaimBatchResponse, ClaimBatchResult
 from security import decode_access_token
 from dependencies import get_current_user, get_db
+from tariff_catalogue import TariffIndex, TariffLookup, tariff_catalogue
+import claim_export
+import claim_stats
+from claim_stats import StatsDelta
 import traceback
-from decimal import Decimal
 import os
 
 router = APIRouter(prefix="/claims", tags=["Claims"])
 logger = logging.getLogger(__name__)
 
+CLAIM_BATCH_MAX = int(os.getenv("CLAIM_BATCH_MAX", "1000"))
+
+# Declared on Claim too, but create_all does not add indexes to an existing claims table
+CLAIM_INDEXES = {
+    "idx_claim_status_created":
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_claim_status_created ON claims (status, created_at)",
+}
+
+
+@router.on_event("startup")
+async def start_tariff_catalogue():
+    tariff_catalogue.start()
+
+
+@router.on_event("startup")
+async def create_claim_indexes():
+    def create():
+        try:
+            create_indexes_concurrently(CLAIM_INDEXES)
+        except Exception as e:
+            logger.error(f"Could not create claim indexes: {str(e)}")
+
+    asyncio.get_running_loop().run_in_executor(None, create)
+
+
+@router.on_event("startup")
+async def build_claim_stats():
+    def build():
+        db = SessionLocal()
+        try:
+            claim_stats.ensure_built(db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Could not build claim stats: {str(e)}")
+        finally:
+            db.close()
+
+    asyncio.get_running_loop().run_in_executor(None, build)
+
+
+@router.on_event("shutdown")
+async def stop_tariff_catalogue():
+    await tariff_catalogue.stop()
+
+
 def calculate_age(dob):
     today = date.today()
     return today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
 
+# Claim list pagination: keyset on (created_at, encounter_token), newest first
+CLAIM_PAGE_DEFAULT = int(os.getenv("CLAIM_PAGE_DEFAULT", "50"))
+CLAIM_PAGE_MAX = int(os.getenv("CLAIM_PAGE_MAX", "500"))
+
+# Columns every list view returns; the JSON line items only when asked for with ?expand=
+_LIST_COLUMNS = (
+    Claim.encounter_token, Claim.service_type, Claim.created_at, Claim.status, Claim.reason,
+    Claim.adjusted_amount, Claim.total_payout, Claim.location, Claim.age,
+    Claim.service_outcome, Claim.service_type_1, Claim.service_type_2, Claim.specialties,
+    Claim.type_of_attendance, Claim.pharmacy, Claim.diagnosis_total, Claim.medical_procedures_total,
+    Claim.lab_tests_total, Claim.drugs_total, Claim.expected_payout,
+)
+_EXPANDABLE = {
+    "diagnosis": Claim.diagnosis,
+    "drugs": Claim.drugs,
+    "medical_procedures": Claim.medical_procedures,
+    "lab_tests": Claim.lab_tests,
+}
+
+
+def _parse_expand(expand: Optional[str]) -> Tuple[str, ...]:
+    fields = tuple(f.strip() for f in (expand or "").split(",") if f.strip())
+    unknown = [f for f in fields if f not in _EXPANDABLE]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot expand {', '.join(unknown)}; expandable: {', '.join(_EXPANDABLE)}",
+        )
+    return fields
+
+
+def _list_columns(expand: Tuple[str, ...]):
+    return [*_LIST_COLUMNS, *(_EXPANDABLE[f] for f in expand)]
+
+
+def _encode_cursor(created_at: datetime, encounter_token: str) -> str:
+    raw = json.dumps([created_at.isoformat(), encounter_token]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, encounter_token = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(encounter_token)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _keyset_page(query, cursor: Optional[str], limit: int, offset: int = 0):
+    """
+    Rows of the page after cursor (newest first) and the cursor of the page
+    after that. offset is for clients still paging the old way and is
+    ignored when a cursor is given.
+    """
+    if cursor:
+        created_at, encounter_token = _decode_cursor(cursor)
+        query = query.filter(tuple_(Claim.created_at, Claim.encounter_token) < (created_at, encounter_token))
+    query = query.order_by(Claim.created_at.desc(), Claim.encounter_token.desc())
+    if offset and not cursor:
+        query = query.offset(offset)
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].encounter_token)
+    return rows, next_cursor
+
+
+def _list_page(response: Response, rows: list, next_cursor: Optional[str]) -> list:
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
+
+
+def _claim_values(claim_data: ClaimCreate, verification: VerificationToken, current_user: User,
+                  tariffs: TariffIndex) -> dict:
+    """Column values for a new claim, with its legend priced from tariffs"""
+    full_name = f"{verification.first_name} {verification.middle_name or ''} {verification.last_name}".strip()
+    age = calculate_age(verification.date_of_birth)
+
+    primary_grdg = None
+    diagnosis_legend = []
+
+    for diag in claim_data.diagnosis or []:
+        gdrg_code = tariffs.gdrg_for(diag.ICD10)
+        tariff = None
+
+        if gdrg_code:
+            if getattr(diag, "primary", False):
+                primary_grdg = gdrg_code
+            tariff = tariffs.diagnosis_tariff(gdrg_code)
+
+        diagnosis_legend.append({
+            "code": diag.ICD10,
+            "tariff": tariff
+        })
+
+    drugs_legend = []
+    for drug in claim_data.drugs:
+        price = tariffs.medicine_price(drug.code)
+        drugs_legend.append({
+            "code": drug.code,
+            "dosage": drug.dosage,
+            "frequency": drug.frequency,
+            "duration": drug.duration,
+            "tariff": price if price else drug.tariff,
+        })
+
+    procedures_legend = []
+    for proc in claim_data.medical_procedures:
+        tariff = tariffs.procedure_tariff(proc.code)
+        procedures_legend.append({
+            "code": proc.code,
+            "tariff": tariff if tariff else proc.tariff
+        })
+
+    labs_legend = []
+    for lab in claim_data.lab_tests or []:
+        tariff = tariffs.investigation_tariff(lab.code)
+        labs_legend.append({
+            "code": lab.code,
+            "tariff": tariff if tariff else lab.tariff
+        })
+
+    legend = {
+        "primary_grdg": primary_grdg,
+        "diagnosis": diagnosis_legend,
+        "drugs": drugs_legend,
+        "procedures": procedures_legend,
+        "labs": labs_legend,
+    }
+
+    drugs_list = [
+        {
+            "code": drug.code,
+            "generic_name": drug.generic_name,
+            "dosage": drug.dosage,
+            "date": drug.date.isoformat(),
+            "frequency": drug.frequency,
+            "duration": drug.duration,
+            "tariff": drug.tariff,
+            "unitOfPricing": drug.unitOfPricing,
+            "levelOfPriscription": drug.levelOfPriscription,
+            "quantity": drug.quantity,
+            "total": drug.total,
+        }
+        for drug in claim_data.drugs
+    ]
+
+    return dict(
+        encounter_token=claim_data.encounter_token,
+        diagnosis=[d.model_dump() for d in claim_data.diagnosis] if claim_data.diagnosis else [],
+        service_type=claim_data.service_type,
+        drugs=drugs_list,
+        medical_procedures=[p.model_dump() for p in claim_data.medical_procedures],
+        lab_tests=[l.model_dump() for l in claim_data.lab_tests] if claim_data.lab_tests else [],
+        created_at=datetime.utcnow(),
+        user_id=current_user.id,
+        status="pending",
+        age=age,
+        reason=None,
+        adjusted_amount=None,
+        total_payout=None,
+        expected_payout=claim_data.expectedPayout,
+        diagnosis_total=claim_data.diagnosis_total,
+        medical_procedures_total=claim_data.medical_procedures_total,
+        lab_tests_total=claim_data.lab_tests_total,
+        drugs_total=claim_data.drugs_total,
+        patient_name=full_name,
+        hospital_name=current_user.hospital_name,
+        location=current_user.location.get("address", "Unknown"),
+        service_outcome=claim_data.service_outcome,
+        service_type_1=claim_data.service_type_1,
+        service_type_2=claim_data.service_type_2,
+        specialties=claim_data.specialties,
+        type_of_attendance=claim_data.type_of_attendance,
+        pharmacy=claim_data.pharmacy or False,
+        legend=legend,
+    )
+
+
 @router.post("/submit", response_model=ClaimResponse)
 def submit_claim(
     claim_data: ClaimCreate,
@@ -36,139 +270,15 @@ def submit_claim(
         if not verification:
             raise HTTPException(status_code=404, detail="Invalid encounter token")
 
-        full_name = f"{verification.first_name} {verification.middle_name or ''} {verification.last_name}".strip()
-        age = calculate_age(verification.date_of_birth)
-
-        def get_tariff(table: str, select_column: str, code_column: str, code_value: str):
-            query = text(f"SELECT {select_column} FROM {table} WHERE {code_column} = :code")
-            result = db.execute(query, {"code": code_value}).fetchone()
-            if result and isinstance(result[0], Decimal):
-                return float(result[0])
-            return result[0] if result else None
-
-        def get_procedure_tariff(code: str):
-            table_map = {
-                "medi": ("medicine_procedures", "medi_code"),
-                "opd": ("opd_procedures", "opd_code"),
-                "dent": ("dent_procedures", "dent_code"),
-                "paed": ("paediatric_procedures", "paed_code"),
-                "surg": ("surgery_procedures", "surg_code"),
-                "ent": ("ent_procedures", "ent_code"),
-            }
-            prefix = code.lower()[:4]
-            table, col = table_map.get(prefix, (None, None))
-            return get_tariff(table, "tariff", col, code) if table else None
-
-        primary_grdg = None
-        diagnosis_legend = []
-
-        for diag in claim_data.diagnosis:
-            gdrg_row = db.execute(
-                text("SELECT gdrg_code FROM icd10_codes WHERE icd_code = :code"),
-                {"code": diag.ICD10}
-            ).fetchone()
-
-            gdrg_code = gdrg_row[0] if gdrg_row else None
-            tariff = None
-
-            if gdrg_code:
-                if getattr(diag, "primary", False):
-                    primary_grdg = gdrg_code
-                tariff_row = db.execute(
-                    text("SELECT tariff FROM icd10_codes WHERE gdrg_code = :code"),
-                    {"code": gdrg_code}
-                ).fetchone()
-                tariff = float(tariff_row[0]) if tariff_row and tariff_row[0] is not None else None
-
-            diagnosis_legend.append({
-                "code": diag.ICD10,
-                "tariff": tariff
-            })
-
-        drugs_legend = []
-        for drug in claim_data.drugs:
-            price = get_tariff("medicines", "price", "code", drug.code)
-            drugs_legend.append({
-                "code": drug.code,
-                "dosage": drug.dosage,
-                "frequency": drug.frequency,
-                "duration": drug.duration,
-                "tariff": price if price else drug.tariff,
-            })
-
-        procedures_legend = []
-        for proc in claim_data.medical_procedures:
-            tariff = get_procedure_tariff(proc.code)
-            procedures_legend.append({
-                "code": proc.code,
-                "tariff": tariff if tariff else proc.tariff
-            })
-
-        labs_legend = []
-        for lab in claim_data.lab_tests or []:
-            tariff = get_tariff("investigations", "tariff", "inv_code", lab.code)
-            labs_legend.append({
-                "code": lab.code,
-                "tariff": tariff if tariff else lab.tariff
-            })
-
-        legend = {
-            "primary_grdg": primary_grdg,
-            "diagnosis": diagnosis_legend,
-            "drugs": drugs_legend,
-            "procedures": procedures_legend,
-            "labs": labs_legend,
-        }
-
-        drugs_list = [
-            {
-                "code": drug.code,
-                "generic_name": drug.generic_name,
-                "dosage": drug.dosage,
-                "date": drug.date.isoformat(),
-                "frequency": drug.frequency,
-                "duration": drug.duration,
-                "tariff": drug.tariff,
-                "unitOfPricing": drug.unitOfPricing,
-                "levelOfPriscription": drug.levelOfPriscription,
-                "quantity": drug.quantity,
-                "total": drug.total,
-            }
-            for drug in claim_data.drugs
-        ]
-
-        new_claim = Claim(
-            encounter_token=claim_data.encounter_token,
-            diagnosis=[d.model_dump() for d in claim_data.diagnosis] if claim_data.diagnosis else [],
-            service_type=claim_data.service_type,
-            drugs=drugs_list,
-            medical_procedures=[p.model_dump() for p in claim_data.medical_procedures],
-            lab_tests=[l.model_dump() for l in claim_data.lab_tests] if claim_data.lab_tests else [],
-            created_at=datetime.utcnow(),
-            user_id=current_user.id,
-            status="pending",
-            age=age,
-            reason=None,
-            adjusted_amount=None,
-            total_payout=None,
-            expected_payout=claim_data.expectedPayout,
-            diagnosis_total=claim_data.diagnosis_total,
-            medical_procedures_total=claim_data.medical_procedures_total,
-            lab_tests_total=claim_data.lab_tests_total,
-            drugs_total=claim_data.drugs_total,
-            patient_name=full_name,
-            hospital_name=current_user.hospital_name,
-            location=current_user.location.get("address", "Unknown"),
-            service_outcome=claim_data.service_outcome,
-            service_type_1=claim_data.service_type_1,
-            service_type_2=claim_data.service_type_2,
-            specialties=claim_data.specialties,
-            type_of_attendance=claim_data.type_of_attendance,
-            pharmacy=claim_data.pharmacy or False,
-            legend=legend,
-        )
+        # Prices come from the in-process catalogue, no per-line queries
+        tariff_catalogue.ensure_loaded()
+        new_claim = Claim(**_claim_values(claim_data, verification, current_user, tariff_catalogue))
 
         db.add(new_claim)
+        stats = StatsDelta()
+        stats.add(new_claim.created_at, new_claim.user_id, new_claim.hospital_name,
+                  new_claim.status, new_claim.expected_payout)
+        stats.apply(db)
         db.commit()
         db.refresh(new_claim)
 
@@ -192,18 +302,109 @@ def submit_claim(
 
 
 
-@router.get("/", response_model=List[ClaimResponse])
+@router.post("/submit-batch", response_model=ClaimBatchResponse)
+def submit_claims_batch(
+    claims: List[ClaimCreate],
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Submit many claims at once (e.g. a facility's end-of-day batch).
+
+    Encounter tokens and existing claims are checked with one query each,
+    every distinct code is priced with one query per tariff table (or from
+    the loaded catalogue), and all valid claims go in with a single
+    multi-row INSERT. Invalid claims are reported per entry and do not stop
+    the rest of the batch.
+    """
+    if len(claims) > CLAIM_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {CLAIM_BATCH_MAX} claims per batch")
+
+    try:
+        tokens = {claim_data.encounter_token for claim_data in claims}
+        verifications = {
+            v.token: v for v in db.query(VerificationToken).filter(VerificationToken.token.in_(tokens))
+        }
+        already_submitted = {
+            token for (token,) in db.query(Claim.encounter_token).filter(Claim.encounter_token.in_(tokens))
+        }
+
+        if tariff_catalogue.loaded:
+            tariffs = tariff_catalogue
+        else:
+            tariffs = TariffLookup.resolve(
+                db,
+                icd_codes=[d.ICD10 for c in claims for d in c.diagnosis or []],
+                drug_codes=[d.code for c in claims for d in c.drugs],
+                procedure_codes=[p.code for c in claims for p in c.medical_procedures],
+                lab_codes=[l.code for c in claims for l in c.lab_tests or []],
+            )
+
+        rows = []
+        results = []
+        seen = set()
+        for claim_data in claims:
+            token = claim_data.encounter_token
+            error = None
+            if token in seen:
+                error = "Duplicate encounter token in batch"
+            elif token not in verifications:
+                error = "Invalid encounter token"
+            elif token in already_submitted:
+                error = "Claim already submitted"
+            else:
+                try:
+                    rows.append(_claim_values(claim_data, verifications[token], current_user, tariffs))
+                except Exception as e:
+                    error = str(e)
+            seen.add(token)
+            results.append(ClaimBatchResult(
+                encounter_token=token,
+                status="failed" if error else "created",
+                error=error,
+            ))
+
+        if rows:
+            db.execute(insert(Claim.__table__), rows)
+            stats = StatsDelta()
+            for row in rows:
+                stats.add(row["created_at"], row["user_id"], row["hospital_name"], row["status"], row["expected_payout"])
+            stats.apply(db)
+            db.commit()
+            # One notification for the whole batch
+            anyio.from_thread.run(manager.send_notification, "2", "pending", len(rows))
+
+        return ClaimBatchResponse(
+            created=len(rows),
+            failed=len(results) - len(rows),
+            results=results,
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        error_trace = traceback.format_exc()
+        logger.error("Error submitting claim batch:\n" + error_trace)
+        raise HTTPException(status_code=500, detail={"error": str(e)})
+
+
+@router.get("/", response_model=List[ClaimListItem], response_model_exclude_unset=True)
 def get_claims(
+    response: Response,
     user_id: Optional[int] = Query(None),
     encounter_token: Optional[str] = Query(None),
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     limit: int = Query(10, ge=1, le=100),
-    offset: int = Query(0, ge=0),
+    offset: int = Query(0, ge=0, deprecated=True),
+    cursor: Optional[str] = Query(None),
+    expand: Optional[str] = Query(None),
     db: Session = Depends(get_db),
 ):
+    expanded = _parse_expand(expand)
     try:
-        query = db.query(Claim)
+        query = db.query(*_list_columns(expanded), Claim.patient_name, Claim.hospital_name)
         if user_id:
             query = query.filter(Claim.user_id == user_id)
         if encounter_token:
@@ -212,11 +413,10 @@ def get_claims(
             query = query.filter(Claim.created_at >= start_date)
         if end_date:
             query = query.filter(Claim.created_at <= end_date)
-        claims = (
-            query.order_by(Claim.created_at.desc()).offset(offset).limit(limit).all()
-        )
-        print("env example", os.getenv("ex"))
-        return claims
+        rows, next_cursor = _keyset_page(query, cursor, limit, offset)
+        return _list_page(response, [dict(row._mapping) for row in rows], next_cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving claims: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -224,6 +424,55 @@ def get_claims(
         )
 
 
+@router.get("/export")
+def export_claims(
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet)$"),
+    status: Optional[List[str]] = Query(None),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    user_id: Optional[int] = Query(None),
+    hospital_name: Optional[str] = Query(None),
+    lines: Optional[str] = Query(None, pattern="^(diagnosis|drugs|medical_procedures|lab_tests)$"),
+    current_user: User = Depends(get_current_user),
+):
+    """Stream matching claims (one row per claim, or per line item with ?lines=) as CSV, NDJSON or Parquet"""
+    if format == "parquet" and claim_export.pyarrow is None:
+        raise HTTPException(
+            status_code=501,
+            detail="Parquet export needs pyarrow, which is not installed on this server; use format=csv or ndjson",
+        )
+    media_type, extension = claim_export.EXPORT_FORMATS[format]
+    columns = claim_export.export_columns(lines)
+    rows = claim_export.iter_claim_rows(
+        status=status, start_date=start_date, end_date=end_date,
+        user_id=user_id, hospital_name=hospital_name, lines=lines,
+    )
+    filename = f"claims-{lines or 'summary'}-{datetime.utcnow():%Y%m%d%H%M%S}.{extension}"
+    logger.info(f"User {current_user.id} exporting claims as {format} (lines={lines})")
+    return StreamingResponse(
+        claim_export.export_chunks(format, rows, columns),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/stats")
+def get_claim_stats(
+    user_id: Optional[int] = Query(None),
+    hospital_name: Optional[str] = Query(None),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    group_by: Optional[str] = Query(None, pattern="^(day|user_id|hospital_name)$"),
+    db: Session = Depends(get_db),
+):
+    """Claim counts and totals per status from the pre-aggregated counters (dates are submission days)"""
+    try:
+        return claim_stats.summarize(db, user_id, hospital_name, start_date, end_date, group_by)
+    except Exception as e:
+        logger.error(f"Error retrieving claim stats: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error retrieving claim stats")
+
+
 from pydantic import BaseModel
 
 class ClaimStatusUpdate(BaseModel):
@@ -237,11 +486,16 @@ def update_claim_status_public(
     db: Session = Depends(get_db),
 ):
     try:
-        claim = db.query(Claim).filter(Claim.encounter_token == encounter_token).first()
+        claim = db.query(Claim).filter(Claim.encounter_token == encounter_token).with_for_update().first()
 
         if not claim:
             raise HTTPException(status_code=404, detail="Claim not found")
 
+        if claim.status != update_data.status:
+            stats = StatsDelta()
+            stats.move(claim.created_at, claim.user_id, claim.hospital_name, claim.status, update_data.status,
+                       claim.expected_payout, claim.total_payout, claim.total_payout)
+            stats.apply(db)
         claim.status = update_data.status
         claim.reason = update_data.reason
 
@@ -250,31 +504,61 @@ def update_claim_status_public(
 
         return claim
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating claim status: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error updating claim status")
 
 
 
-@router.get("/approved", response_model=List[ClaimResponse])
-def get_approved_claims(db: Session = Depends(get_db)):
+@router.get("/approved", response_model=List[ClaimListItem], response_model_exclude_unset=True)
+def get_approved_claims(
+    response: Response,
+    limit: int = Query(CLAIM_PAGE_DEFAULT, ge=1, le=CLAIM_PAGE_MAX),
+    cursor: Optional[str] = Query(None),
+    expand: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
     anyio.from_thread.run(manager.reset_counter, "2", "approved")
-    return get_claims_by_status(db, "approved")
-
-@router.get("/rejected", response_model=List[ClaimResponse])
-def get_rejected_claims(db: Session = Depends(get_db)):
+    rows, next_cursor = get_claims_by_status(db, "approved", limit, cursor, _parse_expand(expand))
+    return _list_page(response, rows, next_cursor)
+
+@router.get("/rejected", response_model=List[ClaimListItem], response_model_exclude_unset=True)
+def get_rejected_claims(
+    response: Response,
+    limit: int = Query(CLAIM_PAGE_DEFAULT, ge=1, le=CLAIM_PAGE_MAX),
+    cursor: Optional[str] = Query(None),
+    expand: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
     anyio.from_thread.run(manager.reset_counter, "2", "rejected")
-    return get_claims_by_status(db, "rejected")
-
-@router.get("/flagged", response_model=List[ClaimResponse])
-def get_flagged_claims(db: Session = Depends(get_db)):
+    rows, next_cursor = get_claims_by_status(db, "rejected", limit, cursor, _parse_expand(expand))
+    return _list_page(response, rows, next_cursor)
+
+@router.get("/flagged", response_model=List[ClaimListItem], response_model_exclude_unset=True)
+def get_flagged_claims(
+    response: Response,
+    limit: int = Query(CLAIM_PAGE_DEFAULT, ge=1, le=CLAIM_PAGE_MAX),
+    cursor: Optional[str] = Query(None),
+    expand: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
     anyio.from_thread.run(manager.reset_counter, "2", "flagged")
-    return get_claims_by_status(db, "flagged")
-
-@router.get("/pending", response_model=List[ClaimResponse])
-def get_pending_claims(db: Session = Depends(get_db)):
+    rows, next_cursor = get_claims_by_status(db, "flagged", limit, cursor, _parse_expand(expand))
+    return _list_page(response, rows, next_cursor)
+
+@router.get("/pending", response_model=List[ClaimListItem], response_model_exclude_unset=True)
+def get_pending_claims(
+    response: Response,
+    limit: int = Query(CLAIM_PAGE_DEFAULT, ge=1, le=CLAIM_PAGE_MAX),
+    cursor: Optional[str] = Query(None),
+    expand: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
     anyio.from_thread.run(manager.reset_counter, "2", "pending")
-    return get_claims_by_status(db, "pending")
+    rows, next_cursor = get_claims_by_status(db, "pending", limit, cursor, _parse_expand(expand))
+    return _list_page(response, rows, next_cursor)
 
 @router.get("/{token}", response_model=ClaimResponse)
 def get_claim_by_token(
@@ -291,61 +575,41 @@ def get_claim_by_token(
         raise HTTPException(status_code=404, detail="Claim not found")
     return claim
 
-def get_claims_by_status(db: Session, status: str):
-    stmt = (
-        select(Claim, VerificationToken, User)
-        .join(
-            VerificationToken,
-            Claim.encounter_token == VerificationToken.token,
-            isouter=True,
+def get_claims_by_status(db: Session, status: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                         expand: Tuple[str, ...] = ()):
+    """One keyset page of claims with a status, newest first, and the cursor of the next page"""
+    query = (
+        db.query(
+            *_list_columns(expand),
+            VerificationToken.first_name,
+            VerificationToken.last_name,
+            User.hospital_name,
         )
-        .join(User, VerificationToken.user_id == User.id, isouter=True)
+        .outerjoin(VerificationToken, Claim.encounter_token == VerificationToken.token)
+        .outerjoin(User, VerificationToken.user_id == User.id)
         .filter(Claim.status == status)
     )
-    claims_with_details = db.execute(stmt).all()
+    rows, next_cursor = _keyset_page(query, cursor, limit or CLAIM_PAGE_DEFAULT)
     results = []
-    for claim, verification, user in claims_with_details:
-        first_name = getattr(verification, "first_name", "") if verification else ""
-        middle_name = getattr(verification, "middle_name", "") if verification else ""
-        last_name = getattr(verification, "last_name", "") if verification else ""
-        patient_name = f"{first_name} {last_name}".strip() if verification else None
-        result = {
-            "encounter_token": claim.encounter_token,
-            "diagnosis": claim.diagnosis,
-            "service_type": claim.service_type,
-            "drugs": claim.drugs,
-            "medical_procedures": claim.medical_procedures,
-            "lab_tests": claim.lab_tests,
-            "created_at": claim.created_at,
-            "status": claim.status,
-            "reason": claim.reason,
-            "adjusted_amount": claim.adjusted_amount,
-            "total_payout": claim.total_payout,
-            "patient_name": patient_name,
-            "location": claim.location,
-            "hospital_name": user.hospital_name if user else None,
-            "service_outcome": claim.service_outcome,
-            "service_type_1": claim.service_type_1,
-            "service_type_2": claim.service_type_2,
-            "specialties": claim.specialties,
-            "type_of_attendance": claim.type_of_attendance,
-            "pharmacy": claim.pharmacy,
-            "diagnosis_total": claim.diagnosis_total,
-            "medical_procedures_total": claim.medical_procedures_total,
-            "lab_tests_total": claim.lab_tests_total,
-            "drugs_total": claim.drugs_total,
-            "expected_payout": claim.expected_payout,
-            "age": claim.age
-        }
+    for row in rows:
+        result = dict(row._mapping)
+        first_name = result.pop("first_name")
+        last_name = result.pop("last_name")
+        # Patient name as recorded on the verification, hospital of the verifying user
+        result["patient_name"] = f"{first_name or ''} {last_name or ''}".strip() if first_name is not None else None
         results.append(result)
-    return results
+    return results, next_cursor
 
 @router.delete("/delete/{encounter_token}")
 def delete_claim(encounter_token: str, db: Session = Depends(get_db)):
     try:
-        claim = db.query(Claim).filter(Claim.encounter_token == encounter_token).first()
+        claim = db.query(Claim).filter(Claim.encounter_token == encounter_token).with_for_update().first()
         if not claim:
             raise HTTPException(status_code=404, detail="Claim not found")
+        stats = StatsDelta()
+        stats.remove(claim.created_at, claim.user_id, claim.hospital_name, claim.status,
+                     claim.expected_payout, claim.total_payout)
+        stats.apply(db)
         db.delete(claim)
         db.commit()
         return {"message": "Claim deleted successfully"}
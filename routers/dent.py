@@ -1,34 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from typing import List, Optional
-from datetime import datetime
 import logging
 
-from db import DentProcedure
 from schemas import DentProcedureResponse
 from dependencies import get_db
+from catalogue_search import catalogue_search
+from catalogue_usage import usage_tracker
+from reference_cache import search_not_modified
 
 router = APIRouter(prefix="/dent", tags=["Dental Procedures"])
 logger = logging.getLogger(__name__)
 
 @router.get("/search", response_model=List[DentProcedureResponse])
 def search_dent_procedures(
+    request: Request,
+    response: Response,
     query: Optional[str] = Query(None, description="Search by dental code or description"),
     limit: int = Query(15, gt=0, le=100, description="Limit the number of results (max 100)"),
     db: Session = Depends(get_db)
 ):
     try:
-        now = datetime.utcnow()
-
         if query:
-            term = f"{query}%"
-            results = db.query(DentProcedure).filter(
-                or_(
-                    DentProcedure.dent_code.ilike(term),
-                    DentProcedure.description.ilike(term)
-                )
-            ).limit(limit).all()
+            results = catalogue_search.search("dent", query, limit)
 
             if not results:
                 raise HTTPException(
@@ -36,14 +30,13 @@ def search_dent_procedures(
                     detail=f"No dental procedures found matching '{query}'"
                 )
 
-            for item in results:
-                item.created_at = now
-            db.commit()
+            usage_tracker.record("dent", results)
+            not_modified = search_not_modified(request, response, "dent", query, limit)
+            if not_modified is not None:
+                return not_modified
 
         else:
-            results = db.query(DentProcedure).order_by(
-                DentProcedure.created_at.desc()
-            ).limit(limit).all()
+            results = usage_tracker.recent(db, "dent", limit)
 
             if not results:
                 raise HTTPException(
@@ -1,10 +1,11 @@
 # routers/dispositions.py
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 import logging
 
-from db import Disposition, User
-from dependencies import get_db, get_current_user
+from db import User
+from dependencies import get_current_user
+from catalogue_search import catalogue_search
+from reference_cache import conditional, make_etag
 
 router = APIRouter(prefix="/dispositions", tags=["Dispositions"])
 logger = logging.getLogger(__name__)
@@ -12,16 +13,20 @@ logger = logging.getLogger(__name__)
 # --- Get all dispositions ---
 @router.get("/")
 def get_dispositions(
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user)
 ):
     try:
-        dispositions = db.query(Disposition).all()
+        index = catalogue_search.index("dispositions")
+        not_modified = conditional(request, response, make_etag("dispositions", index.version), private=True)
+        if not_modified is not None:
+            return not_modified
         return [{
-            "id": d.id,
-            "name": d.name,
-            "description": d.description
-        } for d in dispositions]
+            "id": d["id"],
+            "name": d["name"],
+            "description": d["description"]
+        } for d in sorted(index.rows, key=lambda d: d["id"])]
     except Exception as e:
         logger.error(f"Error fetching dispositions: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error retrieving dispositions")
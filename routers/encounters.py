@@ -4,9 +4,9 @@ from sqlalchemy.orm import Session
 from typing import Optional
 from datetime import datetime
 import uuid
+import os
 import logging
 import time
-from tempfile import SpooledTemporaryFile
 from slowapi.middleware import SlowAPIMiddleware
 import asyncio
 from fastapi.security import OAuth2PasswordBearer
@@ -19,14 +19,35 @@ from db import User, VerificationToken, RecentVisit, Disposition, Claim, Member
 from schemas import InitializeVerificationRequest
 from dependencies import get_db, get_current_user
 from security import decode_access_token
-from utils import FaceComparisonSystem
-from storage import upload_to_s3, generate_s3_key
+from utils import get_face_system, close_face_system
+from inference_pool import InferenceQueueFull
+from face_quality import FaceQualityError
+from frame_ingest import read_upload
+from storage import generate_s3_key
+from upload_outbox import upload_outbox
+from timing import span
+import member_activity
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 router = APIRouter(prefix="/encounter", tags=["Encounters"])
 logger = logging.getLogger(__name__)
-face_system = FaceComparisonSystem()
+# Load the face models in the background at startup instead of on the first verification
+FACE_MODELS_PRELOAD = os.getenv("FACE_MODELS_PRELOAD", "1") == "1"
+
+
+@router.on_event("startup")
+async def preload_face_system():
+    if FACE_MODELS_PRELOAD:
+        asyncio.get_running_loop().run_in_executor(None, get_face_system)
+    upload_outbox.start()
+
+
+@router.on_event("shutdown")
+async def shutdown_face_system():
+    await upload_outbox.stop()
+    await close_face_system()
+
 
 # --- Initialize Encounter ---
 @router.post("/initiate")
@@ -45,6 +66,7 @@ def initialize_verification(
 
         token_id = uuid.uuid4()
         token_string = str(uuid.uuid4())
+        now = datetime.utcnow()
 
         verification_token = VerificationToken(
             id=token_id,
@@ -64,13 +86,16 @@ def initialize_verification(
             ghana_card_number=member.ghana_card_number,
             residential_address=member.residential_address,
             insurance_type=member.insurance_type,
+            verification_date=now,
         )
 
         visit = RecentVisit.create_from_member(member)
         visit.user_id = current_user.id
+        visit.visit_date = now
 
         db.add(verification_token)
         db.add(visit)
+        member_activity.note_verification(db, verification_token, now)
         db.commit()
 
         return {
@@ -99,41 +124,43 @@ async def compare_images(
     token: str = Depends(oauth2_scheme)
 ):
     try:
-        # Decode user token
-        decoded_data = decode_access_token(token)
-        user_email = decoded_data.get("email")
-        if not user_email:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        # Fetch user ID
-        user_id = db.query(User.id).filter(User.email == user_email).scalar()
-        if not user_id:
-            raise HTTPException(status_code=404, detail="User not found")
+        with span("auth"):
+            # Decode user token
+            decoded_data = decode_access_token(token)
+            user_email = decoded_data.get("email")
+            if not user_email:
+                raise HTTPException(status_code=401, detail="Invalid token")
             
-        
-        verification_token = db.query(VerificationToken).filter(
-            VerificationToken.token == verification_token_str
-        ).order_by(VerificationToken.created_at.desc()).first()
-        
-        if not verification_token:
-            raise HTTPException(status_code=404, detail="Invalid verification token.")
+            # Fetch user ID
+            user_id = db.query(User.id).filter(User.email == user_email).scalar()
+            if not user_id:
+                raise HTTPException(status_code=404, detail="User not found")
             
-        # Fetch profile image URL
-        profile_image_url = db.query(Member.profile_image_url).join(
-            VerificationToken, VerificationToken.membership_id == Member.membership_id
-        ).filter(VerificationToken.token == verification_token_str).scalar()
-        
-        if not profile_image_url:
-            raise HTTPException(status_code=404, detail="Profile image not found")
-        
-        # Read the file content before using it
-        file_content = await webcam_image.read()
+        with span("db.lookup"):
+            verification_token = db.query(VerificationToken).filter(
+                VerificationToken.token == verification_token_str
+            ).order_by(VerificationToken.created_at.desc()).first()
+            
+            if not verification_token:
+                raise HTTPException(status_code=404, detail="Invalid verification token.")
+                
+            # Fetch profile image URL
+            profile_image_url = db.query(Member.profile_image_url).join(
+                VerificationToken, VerificationToken.membership_id == Member.membership_id
+            ).filter(VerificationToken.token == verification_token_str).scalar()
+            
+            if not profile_image_url:
+                raise HTTPException(status_code=404, detail="Profile image not found")
         
-        # Reset the file position for face comparison
-        await webcam_image.seek(0)
+        # Read the upload once; the same bytes go to the model and to S3
+        with span("upload.read"):
+            frame = await read_upload(webcam_image)
         
         # Run face comparison
-        comparison_result = await face_system.compare_blobs(profile_image_url, webcam_image)
+        with span("compare"):
+            comparison_result = await get_face_system().compare_blobs(
+                profile_image_url, frame, membership_id=verification_token.membership_id
+            )
         
         # Extract verification status
         is_verified = comparison_result["match_summary"]["is_match"]
@@ -142,20 +169,18 @@ async def compare_images(
         # Generate S3 key
         s3_key = generate_s3_key(str(user_id))
         
-        # Create a new file-like object for S3 upload
-        temp_file = SpooledTemporaryFile()
-        temp_file.write(file_content)
-        temp_file.seek(0)
-        
-        # Upload the image in the background
-        # Pass the temporary file directly to the upload function
-        
-        compare_image_url = await upload_to_s3(temp_file, s3_key)
+        # The frame is uploaded in the background; compare_image_url is filled in once it is stored
+        upload_outbox.enqueue(
+            db, frame.data, s3_key, frame.content_type,
+            verification_token_id=verification_token.id, target_column="compare_image_url"
+        )
         # Update verification record
         verification_token.verification_status = is_verified
         verification_token.final_verification_status = is_verified
-        verification_token.compare_image_url = compare_image_url
-        db.commit()
+        member_activity.note_outcome(db, verification_token)
+        with span("db.commit"):
+            db.commit()
+        upload_outbox.notify()
         
         return {
             "status": "success",
@@ -165,6 +190,12 @@ async def compare_images(
         }
     except HTTPException as e:
         raise e
+    except InferenceQueueFull as e:
+        logger.warning(f"Rejected face comparison: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "2"})
+    except FaceQualityError as e:
+        logger.info(f"Rejected webcam frame ({e.reason}): {e.metrics}")
+        raise HTTPException(status_code=422, detail={"reason": e.reason, "message": str(e)})
     except Exception as e:
         logger.error(f"Error in face comparison: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error in face comparison")
@@ -192,36 +223,48 @@ async def finalize_encounter(
         if not disposition:
             raise HTTPException(status_code=400, detail="Invalid disposition ID")
 
-        file_content = await webcam_image.read()
-        await webcam_image.seek(0)
+        with span("upload.read"):
+            frame = await read_upload(webcam_image)
 
-        comparison_result = await face_system.compare_blobs(
-            token.profile_image_url, webcam_image
-        )
+        with span("compare"):
+            comparison_result = await get_face_system().compare_blobs(
+                token.profile_image_url, frame, membership_id=token.membership_id
+            )
 
         is_verified = comparison_result["match_summary"]["is_match"]
         s3_key = f"encounter/{current_user.id}/{int(time.time())}.jpg"
-        temp_file = SpooledTemporaryFile()
-        temp_file.write(file_content)
-        temp_file.seek(0)
-
-        image_url = await upload_to_s3(temp_file, s3_key)
+        upload_outbox.enqueue(
+            db, frame.data, s3_key, frame.content_type,
+            verification_token_id=token.id, target_column="encounter_image_url"
+        )
 
         token.disposition_name = disposition.name
         token.final_verification_status = is_verified
         token.final_time = datetime.utcnow()
-        token.encounter_image_url = image_url
+        member_activity.note_outcome(db, token)
 
-        db.commit()
+        with span("db.commit"):
+            db.commit()
         db.refresh(token)
+        upload_outbox.notify()
 
         return {
             "status": "success",
             "message": "Encounter finalized",
             "disposition": disposition.name,
             "verified": is_verified,
-            "image_url": image_url
+            # Where the image will be once the background upload has run
+            "image_url": upload_outbox.url_for(s3_key),
+            "image_upload_status": "pending"
         }
+    except InferenceQueueFull as e:
+        db.rollback()
+        logger.warning(f"Rejected encounter finalization: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "2"})
+    except FaceQualityError as e:
+        db.rollback()
+        logger.info(f"Rejected webcam frame ({e.reason}): {e.metrics}")
+        raise HTTPException(status_code=422, detail={"reason": e.reason, "message": str(e)})
     except Exception as e:
         db.rollback()
         logger.error(f"Error finalizing encounter: {str(e)}", exc_info=True)
@@ -330,11 +373,19 @@ async def get_related_verifications(
         if not current_record:
             raise HTTPException(status_code=404, detail="Verification record not found")
         
-        # Fetch related verifications excluding the current token
-        related_verifications = db.query(VerificationToken).filter(
-            VerificationToken.membership_id == current_record.membership_id,
-            VerificationToken.token != token
-        ).order_by(VerificationToken.created_at.desc()).limit(limit).all()
+        # Related verifications excluding the current token: the member's summary
+        # lists the newest encounters, so only those rows are read
+        summary = member_activity.summary_for(db, current_record.membership_id)
+        tokens = member_activity.recent_tokens(summary, limit, exclude=token)
+        if tokens is not None:
+            rows = db.query(VerificationToken).filter(VerificationToken.token.in_(tokens)).all() if tokens else []
+            by_token = {row.token: row for row in rows}
+            related_verifications = [by_token[t] for t in tokens if t in by_token]
+        else:
+            related_verifications = db.query(VerificationToken).filter(
+                VerificationToken.membership_id == current_record.membership_id,
+                VerificationToken.token != token
+            ).order_by(VerificationToken.created_at.desc()).limit(limit).all()
         
         return {"status": "success", "related_verifications": related_verifications}
     
@@ -1,43 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from typing import List, Optional
-from datetime import datetime
 import logging
 
-from db import ENTProcedure
 from schemas import ENTProcedureResponse
 from dependencies import get_db
+from catalogue_search import catalogue_search
+from catalogue_usage import usage_tracker
+from reference_cache import search_not_modified
 
 router = APIRouter(prefix="/ent", tags=["ENT Procedures"])
 logger = logging.getLogger(__name__)
 
 @router.get("/search", response_model=List[ENTProcedureResponse])
 def search_ent_procedures(
+    request: Request,
+    response: Response,
     query: Optional[str] = Query(None, description="Search by ENT code or description"),
     limit: int = Query(15, gt=0, le=100),
     db: Session = Depends(get_db)
 ):
     try:
-        now = datetime.utcnow()
-
         if query:
-            term = f"{query}%"
-            results = db.query(ENTProcedure).filter(
-                or_(
-                    ENTProcedure.ent_code.ilike(term),
-                    ENTProcedure.description.ilike(term)
-                )
-            ).limit(limit).all()
+            results = catalogue_search.search("ent", query, limit)
 
             if not results:
                 raise HTTPException(status_code=404, detail=f"No ENT procedures found for '{query}'")
 
-            for item in results:
-                item.created_at = now
-            db.commit()
+            usage_tracker.record("ent", results)
+            not_modified = search_not_modified(request, response, "ent", query, limit)
+            if not_modified is not None:
+                return not_modified
         else:
-            results = db.query(ENTProcedure).order_by(ENTProcedure.created_at.desc()).limit(limit).all()
+            results = usage_tracker.recent(db, "ent", limit)
 
             if not results:
                 raise HTTPException(status_code=404, detail="No ENT procedures found.")
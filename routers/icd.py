@@ -1,33 +1,48 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from typing import List, Optional
 import logging
 
-from db import ICD10Code
 from schemas import ICD10Response
 from dependencies import get_db
+from catalogue_search import catalogue_search
+from catalogue_usage import usage_tracker
+from reference_cache import search_not_modified
 
 router = APIRouter(prefix="/icd10", tags=["ICD10 Codes"])
 logger = logging.getLogger(__name__)
 
+
+# One background refresher and usage flusher serve every catalogue router
+@router.on_event("startup")
+async def start_catalogue_search():
+    catalogue_search.start()
+    usage_tracker.start()
+
+
+@router.on_event("shutdown")
+async def stop_catalogue_search():
+    await catalogue_search.stop()
+    await usage_tracker.stop()
+
+
 @router.get("/search", response_model=List[ICD10Response])
 def search_icd_codes(
+    request: Request,
+    response: Response,
     query: Optional[str] = Query(None, description="Search by ICD code or diagnosis"),
     limit: int = Query(15, ge=1, le=100, description="Limit the number of results"),
     db: Session = Depends(get_db)
 ) -> List[ICD10Response]:
     try:
         if query:
-            term = f"{query}%"
-            results = db.query(ICD10Code).filter(
-                or_(
-                    ICD10Code.icd_code.ilike(term),
-                    ICD10Code.diagnosis_description.ilike(term)
-                )
-            ).limit(limit).all()
+            results = catalogue_search.search("icd10", query, limit)
+            usage_tracker.record("icd10", results)
+            not_modified = search_not_modified(request, response, "icd10", query, limit)
+            if not_modified is not None:
+                return not_modified
         else:
-            results = db.query(ICD10Code).order_by(ICD10Code.created_at.desc()).limit(limit).all()
+            results = usage_tracker.recent(db, "icd10", limit)
 
         return results
 
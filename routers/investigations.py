@@ -1,34 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from typing import List, Optional
-from datetime import datetime
 import logging
 
-from db import Investigation
 from schemas import InvestigationResponse
 from dependencies import get_db
+from catalogue_search import catalogue_search
+from catalogue_usage import usage_tracker
+from reference_cache import search_not_modified
 
 router = APIRouter(prefix="/investigations", tags=["Investigations"])
 logger = logging.getLogger(__name__)
 
 @router.get("/search", response_model=List[InvestigationResponse])
 def search_investigations(
+    request: Request,
+    response: Response,
     query: Optional[str] = Query(None, description="Search by investigation code or name"),
     limit: int = Query(15, gt=0, le=100, description="Limit the number of results (max 100)"),
     db: Session = Depends(get_db)
 ):
     try:
-        now = datetime.utcnow()
-
         if query:
-            term = f"{query}%"
-            investigations = db.query(Investigation).filter(
-                or_(
-                    Investigation.inv_code.ilike(term),
-                    Investigation.name.ilike(term)
-                )
-            ).limit(limit).all()
+            investigations = catalogue_search.search("investigations", query, limit)
 
             if not investigations:
                 raise HTTPException(
@@ -36,16 +30,15 @@ def search_investigations(
                     detail=f"No investigations found matching '{query}'"
                 )
 
-            # Update created_at to reflect recent search
-            for item in investigations:
-                item.created_at = now
-            db.commit()
+            # Count the hit towards the recently used listing
+            usage_tracker.record("investigations", investigations)
+            not_modified = search_not_modified(request, response, "investigations", query, limit)
+            if not_modified is not None:
+                return not_modified
 
         else:
             # No query: return the most recently accessed records
-            investigations = db.query(Investigation).order_by(
-                Investigation.created_at.desc()
-            ).limit(limit).all()
+            investigations = usage_tracker.recent(db, "investigations", limit)
 
             if not investigations:
                 raise HTTPException(
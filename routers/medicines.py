@@ -1,14 +1,14 @@
 # routers/medicines.py
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from typing import List, Optional
-from datetime import datetime
 import logging
 
-from db import Medicines
 from schemas import MedicineResponse
 from dependencies import get_db
+from catalogue_search import catalogue_search
+from catalogue_usage import usage_tracker
+from reference_cache import search_not_modified
 
 router = APIRouter(prefix="/medicines", tags=["Medicines"])
 logger = logging.getLogger(__name__)
@@ -16,25 +16,21 @@ logger = logging.getLogger(__name__)
 # --- Search medicines ---
 @router.get("/search", response_model=List[MedicineResponse])
 def search_medicines(
+    request: Request,
+    response: Response,
     query: Optional[str] = Query(None, description="Search by code or generic name"),
     limit: int = Query(15, description="Limit results"),
     db: Session = Depends(get_db)
 ):
     try:
         if query:
-            term = f"{query}%"
-            medicines = db.query(Medicines).filter(
-                or_(
-                    Medicines.code.ilike(term),
-                    Medicines.generic_name.ilike(term)
-                )
-            ).limit(limit).all()
-
-            for med in medicines:
-                med.created_at = datetime.utcnow()
-            db.commit()
+            medicines = catalogue_search.search("medicines", query, limit)
+            usage_tracker.record("medicines", medicines)
+            not_modified = search_not_modified(request, response, "medicines", query, limit)
+            if not_modified is not None:
+                return not_modified
         else:
-            medicines = db.query(Medicines).order_by(Medicines.created_at.desc()).limit(limit).all()
+            medicines = usage_tracker.recent(db, "medicines", limit)
 
         return medicines
     except Exception as e:
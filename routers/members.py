@@ -1,17 +1,40 @@
 # routers/members.py
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
-from typing import Optional
+import asyncio
 import logging
 
-from db import Member, RecentVisit, VerificationToken
+import member_activity
+import member_search
+from db import SessionLocal, Member
 from schemas import MemberResponse
 from dependencies import get_db
 
 router = APIRouter(prefix="/members", tags=["Members"])
 logger = logging.getLogger(__name__)
 
+
+@router.on_event("startup")
+async def prepare_member_search():
+    def prepare():
+        # Backfill first: reads go to the source tables until it is done, the indexes only speed things up
+        db = SessionLocal()
+        try:
+            member_activity.ensure_built(db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Could not build member activity summaries: {str(e)}")
+        finally:
+            db.close()
+        try:
+            member_search.ensure_indexes()
+            member_activity.ensure_indexes()
+        except Exception as e:
+            logger.error(f"Could not create member search indexes: {str(e)}")
+
+    asyncio.get_running_loop().run_in_executor(None, prepare)
+
+
 # --- Autocomplete members by search query ---
 @router.get("/autocomplete")
 def autocomplete_memberships(
@@ -21,76 +44,7 @@ def autocomplete_memberships(
     db: Session = Depends(get_db)
 ):
     try:
-        subquery = (
-            db.query(
-                VerificationToken.membership_id,
-                VerificationToken.final_verification_status,
-                VerificationToken.disposition_name,
-                func.max(VerificationToken.verification_date).label("latest_verification_date")
-            )
-            .group_by(
-                VerificationToken.membership_id,
-                VerificationToken.final_verification_status,
-                VerificationToken.disposition_name
-            )
-            .subquery()
-        )
-
-        results = (
-            db.query(
-                Member,
-                RecentVisit.visit_date,
-                subquery.c.final_verification_status,
-                subquery.c.disposition_name
-            )
-            .outerjoin(RecentVisit, RecentVisit.membership_id == Member.membership_id)
-            .outerjoin(subquery, subquery.c.membership_id == Member.membership_id)
-            .filter(
-                or_(
-                    Member.membership_id.ilike(f"%{query}%"),
-                    Member.first_name.ilike(f"%{query}%"),
-                    Member.middle_name.ilike(f"%{query}%"),
-                    Member.last_name.ilike(f"%{query}%"),
-                    Member.nhis_number.ilike(f"%{query}%")
-                )
-            )
-            .order_by(Member.last_name, RecentVisit.visit_date.desc(), subquery.c.latest_verification_date.desc())
-            .offset(offset)
-            .limit(limit)
-            .all()
-        )
-
-        members = []
-        seen_ids = set()
-
-        for member, visit_date, status, disposition in results:
-            if str(member.id) in seen_ids:
-                continue
-
-            seen_ids.add(str(member.id))
-            members.append({
-                "membership_id": member.membership_id,
-                "first_name": member.first_name,
-                "middle_name": member.middle_name,
-                "last_name": member.last_name,
-                "date_of_birth": member.date_of_birth.isoformat(),
-                "gender": member.gender,
-                "marital_status": member.marital_status,
-                "nhis_number": member.nhis_number,
-                "insurance_type": member.insurance_type,
-                "issue_date": member.issue_date.isoformat(),
-                "enrolment_status": member.enrolment_status,
-                "current_expiry_date": member.current_expiry_date.isoformat(),
-                "phone_number": member.mobile_phone_number,
-                "residential_address": member.residential_address,
-                "ghana_card_number": member.ghana_card_number,
-                "profile_image_url": member.profile_image_url,
-                "last_visit": visit_date.isoformat() if visit_date else None,
-                "final_verification_status": status,
-                "disposition_name": disposition,
-            })
-
-        return {"results": members}
+        return {"results": member_search.autocomplete(db, query, limit, offset)}
     except Exception as e:
         logger.error(f"Error during member autocomplete: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to fetch members")
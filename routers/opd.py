@@ -1,34 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from typing import List, Optional
-from datetime import datetime
 import logging
 
-from db import OPDProcedure
 from schemas import OPDProcedureResponse
 from dependencies import get_db
+from catalogue_search import catalogue_search
+from catalogue_usage import usage_tracker
+from reference_cache import search_not_modified
 
 router = APIRouter(prefix="/opd", tags=["OPD Procedures"])
 logger = logging.getLogger(__name__)
 
 @router.get("/search", response_model=List[OPDProcedureResponse])
 def search_opd_procedures(
+    request: Request,
+    response: Response,
     query: Optional[str] = Query(None, description="Search by OPD code or name"),
     limit: int = Query(15, gt=0, le=100, description="Limit the number of results (max 100)"),
     db: Session = Depends(get_db)
 ):
     try:
-        now = datetime.utcnow()
-
         if query:
-            term = f"{query}%"
-            results = db.query(OPDProcedure).filter(
-                or_(
-                    OPDProcedure.opd_code.ilike(term),
-                    OPDProcedure.name.ilike(term)
-                )
-            ).limit(limit).all()
+            results = catalogue_search.search("opd", query, limit)
 
             if not results:
                 raise HTTPException(
@@ -36,14 +30,13 @@ def search_opd_procedures(
                     detail=f"No OPD procedures found matching '{query}'"
                 )
 
-            for item in results:
-                item.created_at = now
-            db.commit()
+            usage_tracker.record("opd", results)
+            not_modified = search_not_modified(request, response, "opd", query, limit)
+            if not_modified is not None:
+                return not_modified
 
         else:
-            results = db.query(OPDProcedure).order_by(
-                OPDProcedure.created_at.desc()
-            ).limit(limit).all()
+            results = usage_tracker.recent(db, "opd", limit)
 
             if not results:
                 raise HTTPException(
@@ -1,14 +1,14 @@
 # routers/services.py
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from typing import List, Optional
-from datetime import datetime
 import logging
 
-from db import SessionLocal, ServiceTariffs
 from schemas import ServiceResponse
 from dependencies import get_db
+from catalogue_search import catalogue_search
+from catalogue_usage import usage_tracker
+from reference_cache import search_not_modified
 
 router = APIRouter(prefix="/services", tags=["Services"])
 logger = logging.getLogger(__name__)
@@ -16,25 +16,21 @@ logger = logging.getLogger(__name__)
 # --- Search services ---
 @router.get("/search", response_model=List[ServiceResponse])
 def search_services(
+    request: Request,
+    response: Response,
     query: Optional[str] = Query(None, description="Search by code or service name"),
     limit: int = Query(15, description="Limit results"),
     db: Session = Depends(get_db)
 ):
     try:
         if query:
-            term = f"{query}%"
-            services = db.query(ServiceTariffs).filter(
-                or_(
-                    ServiceTariffs.code.ilike(term),
-                    ServiceTariffs.service.ilike(term)
-                )
-            ).limit(limit).all()
-
-            for s in services:
-                s.created_at = datetime.utcnow()
-            db.commit()
+            services = catalogue_search.search("services", query, limit)
+            usage_tracker.record("services", services)
+            not_modified = search_not_modified(request, response, "services", query, limit)
+            if not_modified is not None:
+                return not_modified
         else:
-            services = db.query(ServiceTariffs).order_by(ServiceTariffs.created_at.desc()).limit(limit).all()
+            services = usage_tracker.recent(db, "services", limit)
 
         return services
     except Exception as e:
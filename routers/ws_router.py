@@ -1,15 +1,37 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Optional
+from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect
 from websocket_manager import manager  
 
 router = APIRouter()
 
+
+@router.on_event("startup")
+async def start_notifications():
+    await manager.start()
+
+
+@router.on_event("shutdown")
+async def stop_notifications():
+    await manager.stop()
+
+
 @router.websocket("/ws/notifications/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(user_id, websocket)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    user_id: str,
+    statuses: Optional[str] = Query(None),
+    delta: bool = Query(False),
+):
+    # ?statuses=approved,flagged limits the counters sent; ?delta=true sends only the ones that changed
+    subscribed = [s.strip() for s in statuses.split(",") if s.strip()] if statuses else None
+    await manager.connect(user_id, websocket, statuses=subscribed, delta=delta)
     try:
         while True:
             message = await websocket.receive_text()
             if message == "reset_pending":
                 await manager.reset_counter(user_id)
-    except WebSocketDisconnect:
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the manager already closed a slow socket
+        pass
+    finally:
         manager.disconnect(user_id, websocket)
@@ -1,34 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from typing import List, Optional
-from datetime import datetime
 import logging
 
-from db import ZoomCode
 from schemas import ZoomCodeResponse
 from dependencies import get_db
+from catalogue_search import catalogue_search
+from catalogue_usage import usage_tracker
+from reference_cache import search_not_modified
 
 router = APIRouter(prefix="/zoom", tags=["Zoom Codes"])
 logger = logging.getLogger(__name__)
 
 @router.get("/search", response_model=List[ZoomCodeResponse])
 def search_zoom_codes(
+    request: Request,
+    response: Response,
     query: Optional[str] = Query(None, description="Search by Zoom code or description"),
     limit: int = Query(15, gt=0, le=100, description="Limit the number of results (max 100)"),
     db: Session = Depends(get_db)
 ):
     try:
-        now = datetime.utcnow()
-
         if query:
-            term = f"{query}%"
-            results = db.query(ZoomCode).filter(
-                or_(
-                    ZoomCode.zoom_code.ilike(term),
-                    ZoomCode.description.ilike(term)
-                )
-            ).limit(limit).all()
+            results = catalogue_search.search("zoom", query, limit)
 
             if not results:
                 raise HTTPException(
@@ -36,14 +30,13 @@ def search_zoom_codes(
                     detail=f"No Zoom codes found matching '{query}'"
                 )
 
-            for item in results:
-                item.created_at = now
-            db.commit()
+            usage_tracker.record("zoom", results)
+            not_modified = search_not_modified(request, response, "zoom", query, limit)
+            if not_modified is not None:
+                return not_modified
 
         else:
-            results = db.query(ZoomCode).order_by(
-                ZoomCode.created_at.desc()
-            ).limit(limit).all()
+            results = usage_tracker.recent(db, "zoom", limit)
 
             if not results:
                 raise HTTPException(
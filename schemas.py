@@ -412,6 +412,51 @@ class ClaimResponse(BaseModel):
     
 
 
+class ClaimListItem(BaseModel):
+    """Claim in a list view; the line-item JSON fields are only present when expanded"""
+    encounter_token: str
+    diagnosis: Optional[List[DiagnosisItem]] = None
+    service_type: List[str]
+    drugs: Optional[List[Drug]] = None
+    medical_procedures: Optional[List[MedicalProcedure]] = None
+    lab_tests: Optional[List[LabTest]] = None
+
+    created_at: datetime
+    status: str
+    reason: Optional[str] = None
+    adjusted_amount: Optional[float] = None
+    total_payout: Optional[float] = None
+
+    patient_name: Optional[str] = None
+    hospital_name: Optional[str] = None
+    location: str
+    age: Optional[int] = None
+
+    service_outcome: Optional[str] = None
+    service_type_1: Optional[str] = None
+    service_type_2: Optional[str] = None
+    specialties: Optional[List[str]] = None
+    type_of_attendance: Optional[str] = None
+    pharmacy: bool = False
+    diagnosis_total: Optional[float] = None
+    medical_procedures_total: Optional[float] = None
+    lab_tests_total: Optional[float] = None
+    drugs_total: Optional[float] = None
+    expectedPayout: Optional[float] = Field(None, alias="expected_payout")
+
+
+class ClaimBatchResult(BaseModel):
+    encounter_token: str
+    status: str  # created / failed
+    error: Optional[str] = None
+
+
+class ClaimBatchResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[ClaimBatchResult]
+
+
 class ClaimStatusUpdate(BaseModel):
     status: str
     reason: Optional[str] = None
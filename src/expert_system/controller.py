@@ -1,5 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+import os
 import logging
+import anyio
 from .types import IDiagnosis, IPagination
 from sqlalchemy.orm import Session
 from dependencies import get_db, get_current_user
@@ -7,11 +9,15 @@ from .models import Diagnosis, DiagnosisTreatment
 from typing import Optional
 from sqlalchemy import or_
 from db import Claim
-from .utils.process_claim import process_claim
+from .utils.process_claim import process_claim, process_claims_batch
+from websocket_manager import manager
+from .rules_engine import rules_engine
 
 router = APIRouter(prefix="/expert-system", tags=["Expert System"])
 logger = logging.getLogger(__name__)
 
+EXPERT_BATCH_MAX = int(os.getenv("EXPERT_BATCH_MAX", "5000"))
+
 @router.post("/diagnoses/create")
 def add_diagnosis(
     params: IDiagnosis, 
@@ -40,6 +46,7 @@ def add_diagnosis(
         db.add(new_diagnosis)
         db.commit()
         db.refresh(new_diagnosis)
+        rules_engine.invalidate()
 
         return {
             "message": "Diagnosis and treatments added successfully",
@@ -130,6 +137,7 @@ def update_diagnosis(
 
         db.commit()
         db.refresh(diagnosis)
+        rules_engine.invalidate()
 
         return {
             "message": "Diagnosis updated successfully",
@@ -158,6 +166,7 @@ def delete_diagnosis(
 
         db.delete(diagnosis)
         db.commit()
+        rules_engine.invalidate()
 
         return {"message": "Diagnosis deleted successfully"}
 
@@ -171,7 +180,37 @@ def process_nhia_claim(
 ):
     try:
         claim = db.query(Claim).filter(Claim.status == "pending").first()
-        process_claim(claim, db)
+        if not claim:
+            return {"message": "No pending claims"}
+        decision = process_claim(claim, db)
+        if decision is None:
+            return {"encounter_token": claim.encounter_token, "status": claim.status}
+        return {
+            "encounter_token": claim.encounter_token,
+            "status": "pending" if decision.escalate else decision.status,
+            "escalated": decision.escalate,
+            "approved_total": decision.approved_total,
+            "reasons": decision.reasons,
+            "escalation_reasons": decision.escalation_reasons,
+        }
     except Exception as e:
         logger.error(f"Error processing claim: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Error processing claim")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Error processing claim")
+
+
+@router.post("/process-batch")
+def process_nhia_claim_batch(
+    limit: int = Query(500, ge=1, le=EXPERT_BATCH_MAX),
+    db: Session = Depends(get_db)
+):
+    try:
+        result = process_claims_batch(db, limit)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error processing claim batch: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error processing claim batch")
+
+    for status in ("approved", "flagged", "rejected"):
+        if result["counts"][status]:
+            anyio.from_thread.run(manager.send_notification, "2", status, result["counts"][status])
+    return result
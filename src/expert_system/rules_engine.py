@@ -0,0 +1,371 @@
+# src/expert_system/rules_engine.py
+import os
+import re
+import json
+import time
+import random
+import threading
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Every diagnosis with its treatments, in insertion order. Plain SQL so the
+# SQLAlchemy app and the psycopg2 adjudication worker load the same rows.
+RULES_SQL = """
+    SELECT d.diagnosis_icd10, t.drug_icd10, t.frequency, t.duration, t.pricing,
+           t.min_age_months, t.max_age_months
+    FROM diagnoses d
+    LEFT JOIN diagnosis_treatments t ON t.diagnosis_id = d.id
+    ORDER BY d.id, t.id
+"""
+
+# Row counts plus a hash over every column of both rule tables: changes on insert, delete or edit
+RULES_STAMP_SQL = """
+    SELECT (SELECT count(*) FROM diagnoses),
+           (SELECT coalesce(sum(hashtext(d::text)::bigint), 0) FROM diagnoses d),
+           (SELECT count(*) FROM diagnosis_treatments),
+           (SELECT coalesce(sum(hashtext(t::text)::bigint), 0) FROM diagnosis_treatments t)
+"""
+
+# How often a process compares its rules with the tables; edits made by another
+# process (API worker or adjudication worker) are picked up within this time
+RULES_REFRESH_SECONDS = float(os.getenv("RULES_REFRESH_SECONDS", "60"))
+
+_LEADING_NUMBER = re.compile(r"\s*(\d+(?:\.\d+)?)")
+
+
+class TreatmentRule:
+    __slots__ = ("diagnosis", "drug_code", "frequency", "duration", "pricing", "min_age_months", "max_age_months")
+
+    def __init__(self, diagnosis: str, drug_code: str, frequency: Optional[int], duration: Optional[int],
+                 pricing: Optional[float], min_age_months: Optional[int], max_age_months: Optional[int]):
+        self.diagnosis = diagnosis
+        self.drug_code = drug_code
+        self.frequency = frequency
+        self.duration = duration
+        self.pricing = pricing
+        self.min_age_months = min_age_months
+        self.max_age_months = max_age_months
+
+    @property
+    def has_age_bounds(self) -> bool:
+        return bool(self.min_age_months) or bool(self.max_age_months)
+
+    def admits_age(self, age_months: int) -> bool:
+        if self.min_age_months and age_months < self.min_age_months:
+            return False
+        if self.max_age_months and age_months > self.max_age_months:
+            return False
+        return True
+
+
+class RuleSet:
+    """Diagnosis -> drug -> TreatmentRule, built once from the rule tables"""
+
+    def __init__(self, rules: Optional[Dict[str, Dict[str, TreatmentRule]]] = None):
+        self._rules = rules or {}
+        self.loaded_at = time.time()
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Any]) -> "RuleSet":
+        """Compile rows shaped like RULES_SQL (tuples or mappings)"""
+        rules: Dict[str, Dict[str, TreatmentRule]] = {}
+        for row in rows:
+            if isinstance(row, Mapping):
+                row = tuple(row[k] for k in ("diagnosis_icd10", "drug_icd10", "frequency", "duration",
+                                             "pricing", "min_age_months", "max_age_months"))
+            diagnosis, drug_code, frequency, duration, pricing, min_age, max_age = row
+            treatments = rules.setdefault(_normalise_code(diagnosis), {})
+            if drug_code is None:
+                # Diagnosis without treatments: known, but covers no drug
+                continue
+            # First treatment of a drug wins, as with the old per-diagnosis lookup
+            treatments.setdefault(drug_code, TreatmentRule(
+                diagnosis, drug_code, frequency, duration,
+                float(pricing) if pricing is not None else None, min_age, max_age,
+            ))
+        return cls(rules)
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def knows(self, diagnosis: str) -> bool:
+        return _normalise_code(diagnosis) in self._rules
+
+    def treatments(self, diagnosis: str) -> Dict[str, TreatmentRule]:
+        return self._rules.get(_normalise_code(diagnosis), {})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "diagnoses": len(self._rules),
+            "treatments": sum(len(t) for t in self._rules.values()),
+            "loaded_at": self.loaded_at,
+        }
+
+
+@dataclass
+class Decision:
+    """
+    Outcome of adjudicating a claim against the rules.
+
+    When ``escalate`` is set the rules could not decide the claim on their
+    own and it should go to the assistant; the other fields are then only
+    informative.
+    """
+    status: str
+    approved_total: float
+    flagged_excess: float
+    reasons: List[str] = field(default_factory=list)
+    escalate: bool = False
+    escalation_reasons: List[str] = field(default_factory=list)
+
+    def as_response(self) -> Dict[str, Any]:
+        """Same shape as a validated assistant response"""
+        reason = "; ".join(self.reasons) if self.reasons else "All lines within treatment rules"
+        return {
+            "claim_status": self.status,
+            "approved_total": self.approved_total,
+            "flagged_excess": self.flagged_excess,
+            "reason": f"Rules engine: calculated total of {self.approved_total:.2f}. {reason}",
+        }
+
+
+class RulesEngine:
+    """
+    Deterministic claim adjudication from the diagnosis/treatment rules.
+
+    Each drug on a claim is checked against the treatments of every diagnosis
+    on the claim (primary diagnosis first): it must be covered, the patient's
+    age must be within the treatment's bounds, and frequency and duration are
+    capped to the allowed values before pricing. Diagnosis, procedure and lab
+    lines are paid at their legend tariffs.
+
+    Anything the rules cannot settle - no known diagnosis, a drug that only an
+    unknown diagnosis could cover, unparseable quantities, a missing price or
+    age - escalates the claim instead of guessing.
+    """
+
+    def __init__(self, rules: Optional[RuleSet] = None, refresh_seconds: float = RULES_REFRESH_SECONDS):
+        self.rules = rules or RuleSet()
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self.loaded = rules is not None
+        # RULES_STAMP_SQL result the loaded rules were read under, and when it was last compared
+        self.stamp: Optional[Tuple] = None
+        self.checked_at = 0.0
+
+    def load(self, rows: Iterable[Any], stamp: Optional[Tuple] = None) -> RuleSet:
+        rules = RuleSet.from_rows(rows)
+        with self._lock:
+            self.rules = rules
+            self.stamp = stamp
+            self.checked_at = time.monotonic()
+            self.loaded = True
+        logger.info(f"Rules engine loaded {len(rules)} diagnoses")
+        return rules
+
+    def load_from_session(self, db) -> RuleSet:
+        from sqlalchemy import text
+        stamp = tuple(db.execute(text(RULES_STAMP_SQL)).one())
+        return self.load(db.execute(text(RULES_SQL)).fetchall(), stamp)
+
+    def refresh_due(self) -> bool:
+        return not self.loaded or time.monotonic() - self.checked_at >= self.refresh_seconds
+
+    def sync(self, stamp: Tuple, fetch_rows: Callable[[], Iterable[Any]]) -> bool:
+        """
+        Reload from fetch_rows() unless the rules were loaded under the same
+        stamp; returns whether they were reloaded. The stamp is read before
+        the rows, so an edit in between only causes one more reload.
+        """
+        if self.loaded and tuple(stamp) == self.stamp:
+            self.checked_at = time.monotonic()
+            return False
+        self.load(fetch_rows(), tuple(stamp))
+        return True
+
+    def ensure_loaded(self, db) -> None:
+        """Load the rules, or reload them if the rule tables changed (checked every refresh_seconds)"""
+        if not self.refresh_due():
+            return
+        from sqlalchemy import text
+        stamp = db.execute(text(RULES_STAMP_SQL)).one()
+        self.sync(stamp, lambda: db.execute(text(RULES_SQL)).fetchall())
+
+    def invalidate(self) -> None:
+        """Reload on next use; for edits made through this process, others notice the stamp change"""
+        self.loaded = False
+
+    def adjudicate(self, claim: Mapping[str, Any], age_months: Optional[int] = None) -> Decision:
+        rules = self.rules
+        reasons: List[str] = []
+        escalation: List[str] = []
+
+        diagnoses = _claim_diagnoses(claim.get("diagnosis"))
+        known = [code for code in diagnoses if rules.knows(code)]
+        unknown = [code for code in diagnoses if not rules.knows(code)]
+        if not known:
+            escalation.append("No claimed diagnosis has treatment rules")
+
+        drugs_total = 0.0
+        approved_drugs = 0
+        for drug in _json_list(claim.get("drugs")):
+            code = drug.get("code")
+            candidates = [rules.treatments(d)[code] for d in known if code in rules.treatments(d)]
+            if not candidates:
+                if unknown:
+                    escalation.append(f"{code}: may be covered by {', '.join(unknown)}, which has no rules")
+                else:
+                    reasons.append(f"Drug '{code}' is not covered")
+                continue
+
+            if age_months is None:
+                if any(c.has_age_bounds for c in candidates):
+                    escalation.append(f"{code}: patient age unknown")
+                    continue
+                treatment = candidates[0]
+            else:
+                treatment = next((c for c in candidates if c.admits_age(age_months)), None)
+                if treatment is None:
+                    reasons.append(f"{code}: Patient is {age_months // 12} years, outside the age limits")
+                    continue
+
+            frequency = _number(drug.get("frequency"))
+            duration = _number(drug.get("duration"))
+            if frequency is None or duration is None:
+                escalation.append(f"{code}: unreadable frequency or duration")
+                continue
+            if treatment.frequency and frequency > treatment.frequency:
+                reasons.append(f"{code}: Frequency {frequency:g} exceeds allowed {treatment.frequency}")
+                frequency = treatment.frequency
+            if treatment.duration and duration > treatment.duration:
+                reasons.append(f"{code}: Duration {duration:g} exceeds allowed {treatment.duration}")
+                duration = treatment.duration
+            if not frequency or treatment.pricing is None:
+                escalation.append(f"{code}: no usable frequency or price in the treatment rule")
+                continue
+
+            drugs_total += (24 / frequency) * duration * treatment.pricing
+            approved_drugs += 1
+
+        services_total = 0.0
+        legend = claim.get("legend") or {}
+        if isinstance(legend, str):
+            legend = json.loads(legend)
+        for section in ("diagnosis", "procedures", "labs"):
+            for item in legend.get(section) or []:
+                tariff = item.get("tariff")
+                if tariff is None:
+                    escalation.append(f"{item.get('code')}: no tariff for {section} line")
+                    continue
+                services_total += float(tariff)
+
+        approved_total = round(drugs_total + services_total, 2)
+        expected = float(claim.get("expected_payout") or 0)
+        flagged_excess = round(max(0.0, expected - approved_total), 2)
+        if approved_total <= 0 and approved_drugs == 0:
+            status = "rejected"
+        elif reasons:
+            status = "flagged"
+        else:
+            status = "approved"
+        return Decision(status, approved_total, flagged_excess, reasons, bool(escalation), escalation)
+
+
+rules_engine = RulesEngine()
+
+
+def _normalise_code(code: str) -> str:
+    return code.strip().upper()
+
+
+def _claim_diagnoses(value: Any) -> List[str]:
+    """ICD-10 codes on a claim, primary first; accepts the list of dicts or a legacy plain code"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return [value]
+        if isinstance(value, str):
+            return [value]
+    codes: List[Tuple[int, str]] = []
+    for item in value:
+        if isinstance(item, str):
+            codes.append((1, item))
+        elif isinstance(item, Mapping) and item.get("ICD10"):
+            codes.append((0 if item.get("primary") else 1, item["ICD10"]))
+    seen = set()
+    ordered = []
+    for _, code in sorted(codes, key=lambda c: c[0]):
+        if code not in seen:
+            seen.add(code)
+            ordered.append(code)
+    return ordered
+
+
+def _json_list(value: Any) -> List[Mapping[str, Any]]:
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return []
+    return [v for v in value or [] if isinstance(v, Mapping)]
+
+
+def _number(value: Any) -> Optional[float]:
+    """Leading number of a quantity such as 3, "5" or "5 days"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = _LEADING_NUMBER.match(value)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def _synthetic(n_diagnoses: int, treatments_per_diagnosis: int, n_claims: int, seed: int = 7):
+    """Rule rows and (age_months, claim) pairs, with about half the claimed drugs covered"""
+    rng = random.Random(seed)
+    drugs = [f"DRG{i:05d}" for i in range(n_diagnoses * 2)]
+    rows = []
+    for d in range(n_diagnoses):
+        for drug in rng.sample(drugs, treatments_per_diagnosis):
+            rows.append((f"X{d:04d}", drug, rng.choice([6, 8, 12, 24]), rng.choice([None, 5, 7, 14]),
+                         round(rng.uniform(0.5, 20), 2), None, rng.choice([None, None, 216])))
+    claims = []
+    for _ in range(n_claims):
+        diagnosis = [{"ICD10": f"X{rng.randrange(n_diagnoses):04d}", "primary": i == 0} for i in range(rng.randint(1, 3))]
+        claims.append((rng.randint(1, 900), {
+            "diagnosis": diagnosis,
+            "drugs": [{"code": rng.choice(drugs), "frequency": rng.choice([6, 8, 12, 24]),
+                       "duration": f"{rng.randint(1, 14)} days"} for _ in range(rng.randint(1, 5))],
+            "legend": {"diagnosis": [{"code": d["ICD10"], "tariff": 50.0} for d in diagnosis],
+                       "procedures": [], "labs": []},
+            "expected_payout": rng.uniform(50, 500),
+        }))
+    return rows, claims
+
+
+def benchmark(n_diagnoses: int = 2000, treatments_per_diagnosis: int = 15, n_claims: int = 20000):
+    """Compile a synthetic rule base and time adjudication over synthetic claims"""
+    rows, claims = _synthetic(n_diagnoses, treatments_per_diagnosis, n_claims)
+    ta = time.perf_counter()
+    engine = RulesEngine()
+    engine.load(rows)
+    compile_ms = (time.perf_counter() - ta) * 1000
+
+    ta = time.perf_counter()
+    decisions = [engine.adjudicate(claim, age_months=age_months) for age_months, claim in claims]
+    elapsed = time.perf_counter() - ta
+    escalated = sum(d.escalate for d in decisions)
+    print('rules %d diagnoses x %d treatments compiled in %.1fms' % (n_diagnoses, treatments_per_diagnosis, compile_ms))
+    print('%d claims in %.3fs: %.1fus/claim, %.0f claims/s, escalated %.1f%%' % (
+        n_claims, elapsed, elapsed * 1e6 / n_claims, n_claims / elapsed, 100.0 * escalated / n_claims))
+
+
+if __name__ == '__main__':
+    benchmark()
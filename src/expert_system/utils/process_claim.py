@@ -1,88 +1,155 @@
+from sqlalchemy import exists, func, text
 from sqlalchemy.orm import Session
-from db import Claim, VerificationToken
-from src.expert_system.models import Diagnosis
+from db import Claim, ClaimLease, VerificationToken
+from src.expert_system.rules_engine import rules_engine, Decision
+from claim_stats import StatsDelta
 from .get_age_in_months import get_age_in_months
-import json, math, logging
+from typing import Any, Dict, Optional
+import json, time, logging
 
 logger = logging.getLogger(__name__)
 
-def process_claim(claim: Claim, db: Session):
-    reasons : list[str] = []
-    total_payout = 0
-    approved_drug_count = 0
+# One statement for the whole batch; claims decided elsewhere meanwhile are left alone.
+# A NULL payout (rejected without a decision) keeps the claim's payout, as _set_status does
+_BATCH_UPDATE_SQL = text("""
+    UPDATE claims AS c
+    SET status = v.status, total_payout = coalesce(v.total_payout, c.total_payout), reason = v.reason
+    FROM unnest(CAST(:tokens AS varchar[]), CAST(:statuses AS varchar[]),
+                CAST(:payouts AS float8[]), CAST(:reasons AS varchar[]))
+        AS v(encounter_token, status, total_payout, reason)
+    WHERE c.encounter_token = v.encounter_token AND c.status = 'pending'
+    RETURNING c.encounter_token, c.created_at, c.user_id, c.hospital_name, c.status, c.total_payout, c.expected_payout
+""")
 
+def process_claim(claim: Claim, db: Session) -> Optional[Decision]:
+    """
+    Adjudicate a claim with the rules engine. Escalated claims are left
+    pending for the assistant worker; returns the decision, or None.
+    """
     try:
         # Step 1: Fetch the actual claim from DB
-        claim = db.query(Claim).filter(Claim.encounter_token == claim.encounter_token).first()
+        claim = db.query(Claim).filter(Claim.encounter_token == claim.encounter_token).with_for_update().first()
         if not claim:
             logger.warning("Claim not found")
             return None
 
-        # Step 2: Get diagnosis
-        diagnosis = db.query(Diagnosis).filter(Diagnosis.diagnosis_icd10 == claim.diagnosis).first()
-        if not diagnosis:
-            reasons.append("Invalid diagnosis code")
-            claim.reason = json.dumps(reasons)
-            claim.status = "rejected"
-            db.commit()
-            print(json.dumps(reasons))
-            print("claim:", claim.reason)
-            return None
-
-        # Step 3: Get NHIS member via verification token
+        # Step 2: Get NHIS member via verification token
         member = db.query(VerificationToken).filter(VerificationToken.token == claim.encounter_token).first()
         if not member:
-            reasons.append("Verification token not found")
-            claim.reason = json.dumps(reasons)
-            claim.status = "rejected"
+            _set_status(db, claim, "rejected")
+            claim.reason = json.dumps(["Verification token not found"])
             db.commit()
             return None
 
-        # Step 4: Build treatment lookup for diagnosis
-        valid_treatments = {t.drug_icd10: t for t in diagnosis.treatments}
-
-        # Step 5: Check each drug in claim
-        for drug in claim.drugs:
-            drug_code = drug.get("code")
-            if not drug_code or drug_code not in valid_treatments:
-                reasons.append(f"Drug '{drug_code}' is not covered")
-                continue
-
-            treatment = valid_treatments[drug_code]
-            frequency = drug.get("frequency", 0)
-            duration = drug.get("duration", 0)
-            pricing = treatment.pricing  # from DB
-
-            age_in_months = get_age_in_months(member.date_of_birth)
-
-            # Validate age
-            if treatment.max_age_months and age_in_months > treatment.max_age_months:
-                reasons.append(f"{drug_code}: Patient is {(math.floor((age_in_months / 12) * 10) / 10):.0f} years, exceeds age limit")
-                continue
-
-            # Validate frequency and duration
-            if frequency > treatment.frequency:
-                reasons.append(f"{drug_code}: Frequency {frequency} exceeds allowed {treatment.frequency}")
-                frequency = treatment.frequency
-            if treatment.duration and duration > treatment.duration:
-                reasons.append(f"{drug_code}: Duration {duration} exceeds allowed {treatment.duration}")
-                duration = treatment.duration
-
-            total_payout += (24/frequency) * duration * pricing
-            print("pay:", total_payout)
-            approved_drug_count += 1
-
-        # Step 6: Final decision
-        claim.status = "approved" if approved_drug_count > 0 else "rejected"
-        claim.total_payout = f"{total_payout:.2f}"
-
-        claim.reason = json.dumps(reasons)
+        # Step 3: Check every diagnosis and drug against the compiled rules
+        rules_engine.ensure_loaded(db)
+        decision = rules_engine.adjudicate(
+            {
+                "diagnosis": claim.diagnosis,
+                "drugs": claim.drugs,
+                "legend": claim.legend,
+                "expected_payout": claim.expected_payout,
+            },
+            age_months=get_age_in_months(member.date_of_birth) if member.date_of_birth else None,
+        )
+        if decision.escalate:
+            logger.info(f"Claim {claim.encounter_token} escalated: {'; '.join(decision.escalation_reasons)}")
+            return decision
+
+        # Step 4: Final decision
+        _set_status(db, claim, decision.status, decision.approved_total)
+        claim.reason = json.dumps(decision.reasons)
         db.commit()
         db.refresh(claim)
+        return decision
 
     except Exception as e:
         logger.error(f"Error processing claim: {e}", exc_info=True)
-        claim.reason = ["Internal processing error"]
-        claim.status = "rejected"
+        db.rollback()
+        _set_status(db, claim, "rejected")
+        claim.reason = json.dumps(["Internal processing error"])
         db.commit()
         db.refresh(claim)
+        return None
+
+
+def process_claims_batch(db: Session, limit: int) -> Dict[str, Any]:
+    """
+    Adjudicate up to limit pending claims (oldest first) in one pass: one
+    joined select for the claims and members, rules from memory, one UPDATE.
+    Escalated claims stay pending, and claims under an unexpired lease are skipped.
+    """
+    started_at = time.perf_counter()
+    rows = (
+        db.query(Claim.encounter_token, Claim.diagnosis, Claim.drugs, Claim.legend,
+                 Claim.expected_payout, Claim.total_payout,
+                 VerificationToken.token.label("member_token"), VerificationToken.date_of_birth)
+        .outerjoin(VerificationToken, VerificationToken.token == Claim.encounter_token)
+        .filter(Claim.status == "pending")
+        # Claims an assistant worker holds or is backing off on are left to it
+        .filter(~exists().where(ClaimLease.encounter_token == Claim.encounter_token,
+                                ClaimLease.available_at > func.now()))
+        .order_by(Claim.created_at)
+        .limit(limit)
+        .with_for_update(of=Claim, skip_locked=True)
+        .all()
+    )
+    rules_engine.ensure_loaded(db)
+
+    updates = {"tokens": [], "statuses": [], "payouts": [], "reasons": []}
+    counts: Dict[str, int] = {"approved": 0, "flagged": 0, "rejected": 0, "escalated": 0}
+
+    def decide(token: str, status: str, payout: Optional[float], reasons: list) -> None:
+        updates["tokens"].append(token)
+        updates["statuses"].append(status)
+        updates["payouts"].append(payout)
+        updates["reasons"].append(json.dumps(reasons))
+        counts[status] += 1
+
+    old_payouts = {row.encounter_token: row.total_payout for row in rows}
+    for token, diagnosis, drugs, legend, expected_payout, _, member_token, date_of_birth in rows:
+        if member_token is None:
+            decide(token, "rejected", None, ["Verification token not found"])
+            continue
+        decision = rules_engine.adjudicate(
+            {"diagnosis": diagnosis, "drugs": drugs, "legend": legend, "expected_payout": expected_payout},
+            age_months=get_age_in_months(date_of_birth) if date_of_birth else None,
+        )
+        if decision.escalate:
+            counts["escalated"] += 1
+            continue
+        decide(token, decision.status, decision.approved_total, decision.reasons)
+
+    updated = 0
+    if updates["tokens"]:
+        # Only claims the UPDATE actually moved out of pending count towards the counters
+        stats = StatsDelta()
+        for token, created_at, user_id, hospital_name, status, total_payout, expected_payout in db.execute(
+            _BATCH_UPDATE_SQL, updates
+        ):
+            stats.move(created_at, user_id, hospital_name, "pending", status,
+                       expected_payout, old_payouts.get(token), total_payout)
+            updated += 1
+        stats.apply(db)
+    db.commit()
+
+    elapsed = time.perf_counter() - started_at
+    logger.info(f"Adjudicated {len(rows)} claims in {elapsed:.3f}s: {counts}")
+    return {
+        "processed": len(rows),
+        "updated": updated,
+        "counts": counts,
+        "elapsed_ms": round(elapsed * 1000, 1),
+    }
+
+
+def _set_status(db: Session, claim: Claim, status: str, total_payout: Optional[float] = None) -> None:
+    """Change a claim's status (and payout when given), keeping the claim counters in step"""
+    new_payout = claim.total_payout if total_payout is None else total_payout
+    if claim.status != status or claim.total_payout != new_payout:
+        stats = StatsDelta()
+        stats.move(claim.created_at, claim.user_id, claim.hospital_name, claim.status, status,
+                   claim.expected_payout, claim.total_payout, new_payout)
+        stats.apply(db)
+    claim.status = status
+    claim.total_payout = new_payout
@@ -0,0 +1,259 @@
+# tariff_catalogue.py
+import os
+import time
+import asyncio
+import threading
+import logging
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from db import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+TARIFF_REFRESH_SECONDS = float(os.getenv("TARIFF_REFRESH_SECONDS", "300"))
+
+# Procedure tables by (lower-cased) code prefix
+PROCEDURE_TABLES: Dict[str, Tuple[str, str]] = {
+    "medi": ("medicine_procedures", "medi_code"),
+    "opd": ("opd_procedures", "opd_code"),
+    "dent": ("dent_procedures", "dent_code"),
+    "paed": ("paediatric_procedures", "paed_code"),
+    "surg": ("surgery_procedures", "surg_code"),
+    "ent": ("ent_procedures", "ent_code"),
+}
+
+
+def procedure_table(code: str) -> Optional[str]:
+    # Prefixes are 3 or 4 characters (opd/ent vs medi/dent/...), so match on startswith
+    lowered = code.lower()
+    for prefix, (table, _) in PROCEDURE_TABLES.items():
+        if lowered.startswith(prefix):
+            return table
+    return None
+
+
+class _TableSpec:
+    def __init__(self, table: str, key_column: str, value_columns: List[str]):
+        self.table = table
+        self.key_column = key_column
+        self.value_columns = value_columns
+        # Ordered by id so "first matching row" is the same row the old per-code
+        # queries found (medicines is keyed by code and has no id)
+        self.order = " ORDER BY id" if table != "medicines" else ""
+
+    def load_sql(self) -> str:
+        columns = ", ".join([self.key_column, *self.value_columns])
+        return f"SELECT {columns} FROM {self.table}{self.order}"
+
+    def lookup_sql(self) -> str:
+        columns = ", ".join([self.key_column, *self.value_columns])
+        return f"SELECT {columns} FROM {self.table} WHERE {self.key_column} = ANY(:codes){self.order}"
+
+    def stamp_sql(self) -> str:
+        # Row count plus a hash over the priced columns: changes on insert, delete or re-pricing
+        columns = ", ".join(f"{c}::text" for c in [self.key_column, *self.value_columns])
+        return (
+            f"SELECT count(*), coalesce(sum(hashtext(concat_ws('|', {columns}))::bigint), 0) "
+            f"FROM {self.table}"
+        )
+
+
+_SPECS: Dict[str, _TableSpec] = {
+    "icd10_codes": _TableSpec("icd10_codes", "icd_code", ["gdrg_code", "tariff"]),
+    "medicines": _TableSpec("medicines", "code", ["price"]),
+    "investigations": _TableSpec("investigations", "inv_code", ["tariff"]),
+    **{table: _TableSpec(table, column, ["tariff"]) for table, column in PROCEDURE_TABLES.values()},
+}
+
+
+def _number(value) -> Optional[float]:
+    if value is None:
+        return None
+    return float(value) if isinstance(value, Decimal) else value
+
+
+class TariffIndex:
+    """Code -> tariff dicts and the lookups claim pricing needs"""
+
+    def __init__(self):
+        self._icd_gdrg: Dict[str, Optional[str]] = {}
+        self._gdrg_tariff: Dict[str, Optional[float]] = {}
+        self._prices: Dict[str, Dict[str, Optional[float]]] = {}
+
+    def gdrg_for(self, icd_code: str) -> Optional[str]:
+        return self._icd_gdrg.get(icd_code)
+
+    def diagnosis_tariff(self, gdrg_code: str) -> Optional[float]:
+        return self._gdrg_tariff.get(gdrg_code)
+
+    def medicine_price(self, code: str) -> Optional[float]:
+        return self._prices.get("medicines", {}).get(code)
+
+    def investigation_tariff(self, code: str) -> Optional[float]:
+        return self._prices.get("investigations", {}).get(code)
+
+    def procedure_tariff(self, code: str) -> Optional[float]:
+        table = procedure_table(code)
+        return self._prices.get(table, {}).get(code) if table else None
+
+    def price(self, kind: str, code: str) -> Optional[float]:
+        """Tariff of a claim line: kind is diagnosis (ICD-10 code), drug, procedure or lab"""
+        if kind == "diagnosis":
+            gdrg_code = self.gdrg_for(code)
+            return self.diagnosis_tariff(gdrg_code) if gdrg_code else None
+        if kind == "drug":
+            return self.medicine_price(code)
+        if kind == "procedure":
+            return self.procedure_tariff(code)
+        if kind == "lab":
+            return self.investigation_tariff(code)
+        raise ValueError(f"Unknown tariff kind: {kind}")
+
+
+class TariffLookup(TariffIndex):
+    """Tariffs for a known set of codes, fetched with one query per table"""
+
+    @classmethod
+    def resolve(cls, db, icd_codes: Iterable[str] = (), drug_codes: Iterable[str] = (),
+                procedure_codes: Iterable[str] = (), lab_codes: Iterable[str] = ()) -> "TariffLookup":
+        lookup = cls()
+        icd_codes = sorted(set(icd_codes))
+        if icd_codes:
+            rows = db.execute(
+                text("SELECT icd_code, gdrg_code FROM icd10_codes WHERE icd_code = ANY(:codes) ORDER BY id"),
+                {"codes": icd_codes}
+            ).fetchall()
+            for icd_code, gdrg_code in rows:
+                lookup._icd_gdrg.setdefault(icd_code, gdrg_code)
+            gdrg_codes = sorted({g for g in lookup._icd_gdrg.values() if g is not None})
+            if gdrg_codes:
+                rows = db.execute(
+                    text("SELECT gdrg_code, tariff FROM icd10_codes WHERE gdrg_code = ANY(:codes) ORDER BY id"),
+                    {"codes": gdrg_codes}
+                ).fetchall()
+                for gdrg_code, tariff in rows:
+                    lookup._gdrg_tariff.setdefault(gdrg_code, _number(tariff))
+
+        by_table: Dict[str, set] = {"medicines": set(drug_codes), "investigations": set(lab_codes)}
+        for code in procedure_codes:
+            table = procedure_table(code)
+            if table:
+                by_table.setdefault(table, set()).add(code)
+        for table, codes in by_table.items():
+            if not codes:
+                continue
+            rows = db.execute(text(_SPECS[table].lookup_sql()), {"codes": sorted(codes)}).fetchall()
+            prices = lookup._prices.setdefault(table, {})
+            for code, value in rows:
+                prices.setdefault(code, _number(value))
+        return lookup
+
+
+class TariffCatalogue(TariffIndex):
+    """
+    In-process copy of the tariff and price tables used to price claims.
+
+    Every table is held as a plain dict keyed by code, so pricing a claim line
+    is a dict lookup instead of a database round trip. refresh() compares a
+    cheap per-table stamp against the loaded one and only reloads the tables
+    that changed; a reload builds new dicts and swaps them in, so readers
+    never see a half-loaded table.
+    """
+
+    def __init__(self, refresh_seconds: float = TARIFF_REFRESH_SECONDS):
+        super().__init__()
+        self.refresh_seconds = refresh_seconds
+        self._stamps: Dict[str, Tuple] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.loaded_at: Optional[float] = None
+        self.reloads = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def ensure_loaded(self) -> None:
+        if not self.loaded:
+            self.refresh()
+
+    # Loading
+
+    def refresh(self, force: bool = False) -> List[str]:
+        """Reload the tables whose stamp changed (all of them when force); returns their names"""
+        with self._lock:
+            db = SessionLocal()
+            try:
+                changed = []
+                for name, spec in _SPECS.items():
+                    stamp = tuple(db.execute(text(spec.stamp_sql())).fetchone())
+                    if not force and self._stamps.get(name) == stamp:
+                        continue
+                    rows = db.execute(text(spec.load_sql())).fetchall()
+                    self._install(name, rows)
+                    self._stamps[name] = stamp
+                    changed.append(name)
+            finally:
+                db.close()
+            if changed:
+                self.reloads += 1
+                logger.info(f"Tariff catalogue reloaded: {', '.join(changed)}")
+            self.loaded_at = time.time()
+            return changed
+
+    def _install(self, name: str, rows) -> None:
+        if name == "icd10_codes":
+            icd_gdrg: Dict[str, Optional[str]] = {}
+            gdrg_tariff: Dict[str, Optional[float]] = {}
+            for icd_code, gdrg_code, tariff in rows:
+                icd_gdrg.setdefault(icd_code, gdrg_code)
+                if gdrg_code is not None:
+                    gdrg_tariff.setdefault(gdrg_code, _number(tariff))
+            self._icd_gdrg, self._gdrg_tariff = icd_gdrg, gdrg_tariff
+            return
+
+        prices: Dict[str, Optional[float]] = {}
+        for code, value in rows:
+            prices.setdefault(code, _number(value))
+        self._prices = {**self._prices, name: prices}
+
+    def start(self) -> None:
+        """Load in the background and keep refreshing every refresh_seconds"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Tariff catalogue refresh failed: {str(e)}")
+            await asyncio.sleep(self.refresh_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = {name: len(prices) for name, prices in self._prices.items()}
+        sizes["icd10_codes"] = len(self._icd_gdrg)
+        return {
+            "loaded": self.loaded,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "refresh_seconds": self.refresh_seconds,
+            "entries": sizes,
+        }
+
+
+tariff_catalogue = TariffCatalogue()
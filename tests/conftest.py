@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Manual scripts that talk to a live server; run them by hand, not under pytest
+collect_ignore = ["test_notifications.py", "ws_test.py"]
+
+# A disposable Postgres database for the tests that need one; its tables are dropped and recreated
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+@pytest.fixture(scope="session")
+def pg_engine():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    from sqlalchemy import create_engine, text
+    import db
+    import src.expert_system.models  # noqa: F401  (rule tables live on the same Base)
+
+    engine = create_engine(TEST_DATABASE_URL)
+    # Also drops tables created outside the models (claim_leases)
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+    db.Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def pg(pg_engine, monkeypatch):
+    """
+    Empty tables, with SessionLocal and every module's `engine` pointed at
+    the test database for the duration of the test.
+    """
+    from sqlalchemy import text
+    import db
+
+    tables = ", ".join(table.name for table in db.Base.metadata.sorted_tables)
+    with pg_engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+    original = db.engine
+    for module in list(sys.modules.values()):
+        if getattr(module, "engine", None) is original:
+            monkeypatch.setattr(module, "engine", pg_engine)
+    db.SessionLocal.configure(bind=pg_engine)
+    # Remembered from an earlier test's database
+    for name in ("claim_stats", "member_activity"):
+        if name in sys.modules:
+            monkeypatch.setattr(sys.modules[name], "_built", False)
+    yield pg_engine
+    db.SessionLocal.configure(bind=original)
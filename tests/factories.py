@@ -0,0 +1,77 @@
+"""Minimal valid rows for the tests that run against TEST_DATABASE_URL"""
+import uuid
+from datetime import datetime, timedelta
+from itertools import count
+
+from db import Claim, Member, User, VerificationToken
+
+_seq = count(1)
+
+
+def make_user(db, hospital_name="Korle Bu", **fields) -> User:
+    n = next(_seq)
+    user = User(hospital_name=hospital_name, email=f"user{n}@example.com", password="x",
+                location={"region": "Greater Accra"}, **fields)
+    db.add(user)
+    db.flush()
+    return user
+
+
+def make_member(db, membership_id=None, first_name="Ama", last_name="Mensah", middle_name=None,
+                date_of_birth=datetime(1990, 1, 1), **fields) -> Member:
+    n = next(_seq)
+    member = Member(
+        membership_id=membership_id or f"M{n:07d}", first_name=first_name, middle_name=middle_name,
+        last_name=last_name, date_of_birth=date_of_birth, gender="F", marital_status="single",
+        nhis_number=fields.pop("nhis_number", f"N{n:07d}"), insurance_type="informal",
+        issue_date=datetime(2020, 1, 1), enrolment_status="active", current_expiry_date=datetime(2030, 1, 1),
+        mobile_phone_number="0200000000", residential_address="Accra",
+        ghana_card_number=fields.pop("ghana_card_number", f"GHA-{n:09d}"),
+        profile_image_url="https://example.com/p.jpg", **fields,
+    )
+    db.add(member)
+    db.flush()
+    return member
+
+
+def make_token(db, member: Member, user: User, created_at=None, **fields) -> VerificationToken:
+    created_at = created_at or datetime.utcnow()
+    fields.setdefault("date_of_birth", member.date_of_birth)
+    token = VerificationToken(
+        token=fields.pop("token", str(uuid.uuid4())), membership_id=member.membership_id,
+        nhis_number=member.nhis_number, first_name=member.first_name, middle_name=member.middle_name,
+        last_name=member.last_name, profile_image_url=member.profile_image_url,
+        gender=member.gender, residential_address=member.residential_address,
+        enrolment_status=member.enrolment_status, verification_date=created_at, created_at=created_at,
+        user_id=user.id, current_expiry_date=member.current_expiry_date,
+        insurance_type=member.insurance_type, **fields,
+    )
+    db.add(token)
+    db.flush()
+    return token
+
+
+def make_claim(db, token: VerificationToken, user: User, created_at=None, status="pending", **fields) -> Claim:
+    claim = Claim(
+        encounter_token=token.token, service_type=fields.pop("service_type", ["OPD"]),
+        drugs=fields.pop("drugs", []), medical_procedures=fields.pop("medical_procedures", []),
+        created_at=created_at or datetime.utcnow(), user_id=user.id, status=status,
+        patient_name=f"{token.first_name} {token.last_name}", hospital_name=user.hospital_name,
+        location="Accra", age=30, diagnosis_total=fields.pop("diagnosis_total", 0.0),
+        expected_payout=fields.pop("expected_payout", 0.0), legend=fields.pop("legend", {}), **fields,
+    )
+    db.add(claim)
+    db.flush()
+    return claim
+
+
+def make_claims(db, n, status="pending", start=None, **fields):
+    """n claims, one member and encounter each, created a minute apart (oldest first)"""
+    start = start or datetime(2026, 1, 1)
+    user = make_user(db)
+    claims = []
+    for i in range(n):
+        member = make_member(db)
+        token = make_token(db, member, user, created_at=start + timedelta(minutes=i))
+        claims.append(make_claim(db, token, user, created_at=start + timedelta(minutes=i), status=status, **fields))
+    return claims
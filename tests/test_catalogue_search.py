@@ -0,0 +1,111 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from catalogue_search import catalogue_search
+from catalogue_usage import usage_tracker
+from db import SessionLocal, CatalogueUsage, ICD10Code, Medicines, ServiceTariffs
+from dependencies import get_db
+from routers import icd, medicines, services
+
+CREATED = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def client(pg, monkeypatch):
+    # Fresh indexes built from the test database, no usage left over from other tests
+    monkeypatch.setattr(catalogue_search, "_indexes", {})
+    monkeypatch.setattr(catalogue_search, "_stamps", {})
+    monkeypatch.setattr(usage_tracker, "_pending", {})
+    db = SessionLocal()
+    try:
+        db.add_all([
+            Medicines(code="PARACETAB1", generic_name="Paracetamol Tablet, 500 mg", unit_of_pricing="Tablet",
+                      price=0.1, created_at=CREATED),
+            Medicines(code="PARACESY1", generic_name="Paracetamol Syrup, 120 mg/5 ml", unit_of_pricing="Bottle",
+                      price=2.5, created_at=CREATED),
+            Medicines(code="AMOXICCA1", generic_name="Amoxicillin Capsule, 250 mg", unit_of_pricing="Capsule",
+                      price=0.3, created_at=CREATED),
+            ICD10Code(icd_code="A00", diagnosis_description="Cholera", created_at=CREATED),
+            ICD10Code(icd_code="B50", diagnosis_description="Plasmodium falciparum malaria", created_at=CREATED),
+            ICD10Code(icd_code="B54", diagnosis_description="Unspecified malaria", created_at=CREATED),
+            ServiceTariffs(code="OPD01", service="General OPD consultation", tariff=25.0, created_at=CREATED),
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+    app = FastAPI()
+    for router in (icd.router, medicines.router, services.router):
+        app.include_router(router)
+
+    def test_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = test_db
+    # Not as a context manager: the startup hooks would start the background refreshers
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("path, query, expected", [
+    ("/medicines/search", "paracetamol", ["PARACESY1", "PARACETAB1"]),
+    ("/medicines/search", "amoxcillin", ["AMOXICCA1"]),
+    ("/icd10/search", "B5", ["B50", "B54"]),
+    ("/icd10/search", "malaria", ["B50", "B54"]),
+    ("/services/search", "opd", ["OPD01"]),
+])
+def test_search_with_a_query(client, path, query, expected):
+    response = client.get(path, params={"query": query})
+
+    assert response.status_code == 200, response.text
+    codes = [row.get("code") or row.get("icd_code") for row in response.json()]
+    assert codes == expected
+    assert response.headers["ETag"]
+
+
+def test_repeated_search_is_not_modified(client):
+    first = client.get("/medicines/search", params={"query": "para", "limit": 5})
+    again = client.get("/medicines/search", params={"query": "para", "limit": 5},
+                       headers={"If-None-Match": first.headers["ETag"]})
+
+    assert again.status_code == 304
+    assert again.headers["ETag"] == first.headers["ETag"]
+    # Revalidated on every use, so no search is answered from a client or shared cache
+    assert first.headers["Cache-Control"] == again.headers["Cache-Control"] == "private, no-cache"
+
+
+def test_not_modified_search_still_counts_as_usage(client):
+    first = client.get("/medicines/search", params={"query": "amoxicillin"})
+    again = client.get("/medicines/search", params={"query": "amoxicillin"},
+                       headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+
+    assert usage_tracker.flush() == 1
+    db = SessionLocal()
+    try:
+        usage = db.query(CatalogueUsage).one()
+    finally:
+        db.close()
+    assert (usage.item_key, usage.hits) == ("AMOXICCA1", 2)
+
+
+def test_searched_rows_come_back_as_recently_used(client):
+    client.get("/medicines/search", params={"query": "amoxicillin"})
+
+    recent = client.get("/medicines/search", params={"limit": 2})
+    assert recent.status_code == 200, recent.text
+    assert recent.json()[0]["code"] == "AMOXICCA1"
+
+    assert usage_tracker.flush() == 1
+    db = SessionLocal()
+    try:
+        usage = db.query(CatalogueUsage).one()
+    finally:
+        db.close()
+    assert (usage.catalogue, usage.item_key, usage.hits) == ("medicines", "AMOXICCA1", 1)
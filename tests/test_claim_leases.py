@@ -0,0 +1,167 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import text
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("openai")
+
+import gpt  # noqa: E402
+from conftest import TEST_DATABASE_URL  # noqa: E402
+from db import Claim, SessionLocal  # noqa: E402
+from factories import make_claims  # noqa: E402
+
+
+@pytest.fixture
+def workers(pg, monkeypatch):
+    monkeypatch.setattr(gpt, "DATABASE_URL", TEST_DATABASE_URL)
+    monkeypatch.setattr(gpt, "RULES_ENGINE_ENABLED", False)
+    made = []
+    for name in ("worker-a", "worker-b"):
+        processor = gpt.ClaimsProcessor(backend=gpt.FakeAdjudicationBackend(), concurrency=8)
+        processor.worker_id = name
+        made.append(processor)
+    for processor in made:
+        # Creates the pool before any threads use it, as run() does
+        processor._ensure_schema()
+    yield made
+    for processor in made:
+        if processor.db_pool is not None:
+            processor.db_pool.closeall()
+
+
+def _claims(n):
+    db = SessionLocal()
+    try:
+        tokens = [claim.encounter_token for claim in make_claims(db, n)]
+        db.commit()
+        return tokens
+    finally:
+        db.close()
+
+
+def _execute(pg, sql, *params):
+    conn = pg.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_adjudication_backend_is_abstract():
+    with pytest.raises(TypeError):
+        gpt.AdjudicationBackend()
+
+
+def test_concurrent_workers_never_share_a_claim(workers):
+    tokens = _claims(300)
+    leased = {worker.worker_id: [] for worker in workers}
+    lock = threading.Lock()
+
+    def lease_until_empty(worker):
+        while True:
+            batch = worker._lease_claims(1)
+            if not batch:
+                return
+            with lock:
+                leased[worker.worker_id].extend(claim["encounter_token"] for claim in batch)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lease_until_empty, workers * 8))
+    # A thread can come back empty-handed while others hold the last claims
+    lease_until_empty(workers[0])
+
+    everything = leased["worker-a"] + leased["worker-b"]
+    assert len(everything) == len(set(everything))
+    assert set(everything) == set(tokens)
+
+
+def test_lease_being_taken_is_not_taken_twice(workers, pg):
+    """Worker A has inserted the lease but not committed when worker B looks at the same claim"""
+    (token,) = _claims(1)
+    conn = pg.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO claim_leases (encounter_token, worker_id, available_at) "
+                "VALUES (%s, 'worker-a', now() + interval '5 minutes')", (token,)
+            )
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            racing = pool.submit(workers[1]._lease_claims, 5)
+            time.sleep(0.3)
+            conn.commit()
+            assert racing.result(timeout=10) == []
+    finally:
+        conn.close()
+
+
+def test_expired_lease_is_taken_by_exactly_one_worker(workers, pg):
+    (token,) = _claims(1)
+    _execute(pg, "INSERT INTO claim_leases (encounter_token, worker_id, available_at, attempts) "
+                 "VALUES (%s, 'crashed', now() - interval '1 minute', 2)", token)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = list(pool.map(lambda worker: worker._lease_claims(5), workers))
+
+    winners = [claims for claims in results if claims]
+    assert len(winners) == 1
+    assert winners[0][0]["encounter_token"] == token
+    assert winners[0][0]["lease_attempts"] == 2
+
+
+def test_backing_off_and_given_up_claims_are_skipped(workers, pg):
+    backing_off, gave_up, free = _claims(3)
+    _execute(pg, "INSERT INTO claim_leases (encounter_token, available_at) VALUES (%s, now() + interval '1 hour')",
+             backing_off)
+    _execute(pg, "INSERT INTO claim_leases (encounter_token, available_at, gave_up) VALUES (%s, now(), true)",
+             gave_up)
+
+    assert [claim["encounter_token"] for claim in workers[0]._lease_claims(5)] == [free]
+
+
+def _status(token):
+    db = SessionLocal()
+    try:
+        claim = db.query(Claim).filter(Claim.encounter_token == token).one()
+        return claim.status, claim.user_id
+    finally:
+        db.close()
+
+
+VERDICT = {"claim_status": "approved", "approved_total": 8.0, "reason": "Within tariff"}
+
+
+def test_verdict_notifies_the_claims_owner(workers, pg, monkeypatch):
+    sent = []
+    monkeypatch.setattr(gpt, "send_ws_notification", lambda user_id, status: sent.append((user_id, status)))
+    (token,) = _claims(1)
+    _execute(pg, "INSERT INTO claim_leases (encounter_token, worker_id, available_at) "
+                 "VALUES (%s, 'worker-a', now() + interval '5 minutes')", token)
+
+    assert workers[0]._update_claim_status(token, VERDICT) is True
+
+    status, user_id = _status(token)
+    assert status == "approved"
+    assert sent == [(str(user_id), "approved")]
+
+
+def test_claim_decided_meanwhile_keeps_its_decision(workers, pg, monkeypatch):
+    sent = []
+    monkeypatch.setattr(gpt, "send_ws_notification", lambda user_id, status: sent.append((user_id, status)))
+    (token,) = _claims(1)
+    _execute(pg, "INSERT INTO claim_leases (encounter_token, worker_id, available_at) "
+                 "VALUES (%s, 'worker-a', now() + interval '5 minutes')", token)
+    # A reviewer rejects the claim while the adjudication is running
+    _execute(pg, "UPDATE claims SET status = 'rejected' WHERE encounter_token = %s", token)
+
+    assert workers[0]._update_claim_status(token, VERDICT) is True
+
+    assert _status(token)[0] == "rejected"
+    assert sent == []
+    with pg.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM claim_stats")).scalar() == 0
+        assert conn.execute(text("SELECT count(*) FROM claim_leases")).scalar() == 0
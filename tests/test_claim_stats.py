@@ -0,0 +1,71 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+import claim_stats
+from claim_stats import StatsDelta
+from db import SessionLocal, ClaimStat, SummaryBuild
+from factories import make_claims
+
+
+def _seed():
+    """Claims from before the counters existed: nothing in claim_stats for them"""
+    db = SessionLocal()
+    try:
+        make_claims(db, 4, status="approved", start=datetime(2026, 1, 1), expected_payout=10.0, total_payout=8.0)
+        make_claims(db, 3, status="pending", start=datetime(2026, 1, 2), expected_payout=5.0)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_claim_written_before_the_backfill_does_not_skip_it(pg):
+    _seed()
+    db = SessionLocal()
+    try:
+        # A worker records a new claim before the backfill ran: claim_stats is no longer empty
+        (claim,) = make_claims(db, 1, status="pending", start=datetime(2026, 1, 3), expected_payout=7.0)
+        stats = StatsDelta()
+        stats.add(claim.created_at, claim.user_id, claim.hospital_name, claim.status, claim.expected_payout)
+        stats.apply(db)
+        db.commit()
+        assert db.query(ClaimStat).count() == 1
+
+        # Counted from claims meanwhile
+        before = claim_stats.summarize(db)
+        assert before["total"] == 8
+        assert before["by_status"]["pending"] == {"count": 4, "expected_total": 22.0, "payout_total": 0.0}
+        assert before["by_status"]["approved"] == {"count": 4, "expected_total": 40.0, "payout_total": 32.0}
+
+        assert claim_stats.ensure_built(db) is True
+        assert db.query(SummaryBuild).one().name == claim_stats.SUMMARY_BUILD_NAME
+        assert claim_stats.summarize(db) == before
+        assert claim_stats.ensure_built(db) is False
+    finally:
+        db.close()
+
+
+def test_grouped_counts_match_before_and_after_the_backfill(pg):
+    _seed()
+    db = SessionLocal()
+    try:
+        before = {group_by: claim_stats.summarize(db, group_by=group_by) for group_by in ("day", "hospital_name")}
+        claim_stats.ensure_built(db)
+        after = {group_by: claim_stats.summarize(db, group_by=group_by) for group_by in ("day", "hospital_name")}
+    finally:
+        db.close()
+    assert before == after
+    assert [group["day"] for group in after["day"]["groups"]] == ["2026-01-01", "2026-01-02"]
+
+
+def test_one_worker_runs_the_backfill(pg):
+    _seed()
+    with pg.connect() as other:
+        other.execute(text("SELECT pg_advisory_lock(:key)"), {"key": claim_stats.SUMMARY_BUILD_LOCK})
+        db = SessionLocal()
+        try:
+            assert claim_stats.ensure_built(db) is False
+            assert db.query(ClaimStat).count() == 0
+        finally:
+            db.close()
+        other.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": claim_stats.SUMMARY_BUILD_LOCK})
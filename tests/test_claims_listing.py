@@ -0,0 +1,165 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from db import INDEX_BUILD_LOCK, SessionLocal, create_indexes_concurrently
+from dependencies import get_db
+from factories import make_claim, make_claims, make_member, make_token, make_user
+from routers import claims
+
+
+@pytest.fixture
+def client(pg):
+    app = FastAPI()
+    app.include_router(claims.router)
+
+    def test_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = test_db
+    # Not as a context manager: the router's startup hooks talk to the catalogue and stats
+    return TestClient(app)
+
+
+def _seed(statuses, start=datetime(2026, 3, 1)):
+    """One claim per status, several sharing each created_at so pages split ties"""
+    db = SessionLocal()
+    try:
+        user = make_user(db)
+        tokens = []
+        for i, status in enumerate(statuses):
+            token = make_token(db, make_member(db), user)
+            make_claim(db, token, user, created_at=start + timedelta(minutes=i // 3), status=status)
+            tokens.append(token.token)
+        db.commit()
+        return tokens
+    finally:
+        db.close()
+
+
+def _walk(client, path, limit):
+    tokens, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get(path, params=params)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        assert len(page) <= limit
+        tokens.extend(claim["encounter_token"] for claim in page)
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return tokens, pages
+
+
+def test_keyset_pages_cover_every_claim_once(client):
+    tokens = _seed(["pending"] * 25)
+
+    walked, pages = _walk(client, "/claims/", limit=4)
+
+    assert sorted(walked) == sorted(tokens)
+    assert pages == 7
+    db = SessionLocal()
+    try:
+        expected = [row[0] for row in db.execute(text(
+            "SELECT encounter_token FROM claims ORDER BY created_at DESC, encounter_token DESC"
+        ))]
+    finally:
+        db.close()
+    assert walked == expected
+
+
+def test_status_list_pages_only_that_status(client):
+    tokens = _seed(["approved", "pending", "approved", "rejected"] * 6)
+    approved = {token for token, status in zip(tokens, ["approved", "pending", "approved", "rejected"] * 6)
+                if status == "approved"}
+
+    walked, _ = _walk(client, "/claims/approved", limit=5)
+
+    assert len(walked) == len(set(walked)) == 12
+    assert set(walked) == approved
+
+
+def test_offset_pages_still_work(client):
+    _seed(["pending"] * 10)
+    everything = [c["encounter_token"] for c in client.get("/claims/", params={"limit": 100}).json()]
+
+    response = client.get("/claims/", params={"limit": 3, "offset": 5})
+
+    assert response.status_code == 200, response.text
+    assert [c["encounter_token"] for c in response.json()] == everything[5:8]
+    # The cursor continues right after the offset page
+    rest = client.get("/claims/", params={"limit": 100, "cursor": response.headers["X-Next-Cursor"]}).json()
+    assert [c["encounter_token"] for c in rest] == everything[8:]
+
+
+def test_invalid_cursor_is_a_400(client):
+    response = client.get("/claims/pending", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_update_status_moves_the_claim_between_lists(client):
+    (claim,) = _seed(["pending"])
+
+    response = client.patch(f"/claims/update-status/{claim}", json={"status": "approved", "reason": "Reviewed"})
+
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "approved"
+    assert response.json()["reason"] == "Reviewed"
+    assert client.get("/claims/pending").json() == []
+    assert [c["encounter_token"] for c in client.get("/claims/approved").json()] == [claim]
+
+
+def test_update_status_of_unknown_claim(client):
+    response = client.patch("/claims/update-status/missing", json={"status": "approved"})
+    assert response.status_code == 404
+    assert client.patch("/claims/update-status/missing", json={"reason": "no status"}).status_code == 422
+
+
+def _index_valid(pg, name):
+    with pg.connect() as conn:
+        return conn.execute(
+            text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name}
+        ).scalar()
+
+
+def test_status_index_is_created_on_an_existing_table(pg):
+    db = SessionLocal()
+    try:
+        make_claims(db, 3)
+        db.commit()
+    finally:
+        db.close()
+    with pg.begin() as conn:
+        conn.execute(text("DROP INDEX idx_claim_status_created"))
+
+    assert create_indexes_concurrently(claims.CLAIM_INDEXES)
+    assert _index_valid(pg, "idx_claim_status_created") is True
+
+    # Left invalid by an interrupted concurrent build: dropped and built again
+    with pg.begin() as conn:
+        conn.execute(text("UPDATE pg_index SET indisvalid = false "
+                          "WHERE indexrelid = 'idx_claim_status_created'::regclass"))
+    assert create_indexes_concurrently(claims.CLAIM_INDEXES)
+    assert _index_valid(pg, "idx_claim_status_created") is True
+
+
+def test_index_build_is_skipped_while_another_worker_holds_the_lock(pg):
+    with pg.begin() as conn:
+        conn.execute(text("DROP INDEX idx_claim_status_created"))
+    with pg.connect() as other:
+        other.execute(text("SELECT pg_advisory_lock(:key)"), {"key": INDEX_BUILD_LOCK})
+        try:
+            assert create_indexes_concurrently(claims.CLAIM_INDEXES) is False
+            assert _index_valid(pg, "idx_claim_status_created") is None
+        finally:
+            other.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INDEX_BUILD_LOCK})
+    assert create_indexes_concurrently(claims.CLAIM_INDEXES)
@@ -0,0 +1,151 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+import member_activity
+from db import SessionLocal, Member, MemberActivitySummary, RecentVisit, SummaryBuild, User
+from factories import make_member, make_token, make_user
+
+
+def _encounter(db, member, user, at):
+    """What POST /encounter/initialize writes: a token, a visit and the summary update, in one transaction"""
+    token = make_token(db, member, user, created_at=at)
+    db.add(RecentVisit(membership_id=member.membership_id, nhis_number=member.nhis_number,
+                       first_name=member.first_name, last_name=member.last_name,
+                       date_of_birth=member.date_of_birth, profile_image_url=member.profile_image_url,
+                       gender=member.gender, enrolment_status=member.enrolment_status,
+                       user_id=user.id, visit_date=at, verification_token_id=token.id))
+    member_activity.note_verification(db, token, at)
+    return token
+
+
+@pytest.fixture
+def history(pg):
+    """Members with encounters from before the summary table existed (no summary rows)"""
+    db = SessionLocal()
+    try:
+        user = make_user(db)
+        members = [make_member(db) for _ in range(30)]
+        tokens = {}
+        start = datetime(2026, 1, 1)
+        for i, member in enumerate(members):
+            tokens[member.membership_id] = [
+                make_token(db, member, user, created_at=start + timedelta(hours=i, minutes=n)).token
+                for n in range(3)
+            ]
+        db.commit()
+        return user.id, [m.membership_id for m in members], tokens
+    finally:
+        db.close()
+
+
+def _computed(db, ids):
+    """The summaries as the backfill would write them now"""
+    rows = db.execute(text(member_activity._SUMMARIES_OF_SQL), {"ids": ids}).mappings()
+    return {row["membership_id"]: [e["token"] for e in row["recent_encounters"]] for row in rows}
+
+
+def _stored(db):
+    return {s.membership_id: [e["token"] for e in s.recent_encounters]
+            for s in db.query(MemberActivitySummary).all()}
+
+
+def test_encounter_before_the_backfill_does_not_skip_it(history):
+    user_id, ids, tokens = history
+    db = SessionLocal()
+    try:
+        # A worker serves an encounter before the backfill ran: the summary table is no longer empty
+        member = db.query(Member).filter(Member.membership_id == ids[0]).one()
+        late = _encounter(db, member, db.get(User, user_id), datetime(2026, 6, 1))
+        db.commit()
+        assert _stored(db) == {ids[0]: [late.token]}
+
+        assert member_activity.ensure_built(db) is True
+
+        assert _stored(db) == _computed(db, ids)
+        assert _stored(db)[ids[0]] == [late.token] + tokens[ids[0]][::-1]
+        assert db.query(SummaryBuild).one().name == member_activity.SUMMARY_BUILD_NAME
+        # Done once
+        assert member_activity.ensure_built(db) is False
+    finally:
+        db.close()
+
+
+def test_reads_use_the_source_tables_until_the_backfill_is_done(history):
+    user_id, ids, tokens = history
+    db = SessionLocal()
+    try:
+        summary = member_activity.summary_for(db, ids[1])
+        assert member_activity.recent_tokens(summary, 2) == tokens[ids[1]][::-1][:2]
+        assert set(member_activity.summaries(db, ids[:5])) == set(ids[:5])
+        # Nothing was written by the reads
+        assert db.query(MemberActivitySummary).count() == 0
+
+        member_activity.ensure_built(db)
+        assert member_activity.summary_for(db, ids[1]).recent_encounters[0]["token"] == tokens[ids[1]][-1]
+    finally:
+        db.close()
+
+
+def test_one_worker_runs_the_backfill(history, pg):
+    with pg.connect() as other:
+        other.execute(text("SELECT pg_advisory_lock(:key)"), {"key": member_activity.SUMMARY_BUILD_LOCK})
+        db = SessionLocal()
+        try:
+            assert member_activity.ensure_built(db) is False
+            assert db.query(SummaryBuild).count() == 0
+        finally:
+            db.close()
+        other.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": member_activity.SUMMARY_BUILD_LOCK})
+
+    db = SessionLocal()
+    try:
+        assert member_activity.ensure_built(db) is True
+    finally:
+        db.close()
+
+
+def test_backfill_racing_with_encounters(history):
+    user_id, ids, tokens = history
+    # Each thread serves its own members, so their encounters are ordered the same way everywhere
+    groups = [ids[i::6] for i in range(6)]
+    started = threading.Barrier(len(groups) + 1)
+    errors = []
+
+    def serve(group, worker):
+        started.wait()
+        db = SessionLocal()
+        try:
+            user = db.get(User, user_id)
+            for n in range(10):
+                member = db.query(Member).filter(Member.membership_id == group[n % len(group)]).one()
+                _encounter(db, member, user, datetime(2026, 6, 1) + timedelta(minutes=worker * 100 + n))
+                db.commit()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=serve, args=(group, i)) for i, group in enumerate(groups)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    db = SessionLocal()
+    try:
+        assert member_activity.ensure_built(db) is True
+    finally:
+        db.close()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    db = SessionLocal()
+    try:
+        stored = _stored(db)
+        assert stored == _computed(db, ids)
+        assert all(len(stored[m]) == 3 + 10 // len(g) + (1 if i < 10 % len(g) else 0)
+                   for g in groups for i, m in enumerate(g))
+    finally:
+        db.close()
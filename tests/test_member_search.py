@@ -0,0 +1,109 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from db import SessionLocal
+from dependencies import get_db
+from factories import make_member
+from member_search import search_members
+from routers import members
+
+
+@pytest.fixture
+def population(pg):
+    """260 members whose last name starts with "Mens", 40 with it inside, one whose NHIS number is the term"""
+    db = SessionLocal()
+    try:
+        exact = make_member(db, nhis_number="MENS", last_name="Owusu").membership_id
+        prefix = [make_member(db, first_name=f"Ama{i % 7}", last_name=f"Mensah{i % 13}").membership_id
+                  for i in range(260)]
+        infix = [make_member(db, first_name="Kofi", last_name=f"Amensah{i % 5}").membership_id for i in range(40)]
+        make_member(db, first_name="Yaw", last_name="Boateng")
+        db.commit()
+        return exact, prefix, infix
+    finally:
+        db.close()
+
+
+def _pages(query, limit):
+    db = SessionLocal()
+    try:
+        walked, offset = [], 0
+        while True:
+            page = search_members(db, query, limit=limit, offset=offset)
+            assert len(page) <= limit
+            walked.extend(member.membership_id for member in page)
+            if len(page) < limit:
+                return walked
+            offset += limit
+    finally:
+        db.close()
+
+
+def test_pages_past_the_first_few_hundred_cover_every_match_once(population):
+    exact, prefix, infix = population
+
+    walked = _pages("mens", limit=30)
+
+    assert len(walked) == len(set(walked)) == 1 + len(prefix) + len(infix)
+    # Tiers in order: exact NHIS number, then prefixes, then infixes
+    assert walked[0] == exact
+    assert set(walked[1:1 + len(prefix)]) == set(prefix)
+    assert set(walked[1 + len(prefix):]) == set(infix)
+    # Pages line up with one big page
+    db = SessionLocal()
+    try:
+        assert walked == [member.membership_id for member in search_members(db, "mens", limit=1000)]
+    finally:
+        db.close()
+
+
+def test_page_inside_a_later_tier(population):
+    exact, prefix, infix = population
+    db = SessionLocal()
+    try:
+        everything = [member.membership_id for member in search_members(db, "mens", limit=1000)]
+        # Starts in the prefix tier and ends in the infix tier
+        assert [m.membership_id for m in search_members(db, "mens", limit=20, offset=250)] == everything[250:270]
+        # Starts past the prefix tier altogether
+        assert [m.membership_id for m in search_members(db, "mens", limit=20, offset=280)] == everything[280:300]
+        assert search_members(db, "mens", limit=20, offset=301) == []
+    finally:
+        db.close()
+
+
+def test_names_order_alphabetically_within_a_tier(population):
+    db = SessionLocal()
+    try:
+        page = search_members(db, "mensah1", limit=100)
+    finally:
+        db.close()
+    names = [m.last_name for m in page]
+    # Prefix tier (Mensah1, Mensah10..12), then the infix tier (Amensah1)
+    split = names.index("Amensah1")
+    assert set(names[:split]) == {"Mensah1", "Mensah10", "Mensah11", "Mensah12"}
+    assert set(names[split:]) == {"Amensah1"}
+    keys = [(m.last_name.lower(), m.first_name.lower(), m.membership_id) for m in page[:split]]
+    assert keys == sorted(keys)
+
+
+def test_autocomplete_offset_past_200(population):
+    app = FastAPI()
+    app.include_router(members.router)
+
+    def test_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = test_db
+    client = TestClient(app)
+
+    response = client.get("/members/autocomplete", params={"query": "mens", "limit": 50, "offset": 240})
+
+    assert response.status_code == 200, response.text
+    results = response.json()["results"]
+    assert len(results) == 50
+    assert [r["last_name"].startswith("Mensah") for r in results].count(True) == 21
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+from onnx import TensorProto, helper  # noqa: E402
+
+from insightface.model_zoo import ArcFaceONNX  # noqa: E402
+from recognition_batcher import RecognitionBatcher  # noqa: E402
+
+SIZE = 16
+DIM = 8
+
+
+def _embedding_model(path, batch_dim):
+    """A stand-in for an ArcFace graph: flatten the crop and project it to DIM values"""
+    weights = np.random.default_rng(3).standard_normal((3 * SIZE * SIZE, DIM)).astype(np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node("Flatten", ["input.1"], ["flat"], axis=1),
+            helper.make_node("MatMul", ["flat", "w"], ["683"]),
+        ],
+        "rec",
+        [helper.make_tensor_value_info("input.1", TensorProto.FLOAT, [batch_dim, 3, SIZE, SIZE])],
+        [helper.make_tensor_value_info("683", TensorProto.FLOAT, [batch_dim, DIM])],
+        [helper.make_tensor("w", TensorProto.FLOAT, weights.shape, weights.flatten())],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, str(path))
+    return ArcFaceONNX(model_file=str(path))
+
+
+def _crops(n):
+    rng = np.random.default_rng(11)
+    return [rng.integers(0, 256, size=(SIZE, SIZE, 3), dtype=np.uint8) for _ in range(n)]
+
+
+@pytest.mark.parametrize("batch_dim, max_batch", [("N", 16), (1, 1)], ids=["dynamic", "static-1"])
+def test_concurrent_crops_get_their_own_embedding(tmp_path, batch_dim, max_batch):
+    model = _embedding_model(tmp_path / "rec.onnx", batch_dim)
+    batcher = RecognitionBatcher(model, max_wait_ms=20)
+    crops = _crops(12)
+
+    with ThreadPoolExecutor(max_workers=len(crops)) as pool:
+        embeddings = list(pool.map(batcher.embed, crops))
+
+    assert batcher.max_batch == max_batch
+    for crop, embedding in zip(crops, embeddings):
+        assert embedding.shape == (DIM,)
+        np.testing.assert_allclose(embedding, model.get_feat(crop)[0], rtol=1e-5, atol=1e-4)
+    assert batcher.stats()["items"] == len(crops)
+    if max_batch > 1:
+        assert batcher.stats()["batches"] < len(crops)
@@ -0,0 +1,179 @@
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import func, text
+
+from db import SessionLocal, Claim, ClaimLease
+from factories import make_claim, make_claims, make_member, make_token, make_user
+from src.expert_system.models import Diagnosis, DiagnosisTreatment
+from src.expert_system.rules_engine import RulesEngine, rules_engine
+from src.expert_system.utils.process_claim import process_claim, process_claims_batch
+
+DRUG = {"code": "DRG1", "frequency": 8, "duration": "5 days"}
+LEGEND = {"diagnosis": [{"code": "A00", "tariff": 50.0}], "procedures": [], "labs": []}
+
+# name -> (claim fields, member date of birth, has a verification token)
+SCENARIOS = {
+    "approved": (dict(diagnosis=[{"ICD10": "A00", "primary": True}], drugs=[DRUG], legend=LEGEND,
+                      expected_payout=80.0), datetime(1990, 1, 1), True),
+    "flagged": (dict(diagnosis=[{"ICD10": "A00", "primary": True}], drugs=[dict(DRUG, frequency=12)],
+                     legend=LEGEND, expected_payout=120.0), datetime(1990, 1, 1), True),
+    "rejected": (dict(diagnosis=[{"ICD10": "A00", "primary": True}], drugs=[dict(DRUG, code="DRG9")],
+                      legend={}, expected_payout=40.0, total_payout=40.0), datetime(1990, 1, 1), True),
+    "escalated": (dict(diagnosis=[{"ICD10": "Z99", "primary": True}], drugs=[DRUG], legend=LEGEND,
+                       expected_payout=80.0), datetime(1990, 1, 1), True),
+    "child_drug_over_age": (dict(diagnosis=[{"ICD10": "B00", "primary": True}], drugs=[dict(DRUG, code="DRG2")],
+                                 legend=LEGEND, expected_payout=80.0), datetime(1990, 1, 1), True),
+    "no_date_of_birth": (dict(diagnosis=[{"ICD10": "A00", "primary": True}], drugs=[DRUG], legend=LEGEND,
+                              expected_payout=80.0), None, True),
+    "no_date_of_birth_age_bound": (dict(diagnosis=[{"ICD10": "B00", "primary": True}],
+                                        drugs=[dict(DRUG, code="DRG2")], legend=LEGEND,
+                                        expected_payout=80.0), None, True),
+    "no_token": (dict(diagnosis=[{"ICD10": "A00", "primary": True}], drugs=[DRUG], legend=LEGEND,
+                      expected_payout=80.0, total_payout=75.0), datetime(1990, 1, 1), False),
+}
+
+
+@pytest.fixture
+def legacy_rows(pg):
+    """
+    Rows the current schema forbids but older data has: tokens without a
+    date of birth, claims whose verification token is gone.
+    """
+    with pg.begin() as conn:
+        conn.execute(text("ALTER TABLE verification_tokens ALTER COLUMN date_of_birth DROP NOT NULL"))
+        conn.execute(text("ALTER TABLE claims DROP CONSTRAINT claims_encounter_token_fkey"))
+    yield
+    with pg.begin() as conn:
+        conn.execute(text("TRUNCATE claims, verification_tokens CASCADE"))
+        conn.execute(text("ALTER TABLE claims ADD CONSTRAINT claims_encounter_token_fkey "
+                          "FOREIGN KEY (encounter_token) REFERENCES verification_tokens (token)"))
+        conn.execute(text("ALTER TABLE verification_tokens ALTER COLUMN date_of_birth SET NOT NULL"))
+
+
+@pytest.fixture
+def rules(pg):
+    db = SessionLocal()
+    try:
+        db.add(Diagnosis(diagnosis_icd10="A00", description="Cholera", treatments=[
+            DiagnosisTreatment(drug_icd10="DRG1", frequency=8, duration=7, pricing=2.0),
+        ]))
+        db.add(Diagnosis(diagnosis_icd10="B00", description="Herpes", treatments=[
+            DiagnosisTreatment(drug_icd10="DRG2", frequency=8, duration=7, pricing=3.0, max_age_months=216),
+        ]))
+        db.commit()
+    finally:
+        db.close()
+    rules_engine.invalidate()
+    yield
+    rules_engine.invalidate()
+
+
+def _make_scenarios(db, user, suffix, start):
+    tokens = {}
+    for i, (name, (fields, date_of_birth, has_token)) in enumerate(SCENARIOS.items()):
+        created_at = start + timedelta(minutes=i)
+        member = make_member(db)
+        if has_token:
+            token = make_token(db, member, user, created_at=created_at, date_of_birth=date_of_birth)
+        else:
+            token = SimpleNamespace(token=f"gone-{name}-{suffix}", first_name="Ama", last_name="Mensah")
+        make_claim(db, token, user, created_at=created_at, **fields)
+        tokens[name] = token.token
+    db.commit()
+    return tokens
+
+
+def _outcomes(db, tokens):
+    db.expire_all()
+    outcomes = {}
+    for name, token in tokens.items():
+        claim = db.query(Claim).filter(Claim.encounter_token == token).one()
+        outcomes[name] = (claim.status, claim.total_payout, json.loads(claim.reason) if claim.reason else None)
+    return outcomes
+
+
+def test_batch_and_single_adjudication_agree(rules, legacy_rows):
+    db = SessionLocal()
+    try:
+        user = make_user(db)
+        batch_tokens = _make_scenarios(db, user, "batch", datetime(2026, 1, 1))
+        result = process_claims_batch(db, limit=100)
+        assert result["processed"] == len(SCENARIOS)
+
+        single_tokens = _make_scenarios(db, user, "single", datetime(2026, 2, 1))
+        for token in single_tokens.values():
+            process_claim(Claim(encounter_token=token), db)
+
+        batch = _outcomes(db, batch_tokens)
+        single = _outcomes(db, single_tokens)
+    finally:
+        db.close()
+
+    assert batch == single
+    assert batch["approved"] == ("approved", 80.0, [])
+    assert batch["flagged"][0] == "flagged"
+    assert batch["rejected"][:2] == ("rejected", 0.0)
+    assert batch["escalated"] == ("pending", None, None)
+    assert batch["child_drug_over_age"][0] == "flagged"
+    # No date of birth is not a missing token: decided when no rule has age limits, escalated otherwise
+    assert batch["no_date_of_birth"] == ("approved", 80.0, [])
+    assert batch["no_date_of_birth_age_bound"] == ("pending", None, None)
+    # A claim without its token is rejected and keeps its payout on both paths
+    assert batch["no_token"] == ("rejected", 75.0, ["Verification token not found"])
+
+
+def test_batch_skips_claims_leased_to_the_assistant_worker(rules):
+    db = SessionLocal()
+    try:
+        leased, backing_off, expired, free = [
+            claim.encounter_token for claim in make_claims(
+                db, 4, diagnosis=[{"ICD10": "A00", "primary": True}], drugs=[DRUG], legend=LEGEND,
+                expected_payout=80.0)
+        ]
+        # Lease times are compared with the database clock, as gpt.ClaimsProcessor writes them
+        now = func.now()
+        db.add_all([
+            ClaimLease(encounter_token=leased, worker_id="worker-a", available_at=now + timedelta(minutes=5)),
+            ClaimLease(encounter_token=backing_off, available_at=now + timedelta(hours=1), attempts=2),
+            ClaimLease(encounter_token=expired, worker_id="crashed", available_at=now - timedelta(minutes=1)),
+        ])
+        db.commit()
+
+        result = process_claims_batch(db, limit=100)
+
+        db.expire_all()
+        statuses = {claim.encounter_token: claim.status for claim in db.query(Claim).all()}
+    finally:
+        db.close()
+    assert result["processed"] == 2
+    assert statuses == {leased: "pending", backing_off: "pending", expired: "approved", free: "approved"}
+
+
+def test_rules_changed_by_another_process_are_picked_up(rules, pg):
+    engine = RulesEngine(refresh_seconds=3600)
+    claim = {"diagnosis": [{"ICD10": "A00", "primary": True}], "drugs": [DRUG], "legend": LEGEND,
+             "expected_payout": 80.0}
+    db = SessionLocal()
+    try:
+        engine.ensure_loaded(db)
+        assert engine.adjudicate(claim, age_months=400).approved_total == 80.0
+
+        # Another worker edits the rules; nothing calls invalidate() in this process
+        with pg.begin() as conn:
+            conn.execute(text("UPDATE diagnosis_treatments SET pricing = 4.0 WHERE drug_icd10 = 'DRG1'"))
+
+        engine.ensure_loaded(db)
+        assert engine.adjudicate(claim, age_months=400).approved_total == 80.0
+
+        engine.refresh_seconds = 0
+        engine.ensure_loaded(db)
+        assert engine.adjudicate(claim, age_months=400).approved_total == 110.0
+
+        loaded = engine.rules
+        engine.ensure_loaded(db)
+        assert engine.rules is loaded
+    finally:
+        db.close()
@@ -0,0 +1,120 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("onnxruntime")
+
+# The patched insightface copy in this repository, not an installed one
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "insightface", "python-package"))
+from insightface.model_zoo.scrfd import SCRFD  # noqa: E402
+
+STRIDES = (8, 16, 32)
+NUM_ANCHORS = 2
+
+
+class _Node:
+    def __init__(self, name, shape):
+        self.name = name
+        self.shape = shape
+
+
+class FakeDetectorSession:
+    """
+    Stands in for a 9-output SCRFD (kps) ONNX session. Outputs are a fixed
+    function of each image in the blob, so a batch run must decode to the
+    same faces as one run per image.
+    """
+
+    def __init__(self, batched=True, batch_dim="N"):
+        self.batched = batched
+        self.runs = 0
+        self._inputs = [_Node("input.1", [batch_dim, 3, "H", "W"])]
+        self._outputs = [_Node(f"out{i}", [1, "K", 1] if batched else ["K", 1]) for i in range(9)]
+
+    def get_inputs(self):
+        return self._inputs
+
+    def get_outputs(self):
+        return self._outputs
+
+    def run(self, names, feed):
+        self.runs += 1
+        blob = feed["input.1"]
+        n, _, height, width = blob.shape
+        scores, boxes, kpss = [], [], []
+        for stride in STRIDES:
+            h, w = height // stride, width // stride
+            pooled = blob.mean(axis=1).reshape(n, h, stride, w, stride).mean(axis=(2, 4))
+            per_anchor = np.repeat(pooled.reshape(n, h * w, 1), NUM_ANCHORS, axis=1)
+            scores.append(1.0 / (1.0 + np.exp(-6.0 * per_anchor)))
+            boxes.append(np.concatenate([1.0 + np.abs(per_anchor) * k for k in (1, 2, 3, 4)], axis=2))
+            kpss.append(np.concatenate([per_anchor * k for k in range(1, 11)], axis=2))
+        outs = [o.astype(np.float32) for o in scores + boxes + kpss]
+        if not self.batched:
+            outs = [o.reshape(n * o.shape[1], o.shape[2]) for o in outs]
+        return outs
+
+
+def _images():
+    rng = np.random.default_rng(7)
+    images = []
+    for shape in ((480, 640, 3), (640, 480, 3), (300, 300, 3)):
+        noise = rng.integers(0, 256, size=shape, dtype=np.uint8)
+        # Bright squares give clusters of overlapping candidates for NMS to resolve
+        for _ in range(3):
+            y, x = rng.integers(0, shape[0] - 80), rng.integers(0, shape[1] - 80)
+            noise[y:y + 80, x:x + 80] = 255
+        images.append(noise)
+    return images
+
+
+@pytest.mark.parametrize("batched", [True, False], ids=["nkc-outputs", "flat-outputs"])
+def test_detect_batch_matches_detect(batched):
+    detector = SCRFD(session=FakeDetectorSession(batched=batched))
+    images = _images()
+
+    singles = [detector.detect(img, input_size=(320, 320)) for img in images]
+    detector.session.runs = 0
+    batch = detector.detect_batch(images, input_size=(320, 320))
+
+    assert detector.session.runs == 1
+    assert len(batch) == len(images)
+    for (det, kpss), (batch_det, batch_kpss) in zip(singles, batch):
+        assert det.shape[0] > 0
+        np.testing.assert_allclose(batch_det, det, rtol=1e-6, atol=1e-4)
+        np.testing.assert_allclose(batch_kpss, kpss, rtol=1e-6, atol=1e-4)
+
+
+def test_detect_batch_with_max_num():
+    detector = SCRFD(session=FakeDetectorSession())
+    images = _images()
+
+    singles = [detector.detect(img, input_size=(320, 320), max_num=2) for img in images]
+    batch = detector.detect_batch(images, input_size=(320, 320), max_num=2)
+
+    for (det, kpss), (batch_det, batch_kpss) in zip(singles, batch):
+        assert det.shape[0] <= 2
+        np.testing.assert_allclose(batch_det, det, rtol=1e-6, atol=1e-4)
+        np.testing.assert_allclose(batch_kpss, kpss, rtol=1e-6, atol=1e-4)
+
+
+def test_static_batch_model_falls_back_to_one_run_per_image():
+    detector = SCRFD(session=FakeDetectorSession(batch_dim=1))
+    images = _images()
+
+    singles = [detector.detect(img, input_size=(320, 320)) for img in images]
+    detector.session.runs = 0
+    batch = detector.detect_batch(images, input_size=(320, 320))
+
+    assert detector.session.runs == len(images)
+    for (det, _), (batch_det, _) in zip(singles, batch):
+        np.testing.assert_array_equal(batch_det, det)
+
+
+def test_detect_batch_empty():
+    detector = SCRFD(session=FakeDetectorSession())
+    assert detector.detect_batch([], input_size=(320, 320)) == []
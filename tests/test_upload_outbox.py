@@ -0,0 +1,182 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import upload_outbox  # noqa: E402
+from db import SessionLocal, PendingUpload, VerificationToken  # noqa: E402
+from factories import make_member, make_token, make_user  # noqa: E402
+from storage import LocalObjectStore  # noqa: E402
+from upload_outbox import UploadOutbox  # noqa: E402
+
+
+@pytest.fixture
+def outbox(pg, tmp_path):
+    return UploadOutbox(store=LocalObjectStore(root=str(tmp_path / "store")), spool_dir=str(tmp_path / "spool"),
+                        host_id="task-a")
+
+
+def _spool(outbox, key, commit=True, status="pending"):
+    db = SessionLocal()
+    try:
+        row = outbox.enqueue(db, b"jpeg", key, "image/jpeg")
+        path = row.spool_path
+        if commit:
+            row.status = status
+            db.commit()
+        else:
+            db.rollback()
+    finally:
+        db.close()
+    return path
+
+
+def _age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_sweep_removes_orphans_and_expired_failed_files(outbox, monkeypatch):
+    monkeypatch.setattr(upload_outbox, "UPLOAD_ORPHAN_SECONDS", 60)
+    monkeypatch.setattr(upload_outbox, "UPLOAD_FAILED_RETENTION_SECONDS", 3600)
+    pending = _spool(outbox, "a.jpg")
+    old_orphan = _spool(outbox, "b.jpg", commit=False)
+    new_orphan = _spool(outbox, "c.jpg", commit=False)
+    old_failed = _spool(outbox, "d.jpg", status="failed")
+    new_failed = _spool(outbox, "e.jpg", status="failed")
+    _age(pending, 7200)
+    _age(old_orphan, 120)
+    _age(new_orphan, 10)
+    _age(old_failed, 7200)
+    _age(new_failed, 600)
+
+    assert outbox.sweep_spool() == 2
+
+    assert os.path.exists(pending)
+    assert not os.path.exists(old_orphan)
+    assert os.path.exists(new_orphan)
+    assert not os.path.exists(old_failed)
+    assert os.path.exists(new_failed)
+    assert outbox.stats()["swept"] == 2
+
+
+def test_drain_loop_keeps_sweeping(outbox, monkeypatch):
+    monkeypatch.setattr(upload_outbox, "UPLOAD_ORPHAN_SECONDS", 0)
+    monkeypatch.setattr(upload_outbox, "UPLOAD_SWEEP_SECONDS", 0.05)
+    monkeypatch.setattr(upload_outbox, "UPLOAD_POLL_SECONDS", 0.01)
+
+    async def scenario():
+        outbox.start()
+        try:
+            await asyncio.sleep(0.1)
+            # Left behind by a transaction that rolled back while the process was running
+            orphan = _spool(outbox, "late.jpg", commit=False)
+            for _ in range(100):
+                if not os.path.exists(orphan):
+                    break
+                await asyncio.sleep(0.02)
+            return orphan
+        finally:
+            await outbox.stop()
+
+    orphan = asyncio.run(scenario())
+    assert not os.path.exists(orphan)
+
+
+def test_drain_uploads_and_removes_spool_file(outbox):
+    path = _spool(outbox, "uploads/1/evidence.jpg")
+
+    assert asyncio.run(outbox.drain()) == 1
+
+    assert not os.path.exists(path)
+    db = SessionLocal()
+    try:
+        row = db.query(PendingUpload).one()
+        assert row.status == "uploaded"
+        assert os.path.exists(os.path.join(outbox.store.root, "uploads/1/evidence.jpg"))
+    finally:
+        db.close()
+
+
+def test_uploaded_image_is_back_filled_into_the_verification_token(outbox):
+    db = SessionLocal()
+    try:
+        user = make_user(db)
+        token = make_token(db, make_member(db), user)
+        outbox.enqueue(db, b"jpeg", "uploads/1/compare.jpg", "image/jpeg",
+                       verification_token_id=token.id, target_column="compare_image_url")
+        db.commit()
+        token_id = token.id
+    finally:
+        db.close()
+
+    assert asyncio.run(outbox.drain()) == 1
+
+    db = SessionLocal()
+    try:
+        token = db.query(VerificationToken).filter(VerificationToken.id == token_id).one()
+        assert token.compare_image_url == outbox.url_for("uploads/1/compare.jpg")
+        assert token.encounter_image_url is None
+    finally:
+        db.close()
+
+
+def test_start_needs_a_spool_volume_and_host_id(pg, tmp_path):
+    store = LocalObjectStore(root=str(tmp_path / "store"))
+    for outbox in (UploadOutbox(store=store, spool_dir=None, host_id="task-a"),
+                   UploadOutbox(store=store, spool_dir=str(tmp_path / "spool"), host_id=None)):
+        with pytest.raises(RuntimeError):
+            outbox.start()
+
+
+def _row(key, host, spool_path, status="pending", overdue=0, uploaded_ago=None):
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        row = PendingUpload(object_key=key, spool_path=spool_path, content_type="image/jpeg", size=4, host=host,
+                            status=status, next_attempt_at=now - timedelta(seconds=overdue),
+                            uploaded_at=None if uploaded_ago is None else now - timedelta(seconds=uploaded_ago))
+        db.add(row)
+        db.commit()
+        return row.id
+    finally:
+        db.close()
+
+
+def test_sweep_rows_settles_missing_and_stranded_rows(outbox, monkeypatch, tmp_path):
+    monkeypatch.setattr(upload_outbox, "UPLOAD_STRANDED_SECONDS", 3600)
+    monkeypatch.setattr(upload_outbox, "UPLOAD_RETENTION_SECONDS", 86400)
+    gone = str(tmp_path / "spool" / "gone.bin")
+    kept = _spool(outbox, "kept.jpg")
+    # Spooled by a task that was replaced (keyed on its hostname); its volume is mounted here now
+    on_volume = tmp_path / "spool" / "on-volume.bin"
+    on_volume.write_bytes(b"jpeg")
+    ids = {
+        "own_missing": _row("own-missing.jpg", "task-a", gone),
+        "stranded_missing": _row("stranded-missing.jpg", "ip-10-0-1-5", gone, overdue=7200),
+        "stranded_on_volume": _row("stranded-on-volume.jpg", "ip-10-0-1-5", str(on_volume), overdue=7200),
+        "other_live": _row("other-live.jpg", "task-b", gone, overdue=30),
+        "old_upload": _row("old.jpg", "task-a", gone, status="uploaded", uploaded_ago=2 * 86400),
+        "new_upload": _row("new.jpg", "task-a", gone, status="uploaded", uploaded_ago=600),
+    }
+
+    assert outbox.sweep_rows() == {"abandoned": 2, "taken_over": 1, "pruned": 1}
+
+    db = SessionLocal()
+    try:
+        rows = {row.id: row for row in db.query(PendingUpload).all()}
+        kept_status = db.query(PendingUpload.status).filter(PendingUpload.spool_path == kept).scalar()
+    finally:
+        db.close()
+    assert kept_status == "pending"
+    assert rows[ids["own_missing"]].status == "failed"
+    assert rows[ids["stranded_missing"]].status == "failed"
+    assert (rows[ids["stranded_on_volume"]].status, rows[ids["stranded_on_volume"]].host) == ("pending", "task-a")
+    assert (rows[ids["other_live"]].status, rows[ids["other_live"]].host) == ("pending", "task-b")
+    assert ids["old_upload"] not in rows
+    assert ids["new_upload"] in rows
+    assert outbox.stats()["abandoned"] == 2
@@ -0,0 +1,152 @@
+import json
+import asyncio
+
+import pytest
+
+import websocket_manager
+from websocket_manager import SEQ_FIELD, STATUSES, Broker, InMemoryBroker, RedisBroker, WebSocketManager
+
+
+class SimulatedSocket:
+    """Keeps the counters it has been sent, applying deltas as a client would"""
+
+    def __init__(self, stalls: bool = False):
+        self.stalls = stalls
+        self.received = 0
+        self.closed = False
+        self.view = {}
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.stalls:
+            await asyncio.sleep(60)
+        self.received += 1
+        self.view.update(json.loads(message))
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+
+def test_broker_is_abstract():
+    with pytest.raises(TypeError):
+        Broker()
+
+    class NoPublish(Broker):
+        async def start(self, deliver):
+            pass
+
+        async def notify(self, user_id, status, count):
+            return {}
+
+        async def reset(self, user_id, status):
+            return {}
+
+    with pytest.raises(TypeError):
+        NoPublish()
+
+
+def test_fan_out_under_load(monkeypatch):
+    """A burst of changes reaches every healthy socket coalesced, and stalled sockets are dropped"""
+    monkeypatch.setattr(websocket_manager, "WS_SEND_TIMEOUT", 0.2)
+    users, per_user, notifications = 10, 40, 400
+    subscriptions = [None, ["approved"], ["flagged", "rejected"], None]
+
+    async def scenario():
+        broker = InMemoryBroker()
+        manager = WebSocketManager(broker, coalesce_seconds=0.05, queue_size=4)
+        sockets = []
+        for u in range(users):
+            for i in range(per_user):
+                ws = SimulatedSocket(stalls=i % 20 == 19)
+                statuses = subscriptions[i % len(subscriptions)]
+                await manager.connect(str(u), ws, statuses=statuses, delta=i % 2 == 0)
+                sockets.append((str(u), statuses, ws))
+
+        for n in range(notifications):
+            await manager.send_notification(str(n % users), STATUSES[n % len(STATUSES)])
+            if n % 50 == 0:
+                await asyncio.sleep(0)
+        await asyncio.sleep(0.5)
+        return broker, manager, sockets
+
+    broker, manager, sockets = asyncio.run(scenario())
+
+    healthy = [(user, statuses, ws) for user, statuses, ws in sockets if not ws.stalls]
+    for user, statuses, ws in healthy:
+        counters = {k: v for k, v in broker.counters[user].items() if k != SEQ_FIELD}
+        assert ws.view == {k: v for k, v in counters.items() if statuses is None or k in statuses}
+        assert not ws.closed
+    assert all(ws.closed for _, _, ws in sockets if ws.stalls)
+    assert manager.dropped == len(sockets) - len(healthy)
+    assert manager.stats()["connections"] == len(healthy)
+    # Coalescing: far fewer messages than one per notification per socket
+    assert manager.sent < notifications * per_user / 10
+
+
+def test_stale_snapshot_from_another_worker_is_dropped():
+    async def scenario():
+        manager = WebSocketManager(InMemoryBroker(), coalesce_seconds=0)
+        ws = SimulatedSocket()
+        await manager.connect("1", ws)
+        await manager._deliver("1", {"pending": 3, "approved": 1, "rejected": 0, "flagged": 0, SEQ_FIELD: 7})
+        await asyncio.sleep(0.05)
+        # Published by another worker before the snapshot above, but received after it
+        await manager._deliver("1", {"pending": 4, "approved": 0, "rejected": 0, "flagged": 0, SEQ_FIELD: 6})
+        await asyncio.sleep(0.05)
+        return manager, ws
+
+    manager, ws = asyncio.run(scenario())
+
+    assert ws.view == {"pending": 3, "approved": 1, "rejected": 0, "flagged": 0}
+    assert ws.received == 1
+    assert manager.stats()["stale"] == 1
+
+
+def test_older_snapshot_does_not_replace_a_newer_one_waiting_to_publish():
+    async def scenario():
+        broker = InMemoryBroker()
+        manager = WebSocketManager(broker, coalesce_seconds=0.05)
+        ws = SimulatedSocket()
+        await manager.connect("1", ws)
+        older = await broker.notify("1", "pending", 1)
+        newer = await broker.notify("1", "approved", 1)
+        # The second update finished first
+        await manager._broadcast_to_user("1", newer)
+        await manager._broadcast_to_user("1", older)
+        await asyncio.sleep(0.3)
+        return ws
+
+    ws = asyncio.run(scenario())
+
+    assert ws.view == {"pending": 0, "approved": 1, "rejected": 0, "flagged": 0}
+
+
+def test_redis_workers_share_counters_and_order():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def scenario():
+        server = fakeredis.FakeServer()
+        workers = [RedisBroker(client=fakeredis.aioredis.FakeRedis(server=server)) for _ in range(2)]
+        managers = [WebSocketManager(broker, coalesce_seconds=0.02) for broker in workers]
+        sockets = []
+        for manager in managers:
+            ws = SimulatedSocket()
+            await manager.connect("1", ws)
+            sockets.append(ws)
+        seqs = []
+        for n in range(20):
+            counters = await workers[n % 2].notify("1", "pending", 1)
+            seqs.append(counters[SEQ_FIELD])
+            await managers[n % 2]._broadcast_to_user("1", counters)
+        await asyncio.sleep(0.3)
+        for manager in managers:
+            await manager.stop()
+        return seqs, sockets
+
+    seqs, sockets = asyncio.run(scenario())
+
+    assert seqs == sorted(seqs) and len(set(seqs)) == len(seqs)
+    for ws in sockets:
+        assert ws.view["pending"] == 20
@@ -0,0 +1,141 @@
+"""
+Load test for WebSocket notification fan-out.
+
+In-process (default): thousands of simulated sockets on one WebSocketManager,
+a burst of status changes per user, some sockets too slow to keep up.
+
+    python tests/ws_load.py --users 50 --sockets 40 --notifications 500 --slow 0.02
+
+Against a running server: real sockets to /ws/notifications, status changes
+through POST /ws/trigger (needs the websockets and httpx packages).
+
+    python tests/ws_load.py --url http://localhost:8000 --users 5 --sockets 200
+"""
+import os
+import sys
+import time
+import json
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STATUSES = ["approved", "rejected", "flagged", "pending"]
+
+
+class SimulatedSocket:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.received = 0
+        self.closed = False
+        self.last = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received += 1
+        self.last = json.loads(message)
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+
+async def run_in_process(args):
+    from websocket_manager import WebSocketManager, InMemoryBroker, WS_SEND_TIMEOUT
+
+    manager = WebSocketManager(InMemoryBroker(), coalesce_seconds=args.window, queue_size=args.queue)
+    sockets = {}
+    for u in range(args.users):
+        user_id = str(u)
+        for _ in range(args.sockets):
+            ws = SimulatedSocket(delay=60.0 if random.random() < args.slow else 0.0)
+            statuses = random.choice([None, None, ["approved"], ["flagged", "rejected"]])
+            await manager.connect(user_id, ws, statuses=statuses, delta=random.random() < 0.5)
+            sockets.setdefault(user_id, []).append(ws)
+    total = args.users * args.sockets
+    print(f"{total} simulated sockets for {args.users} users")
+
+    started = time.perf_counter()
+    for i in range(args.notifications):
+        user_id = str(i % args.users)
+        await manager.send_notification(user_id, random.choice(STATUSES))
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+    await asyncio.sleep(args.window * 2 + 0.2)
+    elapsed = time.perf_counter() - started
+    if args.slow:
+        # Give stalled sends time to hit the send timeout
+        await asyncio.sleep(WS_SEND_TIMEOUT + 0.5)
+
+    healthy = [ws for group in sockets.values() for ws in group if not ws.delay]
+    received = [ws.received for ws in healthy]
+    print(f"{args.notifications} notifications in {elapsed:.2f}s")
+    print(f"messages sent: {manager.sent} (uncoalesced would be {args.notifications * args.sockets})")
+    print(f"per healthy socket: min {min(received)}, max {max(received)}, avg {sum(received) / len(received):.1f}")
+    print(f"dropped slow sockets: {manager.dropped}, still connected: {manager.stats()['connections']}")
+
+
+async def run_live(args):
+    import httpx
+    import websockets
+
+    ws_url = args.url.replace("http", "ws", 1)
+    received = []
+
+    async def listen(user_id: str, ready: asyncio.Event, stop: asyncio.Event):
+        count = 0
+        async with websockets.connect(f"{ws_url}/ws/notifications/{user_id}?delta=true") as ws:
+            ready.set()
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(ws.recv(), timeout=0.5)
+                    count += 1
+                except asyncio.TimeoutError:
+                    continue
+        received.append(count)
+
+    stop = asyncio.Event()
+    readies = []
+    tasks = []
+    for u in range(args.users):
+        for _ in range(args.sockets):
+            ready = asyncio.Event()
+            readies.append(ready)
+            tasks.append(asyncio.create_task(listen(str(u), ready, stop)))
+    await asyncio.gather(*(r.wait() for r in readies))
+    print(f"{len(tasks)} sockets connected")
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=args.url) as client:
+        await asyncio.gather(*(
+            client.post("/ws/trigger", json={"user_id": str(i % args.users), "status": random.choice(STATUSES)})
+            for i in range(args.notifications)
+        ))
+    await asyncio.sleep(1)
+    stop.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    print(f"{args.notifications} notifications in {elapsed:.2f}s")
+    print(f"per socket: min {min(received)}, max {max(received)}, avg {sum(received) / len(received):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Run against this server instead of in-process")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--sockets", type=int, default=40, help="Sockets per user")
+    parser.add_argument("--notifications", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=0, help="Notifications per second (0: as fast as possible)")
+    parser.add_argument("--slow", type=float, default=0.02, help="Fraction of sockets that never finish a send")
+    parser.add_argument("--window", type=float, default=0.15, help="Coalescing window in seconds")
+    parser.add_argument("--queue", type=int, default=16, help="Per-socket queue size")
+    args = parser.parse_args()
+    asyncio.run(run_live(args) if args.url else run_in_process(args))
+
+
+if __name__ == "__main__":
+    main()
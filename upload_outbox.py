@@ -0,0 +1,372 @@
+# upload_outbox.py
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from db import SessionLocal, PendingUpload, VerificationToken
+from storage import ObjectStore, get_object_store
+from timing import timed
+
+logger = logging.getLogger(__name__)
+
+# Both are required: the spool directory must be a persistent volume, and the host id names
+# that volume, so that rows spooled before a restart or redeploy are still drained afterwards
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR")
+UPLOAD_HOST_ID = os.getenv("UPLOAD_HOST_ID")
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "8"))
+UPLOAD_POLL_SECONDS = float(os.getenv("UPLOAD_POLL_SECONDS", "5"))
+UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", "32"))
+# A claimed row is not picked up again for this long, so a crashed worker's rows come back
+UPLOAD_LEASE_SECONDS = int(os.getenv("UPLOAD_LEASE_SECONDS", "300"))
+UPLOAD_RETRY_BASE_SECONDS = float(os.getenv("UPLOAD_RETRY_BASE_SECONDS", "5"))
+UPLOAD_RETRY_MAX_SECONDS = float(os.getenv("UPLOAD_RETRY_MAX_SECONDS", "900"))
+# Spooled files without an outbox row (their transaction rolled back) are removed after this long
+UPLOAD_ORPHAN_SECONDS = int(os.getenv("UPLOAD_ORPHAN_SECONDS", "3600"))
+# Spooled files of uploads that gave up are kept this long after spooling, for inspection, then removed
+UPLOAD_FAILED_RETENTION_SECONDS = int(os.getenv("UPLOAD_FAILED_RETENTION_SECONDS", "86400"))
+# Pending rows no host has drained for this long (their host is gone) are taken over or failed
+UPLOAD_STRANDED_SECONDS = int(os.getenv("UPLOAD_STRANDED_SECONDS", "3600"))
+# Uploaded rows are deleted this long after the upload
+UPLOAD_RETENTION_SECONDS = int(os.getenv("UPLOAD_RETENTION_SECONDS", str(7 * 86400)))
+# How often the drain loop sweeps the spool directory
+UPLOAD_SWEEP_SECONDS = float(os.getenv("UPLOAD_SWEEP_SECONDS", "600"))
+
+# Columns of VerificationToken an upload may back-fill
+TARGET_COLUMNS = ("compare_image_url", "encounter_image_url")
+
+
+class UploadOutbox:
+    """
+    Durable outbox for evidence images.
+
+    A request spools the image to the spool volume and adds a
+    ``pending_uploads`` row in its own transaction, then returns. A background
+    task of the host that owns the volume (rows are keyed on its host id)
+    drains due rows with bounded concurrency, retries failures with
+    exponential backoff and back-fills the VerificationToken column once the
+    object is stored, so request latency never includes the object store.
+    """
+
+    def __init__(self, store: Optional[ObjectStore] = None, spool_dir: Optional[str] = UPLOAD_SPOOL_DIR,
+                 host_id: Optional[str] = UPLOAD_HOST_ID,
+                 concurrency: int = UPLOAD_CONCURRENCY, max_attempts: int = UPLOAD_MAX_ATTEMPTS):
+        self._store = store
+        self.spool_dir = spool_dir
+        self.host = host_id
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.uploaded = 0
+        self.failed = 0
+        self.retried = 0
+        self.swept = 0
+        self.abandoned = 0
+        self.taken_over = 0
+        self.pruned = 0
+
+    @property
+    def store(self) -> ObjectStore:
+        if self._store is None:
+            self._store = get_object_store()
+        return self._store
+
+    def check_config(self) -> None:
+        if not self.spool_dir or not self.host:
+            raise RuntimeError(
+                "UPLOAD_SPOOL_DIR and UPLOAD_HOST_ID must be set: the spool directory has to be a "
+                "persistent volume and the host id has to stay the same across restarts"
+            )
+
+    def url_for(self, key: str) -> str:
+        """URL the object will have once uploaded"""
+        return self.store.url_for(key)
+
+    @timed("outbox.enqueue")
+    def enqueue(self, db: Session, data: bytes, object_key: str, content_type: str,
+                verification_token_id=None, target_column: Optional[str] = None) -> PendingUpload:
+        """
+        Spool data and add its outbox row to db; the row becomes visible to the
+        uploader when the caller commits.
+        """
+        if target_column is not None and target_column not in TARGET_COLUMNS:
+            raise ValueError(f"Unsupported upload target column: {target_column}")
+        self.check_config()
+        os.makedirs(self.spool_dir, exist_ok=True)
+        spool_path = os.path.join(self.spool_dir, f"{uuid.uuid4().hex}.bin")
+        tmp_path = spool_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, spool_path)
+
+        pending = PendingUpload(
+            object_key=object_key,
+            spool_path=spool_path,
+            content_type=content_type,
+            size=len(data),
+            host=self.host,
+            verification_token_id=verification_token_id,
+            target_column=target_column,
+        )
+        db.add(pending)
+        return pending
+
+    def notify(self) -> None:
+        """Wake the uploader after a commit instead of waiting for the next poll"""
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self) -> None:
+        self.check_config()
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "concurrency": self.concurrency,
+            "uploaded": self.uploaded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "swept": self.swept,
+            "abandoned": self.abandoned,
+            "taken_over": self.taken_over,
+            "pruned": self.pruned,
+        }
+
+    async def drain(self) -> int:
+        """Upload every row that is currently due; returns how many were attempted"""
+        rows = await asyncio.to_thread(self._claim_due, UPLOAD_BATCH_SIZE)
+        if not rows:
+            return 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def upload(row: Dict[str, Any]) -> None:
+            async with semaphore:
+                await self._upload(row)
+
+        await asyncio.gather(*(upload(row) for row in rows))
+        return len(rows)
+
+    async def _run(self) -> None:
+        last_sweep = None
+        while True:
+            if last_sweep is None or time.monotonic() - last_sweep >= UPLOAD_SWEEP_SECONDS:
+                last_sweep = time.monotonic()
+                try:
+                    await asyncio.to_thread(self.sweep_spool)
+                    await asyncio.to_thread(self.sweep_rows)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Spool sweep failed: {str(e)}")
+            try:
+                while await self.drain() == UPLOAD_BATCH_SIZE:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Upload outbox drain failed: {str(e)}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=UPLOAD_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def sweep_spool(self) -> int:
+        """
+        Remove spooled files nothing will upload: orphans (their transaction
+        rolled back) after UPLOAD_ORPHAN_SECONDS, and files of failed rows
+        after UPLOAD_FAILED_RETENTION_SECONDS. Returns how many were removed.
+        """
+        if not os.path.isdir(self.spool_dir):
+            return 0
+        db = SessionLocal()
+        try:
+            rows = db.query(PendingUpload.spool_path, PendingUpload.status).filter(
+                PendingUpload.host == self.host,
+                PendingUpload.status.in_(("pending", "failed")),
+            ).all()
+        finally:
+            db.close()
+        pending = {path for path, status in rows if status == "pending"}
+        failed = {path for path, status in rows if status == "failed"}
+        now = time.time()
+        removed = 0
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            if path in pending:
+                continue
+            keep_for = UPLOAD_FAILED_RETENTION_SECONDS if path in failed else UPLOAD_ORPHAN_SECONDS
+            try:
+                if now - os.path.getmtime(path) < keep_for:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                # Uploaded and removed by a worker since the listing
+                continue
+            removed += 1
+            logger.info(f"Removed {'failed' if path in failed else 'orphaned'} spool file {path}")
+        self.swept += removed
+        return removed
+
+    def sweep_rows(self) -> Dict[str, int]:
+        """
+        Settle rows nothing would drain and prune old ones. Due pending rows of
+        this host, and of any host that has not drained them for
+        UPLOAD_STRANDED_SECONDS, are marked failed when their spooled file is
+        missing; stranded rows whose file is on this host's volume are taken
+        over. Uploaded rows are deleted after UPLOAD_RETENTION_SECONDS.
+        """
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            rows = db.query(PendingUpload).filter(
+                PendingUpload.status == "pending",
+                # Rows being uploaded are leased into the future
+                PendingUpload.next_attempt_at <= now,
+                or_(
+                    PendingUpload.host == self.host,
+                    PendingUpload.next_attempt_at < now - timedelta(seconds=UPLOAD_STRANDED_SECONDS),
+                ),
+            ).with_for_update(skip_locked=True).all()
+            abandoned = taken_over = 0
+            for row in rows:
+                if not os.path.exists(row.spool_path):
+                    row.status = "failed"
+                    row.last_error = f"Spooled file is missing on {self.host}"
+                    abandoned += 1
+                    logger.error(f"Giving up on upload of {row.object_key} spooled by {row.host}: the file is missing")
+                elif row.host != self.host:
+                    logger.info(f"Took over upload of {row.object_key} from {row.host}")
+                    row.host = self.host
+                    taken_over += 1
+            pruned = db.query(PendingUpload).filter(
+                PendingUpload.status == "uploaded",
+                PendingUpload.uploaded_at < now - timedelta(seconds=UPLOAD_RETENTION_SECONDS),
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.abandoned += abandoned
+        self.taken_over += taken_over
+        self.pruned += pruned
+        return {"abandoned": abandoned, "taken_over": taken_over, "pruned": pruned}
+
+    def _claim_due(self, limit: int) -> List[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            rows = db.query(PendingUpload).filter(
+                PendingUpload.status == "pending",
+                PendingUpload.host == self.host,
+                PendingUpload.next_attempt_at <= now,
+            ).order_by(PendingUpload.next_attempt_at).limit(limit).with_for_update(skip_locked=True).all()
+            claimed = []
+            for row in rows:
+                # Lease the row so other workers on this host skip it while it uploads
+                row.next_attempt_at = now + timedelta(seconds=UPLOAD_LEASE_SECONDS)
+                claimed.append({
+                    "id": row.id,
+                    "object_key": row.object_key,
+                    "spool_path": row.spool_path,
+                    "content_type": row.content_type,
+                    "attempts": row.attempts,
+                })
+            db.commit()
+            return claimed
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _upload(self, row: Dict[str, Any]) -> None:
+        started_at = time.perf_counter()
+        try:
+            url = await asyncio.to_thread(
+                self.store.put_file, row["spool_path"], row["object_key"], row["content_type"]
+            )
+        except Exception as e:
+            await asyncio.to_thread(self._record_failure, row, str(e))
+            return
+        await asyncio.to_thread(self._record_success, row, url)
+        logger.info(f"Uploaded {row['object_key']} in {time.perf_counter() - started_at:.2f}s")
+
+    def _record_success(self, row: Dict[str, Any], url: str) -> None:
+        db = SessionLocal()
+        try:
+            pending = db.query(PendingUpload).filter(PendingUpload.id == row["id"]).first()
+            if pending is None:
+                return
+            if pending.verification_token_id is not None and pending.target_column in TARGET_COLUMNS:
+                db.query(VerificationToken).filter(
+                    VerificationToken.id == pending.verification_token_id
+                ).update({pending.target_column: url}, synchronize_session=False)
+            pending.status = "uploaded"
+            pending.uploaded_at = datetime.utcnow()
+            pending.last_error = None
+            db.commit()
+            self.uploaded += 1
+        except Exception as e:
+            db.rollback()
+            # The lease expires and the upload is retried; a second PUT of the same key is harmless
+            logger.error(f"Failed to record upload of {row['object_key']}: {str(e)}")
+            return
+        finally:
+            db.close()
+        try:
+            os.remove(row["spool_path"])
+        except OSError as e:
+            logger.warning(f"Could not remove spooled file {row['spool_path']}: {str(e)}")
+
+    def _record_failure(self, row: Dict[str, Any], error: str) -> None:
+        attempts = row["attempts"] + 1
+        db = SessionLocal()
+        try:
+            pending = db.query(PendingUpload).filter(PendingUpload.id == row["id"]).first()
+            if pending is None:
+                return
+            pending.attempts = attempts
+            pending.last_error = error
+            if attempts >= self.max_attempts or not os.path.exists(row["spool_path"]):
+                pending.status = "failed"
+                self.failed += 1
+                logger.error(f"Giving up on upload of {row['object_key']} after {attempts} attempts: {error}")
+            else:
+                delay = min(UPLOAD_RETRY_BASE_SECONDS * (2 ** (attempts - 1)), UPLOAD_RETRY_MAX_SECONDS)
+                pending.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+                self.retried += 1
+                logger.warning(f"Upload of {row['object_key']} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to record upload failure for {row['object_key']}: {str(e)}")
+        finally:
+            db.close()
+
+
+upload_outbox = UploadOutbox()
@@ -2,22 +2,43 @@ from fastapi import UploadFile  # Add this import statement
 import cv2
 import numpy as np
 import insightface
-from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from insightface.utils import face_align
 from scipy.spatial.distance import cosine, euclidean
 import logging
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Union
 from datetime import datetime
-import requests
-from io import BytesIO
+import asyncio
+import threading
+import httpx
+from face_cache import ProfileEmbeddingStore, profile_embeddings
+from inference_pool import InferenceExecutor, inference_executor
+from recognition_batcher import RecognitionBatcher
+from face_quality import FaceQualityError, FaceQualityPolicy, default_quality_policy
+from model_registry import FACE_MODEL_PACK, ModelRegistry, model_registry
+from frame_ingest import Frame, decode_image
+from timing import span
+
+PROFILE_FETCH_TIMEOUT = 15.0
+# Verification only needs detection and ArcFace; landmark/genderage models are never loaded
+VERIFICATION_MODULES = ('detection', 'recognition')
 
 class FaceComparisonSystem:
-    def __init__(self, model_name: str = "buffalo_l", det_size: Tuple[int, int] = (640, 640)):
+    def __init__(self, model_name: str = FACE_MODEL_PACK, det_size: Tuple[int, int] = (640, 640),
+                 profile_store: Optional[ProfileEmbeddingStore] = None,
+                 executor: Optional[InferenceExecutor] = None,
+                 quality_policy: Optional[FaceQualityPolicy] = None,
+                 registry: Optional[ModelRegistry] = None):
         """
         Initialize the face comparison system
         
         Args:
             model_name: Name of the InsightFace model to use
             det_size: Detection size for face analysis
+            profile_store: Cache for member profile embeddings
+            executor: Worker pool that model inference is submitted to
+            quality_policy: Checks a frame must pass before recognition runs
+            registry: Where the (shared) models are loaded from
         """
         logging.basicConfig(
             level=logging.INFO,
@@ -25,41 +46,118 @@ class FaceComparisonSystem:
         )
         self.logger = logging.getLogger(__name__)
         
-        self.app = FaceAnalysis(name=model_name)
-        self.app.prepare(ctx_id=0, det_size=det_size)
+        self.app = (registry or model_registry).get(model_name, modules=VERIFICATION_MODULES, det_size=det_size)
+        self.quality_policy = quality_policy or default_quality_policy
+        self.profile_store = profile_store or profile_embeddings
+        self.executor = executor or inference_executor
+        self.recognizer = RecognitionBatcher(self.app.models['recognition'])
+        if not hasattr(self.app.det_model, 'detect_batch'):
+            # The pip insightface has no batched detection; only the copy in insightface/python-package does
+            self.logger.warning(
+                f"{type(self.app.det_model).__name__} has no detect_batch; "
+                "images will be detected one at a time (install ./insightface/python-package)"
+            )
+        self._http_client: Optional[httpx.AsyncClient] = None
         
     def process_image(self, image_path: str) -> np.ndarray:
-        """Process an image and return the RGB array"""
+        """Read an image from disk as the BGR array the models expect"""
         img = cv2.imread(image_path)
         if img is None:
             raise ValueError(f"Could not read image: {image_path}")
-        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return img
     
-    def get_face_info(self, image: np.ndarray, require_single_face: bool = False) -> List[Dict]:
+    def detect_faces(self, image: np.ndarray) -> List[Face]:
+        """Run only the detection model and return bare Face objects"""
+        return self.detect_faces_batch([image])[0]
+
+    def detect_faces_batch(self, images: List[np.ndarray]) -> List[List[Face]]:
+        """Run detection for several images, in a single model call when the detector supports it"""
+        det_model = self.app.det_model
+        if len(images) > 1 and hasattr(det_model, 'detect_batch'):
+            detections = det_model.detect_batch(images, max_num=0, metric='default')
+        else:
+            detections = [det_model.detect(image, max_num=0, metric='default') for image in images]
+
+        results = []
+        for bboxes, kpss in detections:
+            faces = []
+            for i in range(bboxes.shape[0]):
+                faces.append(Face(
+                    bbox=bboxes[i, 0:4],
+                    kps=kpss[i] if kpss is not None else None,
+                    det_score=bboxes[i, 4]
+                ))
+            results.append(faces)
+        return results
+
+    def get_face_info(self, image: np.ndarray, require_single_face: bool = False,
+                      check_quality: bool = False) -> List[Dict]:
         """Extract face information including embeddings and scores"""
-        faces = self.app.get(image)
-        
-        if len(faces) == 0:
-            raise ValueError("No faces detected in image")
-            
-        if require_single_face and len(faces) > 1:
-            raise ValueError("Multiple faces detected in image when only one was expected")
-        
-        face_info = []
-        for face in faces:
-            info = {
-                'bbox': face.bbox.tolist(),
-                'embedding': face.embedding,
-                'detection_score': face.det_score,
-                'facial_features': {
-                    'norm_l2': float(np.linalg.norm(face.embedding)),
-                    'bbox_area': float((face.bbox[2] - face.bbox[0]) * (face.bbox[3] - face.bbox[1])),
-                    'bbox_aspect_ratio': float((face.bbox[2] - face.bbox[0]) / (face.bbox[3] - face.bbox[1]))
-                }
+        return self.get_face_info_batch(
+            [image], require_single_face=require_single_face, check_quality=[check_quality]
+        )[0]
+
+    def get_face_info_batch(self, images: List[np.ndarray], require_single_face: bool = False,
+                            check_quality: Optional[List[bool]] = None) -> List[List[Dict]]:
+        """
+        Extract face information for several images, one list of faces per image
+
+        Runs in stages: detection first, then the face count and (for images
+        flagged in check_quality) the quality policy, and only when every image
+        passed are the crops sent to the recognition model.
+        """
+        with span("detection"):
+            faces_per_image = self.detect_faces_batch(images)
+        check_quality = check_quality or [False] * len(images)
+
+        for image, faces, checked in zip(images, faces_per_image, check_quality):
+            if not checked:
+                if len(faces) == 0:
+                    raise ValueError("No faces detected in image")
+                if require_single_face and len(faces) > 1:
+                    raise ValueError("Multiple faces detected in image when only one was expected")
+                continue
+
+            # Frames the user can simply retake are reported as FaceQualityError
+            if len(faces) == 0:
+                raise FaceQualityError('no_face', "No faces detected in image")
+            if require_single_face and len(faces) > 1:
+                raise FaceQualityError('multiple_faces', "Multiple faces detected in image when only one was expected")
+            with span("quality"):
+                for face in faces:
+                    self.quality_policy.check(image, face)
+
+        for image, faces in zip(images, faces_per_image):
+            for face in faces:
+                for taskname, model in self.app.models.items():
+                    if taskname in ('detection', 'recognition'):
+                        continue
+                    model.get(image, face)
+        with span("recognition"):
+            # Submit every crop before waiting so they land in the same recognition batch
+            futures = [
+                (face, self.recognizer.submit(
+                    face_align.norm_crop(image, landmark=face.kps, image_size=self.recognizer.input_size)
+                ))
+                for image, faces in zip(images, faces_per_image)
+                for face in faces
+            ]
+            for face, future in futures:
+                face.embedding = future.result()
+
+        return [[self._face_to_info(face) for face in faces] for faces in faces_per_image]
+
+    def _face_to_info(self, face: Face) -> Dict:
+        return {
+            'bbox': face.bbox.tolist(),
+            'embedding': face.embedding,
+            'detection_score': face.det_score,
+            'facial_features': {
+                'norm_l2': float(np.linalg.norm(face.embedding)),
+                'bbox_area': float((face.bbox[2] - face.bbox[0]) * (face.bbox[3] - face.bbox[1])),
+                'bbox_aspect_ratio': float((face.bbox[2] - face.bbox[0]) / (face.bbox[3] - face.bbox[1]))
             }
-            face_info.append(info)
-            
-        return face_info
+        }
 
     def calculate_similarity_metrics(self, emb1: np.ndarray, emb2: np.ndarray) -> Dict[str, float]:
         """Calculate various similarity metrics between two embeddings"""
@@ -95,9 +193,16 @@ class FaceComparisonSystem:
         """
         try:
             # Get face information
-            face1_info = self.get_face_info(img1, require_single_face=True)[0]
-            face2_info = self.get_face_info(img2, require_single_face=True)[0]
-            
+            face1_infos, face2_infos = self.get_face_info_batch([img1, img2], require_single_face=True)
+            face1_info, face2_info = face1_infos[0], face2_infos[0]
+            return self.compare_face_info(face1_info, face2_info, threshold)
+        except Exception as e:
+            self.logger.error(f"Error comparing faces: {str(e)}")
+            raise
+
+    def compare_face_info(self, face1_info: Dict, face2_info: Dict, threshold: float = 0.5) -> Dict:
+        """Build the comparison result for two faces returned by get_face_info"""
+        try:
             # Calculate similarity metrics
             similarity_metrics = self.calculate_similarity_metrics(
                 face1_info['embedding'],
@@ -143,28 +248,130 @@ class FaceComparisonSystem:
             self.logger.error(f"Error comparing faces: {str(e)}")
             raise
 
-    async def compare_blobs(self, profile_image_url: str, webcam_image: UploadFile, threshold: float = 0.5) -> Dict:
-        """Compare two image blobs"""
+    def _http(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(timeout=PROFILE_FETCH_TIMEOUT, follow_redirects=True)
+        return self._http_client
+
+    async def aclose(self) -> None:
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+    def get_face_info_from_bytes(self, image_data: bytes, require_single_face: bool = True,
+                                 check_quality: bool = False) -> Dict:
+        """Decode an encoded image and return info for its face (runs on an inference worker)"""
+        return self.get_face_info_batch_from_bytes(
+            [image_data], require_single_face=require_single_face, check_quality=[check_quality]
+        )[0]
+
+    def get_face_info_batch_from_bytes(self, images_data: List[bytes], require_single_face: bool = True,
+                                       check_quality: Optional[List[bool]] = None) -> List[Dict]:
+        """Decode several encoded images and analyse them in one detection/recognition pass"""
+        with span("decode"):
+            decoded = [decode_image(image_data) for image_data in images_data]
+        faces_per_image = self.get_face_info_batch(
+            [image for image, _ in decoded], require_single_face=require_single_face, check_quality=check_quality
+        )
+        return [
+            self._rescale_face_info(faces[0], factor)
+            for faces, (_, factor) in zip(faces_per_image, decoded)
+        ]
+
+    def _rescale_face_info(self, face_info: Dict, factor: int) -> Dict:
+        """Map a face found on a reduced-resolution decode back onto the original image"""
+        if factor == 1:
+            return face_info
+        face_info['bbox'] = [v * factor for v in face_info['bbox']]
+        face_info['facial_features']['bbox_area'] *= factor * factor
+        return face_info
+
+    async def fetch_image(self, image_url: str, etag: Optional[str] = None) -> httpx.Response:
+        headers = {"If-None-Match": etag} if etag else {}
+        with span("profile.fetch"):
+            response = await self._http().get(image_url, headers=headers)
+        if response.status_code not in (200, 304):
+            raise ValueError(f"Failed to fetch profile image from URL: {image_url}")
+        return response
+
+    async def _lookup_profile(self, membership_id: str, profile_image_url: str) -> Tuple[Optional[Dict], Optional[bytes], Optional[str]]:
+        """
+        Return (face_info, None, None) when the profile store can answer,
+        otherwise (None, image_bytes, etag) for the freshly fetched profile image.
+        """
+        with span("profile.cache"):
+            cached = await asyncio.to_thread(self.profile_store.get, membership_id, profile_image_url)
+        if cached is not None and not cached.is_stale():
+            return cached.face_info(), None, None
+
+        response = await self.fetch_image(profile_image_url, etag=cached.etag if cached else None)
+        if response.status_code == 304 and cached is not None:
+            await asyncio.to_thread(self.profile_store.touch, cached)
+            return cached.face_info(), None, None
+        if response.status_code != 200:
+            raise ValueError(f"Failed to fetch profile image from URL: {profile_image_url}")
+        return None, response.content, response.headers.get("ETag")
+
+    async def get_profile_face_info(self, membership_id: str, profile_image_url: str) -> Dict:
+        """
+        Return face info for a member's profile image, running the model only
+        when the image has not been seen before (or has changed upstream).
+        """
+        face_info, image_data, etag = await self._lookup_profile(membership_id, profile_image_url)
+        if face_info is not None:
+            return face_info
+
+        face_info = await self.executor.run(self.get_face_info_from_bytes, image_data)
+        await asyncio.to_thread(self.profile_store.put, membership_id, profile_image_url, face_info, etag)
+        return face_info
+
+    async def compare_blobs(self, profile_image_url: str, webcam_image: Union[Frame, bytes, UploadFile], threshold: float = 0.5,
+                            membership_id: Optional[str] = None) -> Dict:
+        """
+        Compare two image blobs
+
+        Decoding and inference run on the inference executor so the event loop
+        stays free. When membership_id is given the profile embedding is served
+        from the profile store, so only the webcam image is run through the model;
+        otherwise both images go through detection and recognition together.
+        The webcam frame must pass the quality policy before recognition runs,
+        otherwise FaceQualityError is raised.
+        """
         try:
-            # Fetch the profile image from the URL
-            response = requests.get(profile_image_url)
-            if response.status_code != 200:
-                raise ValueError(f"Failed to fetch profile image from URL: {profile_image_url}")
-
-            # Convert the fetched image to a numpy array
-            member_image_data = BytesIO(response.content)
-            member_image_np = np.frombuffer(member_image_data.getvalue(), np.uint8)
-            member_image_cv = cv2.imdecode(member_image_np, cv2.IMREAD_COLOR)
-            member_image_rgb = cv2.cvtColor(member_image_cv, cv2.COLOR_BGR2RGB)
-
-            # Read the uploaded webcam image
-            webcam_image_data = await webcam_image.read()
-            webcam_image_np = np.frombuffer(webcam_image_data, np.uint8)
-            webcam_image_cv = cv2.imdecode(webcam_image_np, cv2.IMREAD_COLOR)
-            webcam_image_rgb = cv2.cvtColor(webcam_image_cv, cv2.COLOR_BGR2RGB)
+            if membership_id:
+                member_face_info, member_image_data, etag = await self._lookup_profile(
+                    membership_id, profile_image_url
+                )
+            else:
+                response = await self.fetch_image(profile_image_url)
+                if response.status_code != 200:
+                    raise ValueError(f"Failed to fetch profile image from URL: {profile_image_url}")
+                member_face_info, member_image_data, etag = None, response.content, None
+
+            # Callers that already read the upload pass its bytes, so they are not read twice
+            if isinstance(webcam_image, Frame):
+                webcam_image_data = webcam_image.data
+            elif isinstance(webcam_image, bytes):
+                webcam_image_data = webcam_image
+            else:
+                webcam_image_data = await webcam_image.read()
+
+            if member_face_info is None:
+                member_face_info, webcam_face_info = await self.executor.run(
+                    self.get_face_info_batch_from_bytes, [member_image_data, webcam_image_data],
+                    check_quality=[False, True]
+                )
+                if membership_id:
+                    await asyncio.to_thread(
+                        self.profile_store.put, membership_id, profile_image_url, member_face_info, etag
+                    )
+            else:
+                webcam_face_info = await self.executor.run(
+                    self.get_face_info_from_bytes, webcam_image_data, check_quality=True
+                )
 
             # Compare faces
-            return self.compare_faces(member_image_rgb, webcam_image_rgb, threshold)
+            return self.compare_face_info(member_face_info, webcam_face_info, threshold)
         except Exception as e:
             self.logger.error(f"Error in compare_blobs: {str(e)}")
             raise
@@ -193,6 +400,25 @@ class FaceComparisonSystem:
             self.logger.error(f"Error in batch comparison: {str(e)}")
             raise
 
+_face_system: Optional[FaceComparisonSystem] = None
+_face_system_lock = threading.Lock()
+
+
+def get_face_system() -> FaceComparisonSystem:
+    """Return the process-wide FaceComparisonSystem, loading the models on first use"""
+    global _face_system
+    if _face_system is None:
+        with _face_system_lock:
+            if _face_system is None:
+                _face_system = FaceComparisonSystem()
+    return _face_system
+
+
+async def close_face_system() -> None:
+    if _face_system is not None:
+        await _face_system.aclose()
+
+
 def main():
     # Initialize the system
     face_system = FaceComparisonSystem()
@@ -1,95 +1,446 @@
+import os
+import time
 import asyncio
-from typing import Dict, List
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
 from fastapi import WebSocket
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
-class WebSocketManager:
+# memory (single process) or redis (counters and fan-out shared by every worker/host)
+WS_BROKER = os.getenv("WS_BROKER", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+WS_CHANNEL = os.getenv("WS_CHANNEL", "ws:notifications")
+WS_COUNTER_TTL = int(os.getenv("WS_COUNTER_TTL", str(7 * 24 * 3600)))
+# A socket that doesn't take a message within this long is dropped
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "2"))
+# Updates to a user's counters within this window are sent as one message
+WS_COALESCE_SECONDS = float(os.getenv("WS_COALESCE_SECONDS", "0.15"))
+# Messages waiting per socket before it is treated as a slow consumer and dropped
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "16"))
+
+STATUSES = ("pending", "approved", "rejected", "flagged")
+# Stored and published with a user's counters; grows with every change so receivers can drop stale snapshots
+SEQ_FIELD = "_seq"
+
+Deliver = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+def _empty_counters() -> Dict[str, int]:
+    return {status: 0 for status in STATUSES}
+
+
+def _apply_notification(counters: Dict[str, int], status: str, count: int) -> Dict[str, int]:
+    # A decided claim leaves pending
+    if status != "pending" and counters.get("pending", 0) > 0:
+        counters["pending"] = max(0, counters["pending"] - count)
+    counters[status] = counters.get(status, 0) + count
+    return counters
+
+
+def _newer(old: Dict[str, Any], new: Dict[str, Any]) -> bool:
+    return new.get(SEQ_FIELD, 0) >= old.get(SEQ_FIELD, 0)
+
+
+class Broker(ABC):
+    """
+    Counter store and message fan-out behind the WebSocketManager.
+
+    notify() and reset() return the user's counters with SEQ_FIELD, which
+    is larger after every change to them. publish() must reach the deliver
+    callback of every process that start()ed with the broker, including
+    the publishing one, but need not keep messages in order.
+    """
+
+    @abstractmethod
+    async def start(self, deliver: Deliver) -> None:
+        ...
+
+    async def stop(self) -> None:
+        pass
+
+    @abstractmethod
+    async def notify(self, user_id: str, status: str, count: int) -> Dict[str, int]:
+        """Record count claims moving to status; returns the user's counters"""
+
+    @abstractmethod
+    async def reset(self, user_id: str, status: str) -> Dict[str, int]:
+        ...
+
+    @abstractmethod
+    async def publish(self, user_id: str, data: Dict[str, Any]) -> None:
+        ...
+
+
+class InMemoryBroker(Broker):
+    """Single-process broker: counters in a dict, publish delivers directly"""
+
     def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-        self.pending_counters: Dict[str, Dict[str, int]] = {}
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def notify(self, user_id: str, status: str, count: int) -> Dict[str, int]:
+        counters = self.counters.setdefault(user_id, _empty_counters())
+        _apply_notification(counters, status, count)
+        counters[SEQ_FIELD] = counters.get(SEQ_FIELD, 0) + 1
+        return dict(counters)
+
+    async def reset(self, user_id: str, status: str) -> Dict[str, int]:
+        counters = self.counters.setdefault(user_id, _empty_counters())
+        counters[status] = 0
+        counters[SEQ_FIELD] = counters.get(SEQ_FIELD, 0) + 1
+        return dict(counters)
+
+    async def publish(self, user_id: str, data: Dict[str, Any]) -> None:
+        if self._deliver is not None:
+            await self._deliver(user_id, data)
+
+
+class RedisBroker(Broker):
+    """
+    Redis broker: counters in a hash per user, messages over pub/sub.
+
+    Takes any redis.asyncio compatible client, so tests can pass
+    fakeredis.aioredis.FakeRedis. Counter updates use WATCH/MULTI rather
+    than Lua scripts, which fakeredis does not always support.
+    """
+
+    def __init__(self, client=None, url: str = REDIS_URL, channel: str = WS_CHANNEL,
+                 counter_ttl: int = WS_COUNTER_TTL):
+        if client is None:
+            import redis.asyncio
+            client = redis.asyncio.from_url(url)
+        self.client = client
+        self.channel = channel
+        self.counter_ttl = counter_ttl
+        self._deliver: Optional[Deliver] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _key(self, user_id: str) -> str:
+        return f"ws:counters:{user_id}"
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+        if self._task is None:
+            ready = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._listen(ready))
+            # Don't return before the subscription exists, or early messages are missed
+            try:
+                await asyncio.wait_for(ready.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                logger.warning("Redis subscription not ready yet, still retrying in the background")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _listen(self, ready: asyncio.Event) -> None:
+        delay = 1.0
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                ready.set()
+                delay = 1.0
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None or message.get("type") != "message":
+                        continue
+                    try:
+                        envelope = json.loads(message["data"])
+                        await self._deliver(envelope["user_id"], envelope["data"])
+                    except Exception as e:
+                        logger.error(f"Error delivering broker message: {str(e)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis subscription lost, retrying in {delay:.0f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+            finally:
+                try:
+                    await pubsub.unsubscribe(self.channel)
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    async def _update(self, user_id: str, change: Callable[[Dict[str, int]], Dict[str, int]]) -> Dict[str, int]:
+        from redis.exceptions import WatchError
+        key = self._key(user_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    stored = await pipe.hgetall(key)
+                    counters = _empty_counters()
+                    counters.update({_text(k): int(v) for k, v in stored.items()})
+                    counters = change(counters)
+                    # Microseconds rather than +1, so a hash that expired and came back still counts up
+                    counters[SEQ_FIELD] = max(counters.get(SEQ_FIELD, 0) + 1, int(time.time() * 1_000_000))
+                    pipe.multi()
+                    pipe.hset(key, mapping=counters)
+                    pipe.expire(key, self.counter_ttl)
+                    await pipe.execute()
+                    return counters
+                except WatchError:
+                    continue
 
-    async def connect(self, user_id: str, websocket: WebSocket):
+    async def notify(self, user_id: str, status: str, count: int) -> Dict[str, int]:
+        return await self._update(user_id, lambda counters: _apply_notification(counters, status, count))
+
+    async def reset(self, user_id: str, status: str) -> Dict[str, int]:
+        def change(counters: Dict[str, int]) -> Dict[str, int]:
+            counters[status] = 0
+            return counters
+        return await self._update(user_id, change)
+
+    async def publish(self, user_id: str, data: Dict[str, Any]) -> None:
+        await self.client.publish(self.channel, json.dumps({"user_id": user_id, "data": data}))
+
+
+def get_broker() -> Broker:
+    if WS_BROKER == "redis":
+        return RedisBroker()
+    if WS_BROKER == "memory":
+        return InMemoryBroker()
+    raise ValueError(f"Unknown WS_BROKER: {WS_BROKER}")
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class _Coalescer:
+    """
+    Keeps the latest value per key and hands it to flush once per window.
+    With newer(old, new), a value put after a newer one doesn't replace it.
+    """
+
+    def __init__(self, window: float, flush: Callable[[str, Any], Awaitable[None]],
+                 newer: Optional[Callable[[Any, Any], bool]] = None):
+        self.window = window
+        self._flush = flush
+        self._newer = newer
+        self._latest: Dict[str, Any] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def put(self, key: str, value: Any) -> None:
+        scheduled = key in self._latest
+        if scheduled and self._newer is not None and not self._newer(self._latest[key], value):
+            return
+        self._latest[key] = value
+        if not scheduled:
+            task = asyncio.get_running_loop().create_task(self._fire(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fire(self, key: str) -> None:
+        if self.window > 0:
+            await asyncio.sleep(self.window)
+        value = self._latest.pop(key)
+        try:
+            await self._flush(key, value)
+        except Exception as e:
+            logger.error(f"Coalesced flush for {key} failed: {str(e)}")
+
+
+class _Connection:
+    """A socket, the statuses it wants, what it was last sent and its bounded send queue"""
+
+    def __init__(self, websocket: WebSocket, statuses: Optional[Set[str]], delta: bool, queue_size: int):
+        self.websocket = websocket
+        self.statuses = statuses
+        self.delta = delta
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.last_sent: Dict[str, int] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def message_for(self, counters: Dict[str, int]) -> Optional[Dict[str, int]]:
+        """What this connection should be sent for counters, or None if nothing it watches changed"""
+        view = {k: v for k, v in counters.items() if self.statuses is None or k in self.statuses}
+        changed = {k: v for k, v in view.items() if self.last_sent.get(k) != v}
+        if not changed:
+            return None
+        self.last_sent.update(changed)
+        return changed if self.delta else view
+
+
+class WebSocketManager:
+    """
+    Claim counters pushed to each user's sockets.
+
+    Counter updates are coalesced per user for WS_COALESCE_SECONDS, both
+    before they are published and before they are fanned out to sockets, so
+    a burst of status changes becomes one message per socket. A socket can
+    subscribe to some statuses only and ask for deltas (just the counters
+    that changed). Every socket has a bounded queue drained by its own
+    sender; a socket whose queue fills up or whose send times out is
+    dropped instead of holding up the others.
+
+    Snapshots from different workers can arrive out of order; one whose
+    SEQ_FIELD isn't above the last one delivered for the user is dropped.
+    """
+
+    def __init__(self, broker: Optional[Broker] = None, coalesce_seconds: float = WS_COALESCE_SECONDS,
+                 queue_size: int = WS_QUEUE_SIZE):
+        self.active_connections: Dict[str, List[_Connection]] = {}
+        self._broker = broker
+        self._started = False
+        self._start_lock: Optional[asyncio.Lock] = None
+        self.queue_size = queue_size
+        # Concurrent updates in this process can finish out of order too
+        self._publish = _Coalescer(coalesce_seconds, self._publish_now, newer=_newer)
+        self._fan_out = _Coalescer(coalesce_seconds, self._fan_out_now)
+        self._closing: Set[asyncio.Task] = set()
+        # Newest SEQ_FIELD delivered per user
+        self._delivered_seq: Dict[str, int] = {}
+        self.sent = 0
+        self.dropped = 0
+        self.stale = 0
+
+    @property
+    def broker(self) -> Broker:
+        if self._broker is None:
+            self._broker = get_broker()
+        return self._broker
+
+    async def start(self) -> None:
+        """Subscribe this process to the broker; safe to call more than once"""
+        if self._started:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if not self._started:
+                await self.broker.start(self._deliver)
+                self._started = True
+
+    async def stop(self) -> None:
+        if self._started:
+            await self.broker.stop()
+            self._started = False
+
+    async def connect(self, user_id: str, websocket: WebSocket, statuses: Optional[Iterable[str]] = None,
+                      delta: bool = False):
+        await self.start()
         await websocket.accept()
-        self.active_connections.setdefault(user_id, []).append(websocket)
-        # Only set default counters if not already set
-        self.pending_counters.setdefault(user_id, {
-            "pending": 0,
-            "approved": 0,
-            "rejected": 0,
-            "flagged": 0
-        })
+        connection = _Connection(websocket, set(statuses) if statuses else None, delta, self.queue_size)
+        connection.task = asyncio.get_running_loop().create_task(self._sender(user_id, connection))
+        self.active_connections.setdefault(user_id, []).append(connection)
 
     def disconnect(self, user_id: str, websocket: WebSocket):
         connections = self.active_connections.get(user_id, [])
-        if websocket in connections:
-            connections.remove(websocket)
+        for connection in [c for c in connections if c.websocket is websocket]:
+            connections.remove(connection)
+            if connection.task is not None:
+                connection.task.cancel()
         if not connections:
             self.active_connections.pop(user_id, None)
-            self.pending_counters.pop(user_id, None)  
-
-    async def send_notification(self, user_id: str, status: str = "pending"):
-        """Send notification to clients when claim status changes."""
-        logger.info(f"Sending notification to user {user_id} for status {status}")
-        
-        self.pending_counters.setdefault(user_id, {
-            "pending": 0,
-            "approved": 0,
-            "rejected": 0,
-            "flagged": 0
-        })
-
-       
-        if status != "pending" and self.pending_counters[user_id]["pending"] > 0:
-            self.pending_counters[user_id]["pending"] -= 1
-
-       
-        self.pending_counters[user_id][status] += 1
-        
-        
-        logger.info(f"Updated counters for user {user_id}: {self.pending_counters[user_id]}")
-
-       
-        await self._broadcast_to_user(user_id, self.pending_counters[user_id])
+
+    async def send_notification(self, user_id: str, status: str = "pending", count: int = 1):
+        """Send notification to clients when claim status changes (count claims at once)."""
+        try:
+            await self.start()
+            counters = await self.broker.notify(user_id, status, count)
+            logger.debug(f"Counters for user {user_id} after {status} x{count}: {counters}")
+            await self._broadcast_to_user(user_id, counters)
+        except Exception as e:
+            # Notifications are best effort; never fail the write that triggered them
+            logger.error(f"Notification to user {user_id} failed: {str(e)}")
 
     async def reset_counter(self, user_id: str, status: str = "pending"):
-        
-        logger.info(f"Resetting counter for user {user_id}, status {status}")
-        
-        self.pending_counters.setdefault(user_id, {
-            "pending": 0,
-            "approved": 0,
-            "rejected": 0,
-            "flagged": 0
-        })[status] = 0
-        
-        await self._broadcast_to_user(user_id, self.pending_counters[user_id])
+        try:
+            await self.start()
+            counters = await self.broker.reset(user_id, status)
+            await self._broadcast_to_user(user_id, counters)
+        except Exception as e:
+            logger.error(f"Counter reset for user {user_id} failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": len(self.active_connections),
+            "connections": sum(len(c) for c in self.active_connections.values()),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "stale": self.stale,
+        }
 
     async def _broadcast_to_user(self, user_id: str, data: dict):
-       
-        message = json.dumps(data)
-        logger.info(f"Broadcasting to user {user_id}: {message}")
-        
-        for ws in self.active_connections.get(user_id, []):
+        # Counters are absolute, so only the latest value in a window needs publishing
+        self._publish.put(user_id, data)
+
+    async def _publish_now(self, user_id: str, data: Dict[str, Any]) -> None:
+        # Through the broker, so sockets held by other workers get it too
+        await self.broker.publish(user_id, data)
+
+    async def _deliver(self, user_id: str, data: Dict[str, Any]) -> None:
+        if user_id not in self.active_connections:
+            return
+        seq = data.get(SEQ_FIELD)
+        if seq is not None:
+            if seq <= self._delivered_seq.get(user_id, -1):
+                self.stale += 1
+                return
+            self._delivered_seq[user_id] = seq
+        self._fan_out.put(user_id, {k: v for k, v in data.items() if k != SEQ_FIELD})
+
+    async def _fan_out_now(self, user_id: str, counters: Dict[str, Any]) -> None:
+        for connection in list(self.active_connections.get(user_id, [])):
+            message = connection.message_for(counters)
+            if message is None:
+                continue
             try:
-                await ws.send_text(message)
-                logger.info(f"Successfully sent to a connection for user {user_id}")
+                connection.queue.put_nowait(json.dumps(message))
+            except asyncio.QueueFull:
+                self._drop(user_id, connection, "send queue full")
+
+    async def _sender(self, user_id: str, connection: _Connection) -> None:
+        while True:
+            message = await connection.queue.get()
+            try:
+                await asyncio.wait_for(connection.websocket.send_text(message), timeout=WS_SEND_TIMEOUT)
+                self.sent += 1
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"Error sending to websocket: {str(e)}")
-                continue 
+                self._drop(user_id, connection, str(e) or type(e).__name__)
+                return
+
+    def _drop(self, user_id: str, connection: _Connection, reason: str) -> None:
+        logger.warning(f"Dropping slow websocket of user {user_id}: {reason}")
+        self.dropped += 1
+        self.disconnect(user_id, connection.websocket)
+        task = asyncio.get_running_loop().create_task(self._close(connection.websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket) -> None:
+        try:
+            # 1013: try again later
+            await asyncio.wait_for(websocket.close(code=1013), timeout=WS_SEND_TIMEOUT)
+        except Exception:
+            pass
 
 manager = WebSocketManager()
 
 
 def run_async(coroutine):
-    
+
     try:
         loop = asyncio.get_event_loop()
     except RuntimeError:
-        
+
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
-    
-    return loop.run_until_complete(coroutine)
\ No newline at end of file
+
+    return loop.run_until_complete(coroutine)